@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+DevAI API Proxy Benchmark
+Drives webapp_api_server.py against fake Ollama backends at fixed
+concurrency levels and fixed arrival rates, and writes latency, TTFT,
+throughput and proxy CPU overhead as JSON so runs can be compared
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+DEPLOYMENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of a process (Linux /proc, or psutil if installed)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import psutil
+        times = psutil.Process(pid).cpu_times()
+        return times.user + times.system
+    except Exception:
+        return None
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        # Linear interpolation between closest ranks
+        pos = (len(ordered) - 1) * q
+        low = int(pos)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+    return {
+        "p50": round(pick(0.50), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2)
+    }
+
+class BenchmarkEnvironment:
+    """Starts fake Ollama backends and the proxy as subprocesses"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.processes: List[subprocess.Popen] = []
+        self.proxy_pid: Optional[int] = args.proxy_pid
+        self.proxy_url = args.proxy_url
+
+    def start(self):
+        if self.proxy_url:
+            print(f"🔗 Using running proxy at {self.proxy_url}")
+            return
+
+        backend_urls = []
+        for i in range(self.args.backends):
+            port = free_port()
+            cmd = [
+                sys.executable, os.path.join(DEPLOYMENT_DIR, "fake_ollama.py"),
+                "--port", str(port),
+                "--tokens", str(self.args.tokens),
+                "--token-delay", str(self.args.token_delay),
+                "--prefill-delay", str(self.args.prefill_delay),
+                "--prefill-per-token", str(self.args.prefill_per_token),
+                "--error-rate", str(self.args.error_rate),
+                "--stream-error-rate", str(self.args.stream_error_rate),
+                "--seed", str(self.args.seed + i),
+                "--models", *self.args.fake_models
+            ]
+            for item in self.args.speedup:
+                cmd += ["--speedup", item]
+            self.processes.append(subprocess.Popen(cmd, stdout=subprocess.DEVNULL))
+            backend_urls.append(f"http://127.0.0.1:{port}")
+
+        for url in backend_urls:
+            wait_until_ready(f"{url}/api/tags")
+        print(f"🧪 Fake Ollama backends: {', '.join(backend_urls)}")
+
+        port = free_port()
+        env = {
+            **os.environ,
+            "DEVAI_OLLAMA_BACKENDS": ",".join(backend_urls),
+            "DEVAI_MAX_CONCURRENT_REQUESTS": str(max(self.args.concurrency + [1]) * self.args.backends),
+            "DEVAI_MAX_QUEUE_DEPTH": "100000",
+        }
+        if self.args.check_recovery:
+            # One slot and a one-deep queue, so a small burst gets rejected
+            env["DEVAI_MAX_CONCURRENT_REQUESTS"] = "1"
+            env["DEVAI_MAX_QUEUE_DEPTH"] = "1"
+        for item in self.args.proxy_env:
+            key, _, value = item.partition("=")
+            env[key] = value
+
+        proxy = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "webapp_api_server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=DEPLOYMENT_DIR, env=env, stdout=subprocess.DEVNULL
+        )
+        self.processes.append(proxy)
+        self.proxy_pid = proxy.pid
+        self.proxy_url = f"http://127.0.0.1:{port}"
+        wait_until_ready(f"{self.proxy_url}/health", timeout=120)
+        print(f"🚀 Proxy running at {self.proxy_url} (pid {proxy.pid})")
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+class LoadGenerator:
+    def __init__(self, args: argparse.Namespace, proxy_url: str):
+        self.args = args
+        self.url = f"{proxy_url}/v1/chat/completions"
+        self._counter = 0
+
+    def next_body(self) -> Dict[str, Any]:
+        self._counter += 1
+        # Unique prompts keep caches and request coalescing out of the measurement
+        question = "Explain how the login flow works" if self.args.repeat_prompts else f"Explain how the login flow works (request {self._counter})"
+        return {
+            "model": self.args.model,
+            "messages": [{"role": "user", "content": question}],
+            "max_tokens": self.args.max_tokens,
+            "temperature": self.args.temperature,
+            "stream": self.args.stream
+        }
+
+    async def one_request(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        body = self.next_body()
+        started = time.perf_counter()
+        ttft = None
+        status = "ok"
+        try:
+            if body["stream"]:
+                async with client.stream("POST", self.url, json=body) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        status = str(response.status_code)
+                    else:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data: {"):
+                                continue
+                            event = json.loads(line[6:])
+                            if "error" in event:
+                                status = "stream_error"
+                            elif ttft is None and event["choices"][0]["delta"].get("content"):
+                                ttft = time.perf_counter() - started
+            else:
+                response = await client.post(self.url, json=body)
+                if response.status_code != 200:
+                    status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+
+        return {"latency": time.perf_counter() - started, "ttft": ttft, "status": status}
+
+    async def closed_loop(self, client: httpx.AsyncClient, concurrency: int, total: int) -> List[Dict[str, Any]]:
+        """Keep `concurrency` requests outstanding until `total` complete"""
+        results = []
+        remaining = total
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                results.append(await self.one_request(client))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results
+
+    async def open_loop(self, client: httpx.AsyncClient, rate: float, duration: float, rng: random.Random) -> List[Dict[str, Any]]:
+        """Poisson arrivals at `rate` requests/sec for `duration` seconds"""
+        tasks = []
+        deadline = time.perf_counter() + duration
+        next_arrival = time.perf_counter()
+        while next_arrival < deadline:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.one_request(client)))
+            next_arrival += rng.expovariate(rate)
+        return await asyncio.gather(*tasks)
+
+def summarize(name: str, params: Dict[str, Any], results: List[Dict[str, Any]], wall_seconds: float, cpu_seconds: Optional[float]) -> Dict[str, Any]:
+    ok = [r for r in results if r["status"] == "ok"]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r["status"] != "ok":
+            errors[r["status"]] = errors.get(r["status"], 0) + 1
+
+    summary = {
+        "name": name,
+        **params,
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "requests_per_second": round(len(ok) / wall_seconds, 2) if wall_seconds else None,
+        "latency_ms": percentiles([r["latency"] * 1000 for r in ok]),
+        "ttft_ms": percentiles([r["ttft"] * 1000 for r in ok if r["ttft"] is not None]),
+        "proxy_cpu_seconds": None,
+        "proxy_cpu_ms_per_request": None,
+        "proxy_cpu_percent": None
+    }
+    if cpu_seconds is not None:
+        summary["proxy_cpu_seconds"] = round(cpu_seconds, 3)
+        summary["proxy_cpu_ms_per_request"] = round(1000 * cpu_seconds / len(results), 3) if results else None
+        summary["proxy_cpu_percent"] = round(100 * cpu_seconds / wall_seconds, 1) if wall_seconds else None
+    return summary
+
+def print_summary(summary: Dict[str, Any]):
+    latency = summary["latency_ms"]
+    ttft = summary["ttft_ms"]
+    print(
+        f"  {summary['name']:<18} ok {summary['ok']:>5}/{summary['requests']:<5} "
+        f"rps {summary['requests_per_second'] or 0:>7.2f}  "
+        f"p50 {latency['p50'] or 0:>8.1f}ms  p95 {latency['p95'] or 0:>8.1f}ms  p99 {latency['p99'] or 0:>8.1f}ms  "
+        f"ttft p50 {ttft['p50'] or 0:>7.1f}ms  "
+        f"cpu/req {summary['proxy_cpu_ms_per_request'] if summary['proxy_cpu_ms_per_request'] is not None else '-'}ms"
+        + (f"  errors {summary['errors']}" if summary["errors"] else "")
+    )
+
+async def run_scenarios(args: argparse.Namespace, env: BenchmarkEnvironment) -> List[Dict[str, Any]]:
+    generator = LoadGenerator(args, env.proxy_url)
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    scenarios = []
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        if args.warmup:
+            print(f"🔥 Warming up with {args.warmup} requests...")
+            await generator.closed_loop(client, min(args.warmup, 4), args.warmup)
+
+        print("📊 Results")
+        for concurrency in args.concurrency:
+            cpu_before = process_cpu_seconds(env.proxy_pid) if env.proxy_pid else None
+            started = time.perf_counter()
+            results = await generator.closed_loop(client, concurrency, args.requests)
+            wall = time.perf_counter() - started
+            cpu_after = process_cpu_seconds(env.proxy_pid) if env.proxy_pid else None
+            cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+            summary = summarize(f"concurrency={concurrency}", {"mode": "closed", "concurrency": concurrency}, results, wall, cpu)
+            print_summary(summary)
+            scenarios.append(summary)
+
+        for rate in args.rates:
+            cpu_before = process_cpu_seconds(env.proxy_pid) if env.proxy_pid else None
+            started = time.perf_counter()
+            results = await generator.open_loop(client, rate, args.duration, rng)
+            wall = time.perf_counter() - started
+            cpu_after = process_cpu_seconds(env.proxy_pid) if env.proxy_pid else None
+            cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+            summary = summarize(f"rate={rate:g}/s", {"mode": "open", "rate": rate, "duration": args.duration}, results, wall, cpu)
+            print_summary(summary)
+            scenarios.append(summary)
+
+    return scenarios
+
+async def check_recovery(args: argparse.Namespace, env: BenchmarkEnvironment, burst: int = 8) -> bool:
+    """Overload the proxy, then require every rejected prompt to be served once load is gone
+
+    Guards against rejected generations staying registered for coalescing,
+    which would keep answering identical prompts with the same 429.
+    """
+    url = f"{env.proxy_url}/v1/chat/completions"
+    bodies = [{
+        "model": args.model,
+        "messages": [{"role": "user", "content": f"Explain how the login flow works (recovery probe {i})"}],
+        "max_tokens": args.max_tokens,
+        # Deterministic, so the generations are registered for coalescing
+        "temperature": 0,
+        "cache": False,
+        "stream": False
+    } for i in range(burst)]
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        responses = await asyncio.gather(*(client.post(url, json=body) for body in bodies))
+        rejected = [body for body, response in zip(bodies, responses) if response.status_code in (429, 503)]
+        print(f"🚦 Burst of {burst}: {len(rejected)} rejected")
+        if not rejected:
+            print("❌ Nothing was rejected; the recovery check needs an overloaded proxy")
+            return False
+
+        retried = [(await client.post(url, json=body)).status_code for body in rejected]
+        in_flight = (await client.get(f"{env.proxy_url}/health")).json()["single_flight"]["in_flight"]
+
+    recovered = all(status == 200 for status in retried) and in_flight == 0
+    print(f"{'✅' if recovered else '❌'} Rejected prompts retried when idle: statuses {sorted(set(retried))}, {in_flight} generation(s) still in flight")
+    return recovered
+
+def compare(results: Dict[str, Any], baseline_path: str, threshold: float) -> bool:
+    """Print deltas against a previous run; returns False if anything regressed"""
+    with open(baseline_path) as f:
+        baseline = {s["name"]: s for s in json.load(f)["scenarios"]}
+
+    print(f"\n🔍 Comparison against {baseline_path} (regression threshold {threshold:.0%})")
+    ok = True
+    # (metric path, higher is better)
+    checks = [
+        (("latency_ms", "p95"), False),
+        (("latency_ms", "p99"), False),
+        (("ttft_ms", "p95"), False),
+        (("requests_per_second",), True),
+        (("proxy_cpu_ms_per_request",), False),
+    ]
+    for scenario in results["scenarios"]:
+        before = baseline.get(scenario["name"])
+        if before is None:
+            continue
+        for path, higher_is_better in checks:
+            old, new = before, scenario
+            for key in path:
+                old = old.get(key) if isinstance(old, dict) else None
+                new = new.get(key) if isinstance(new, dict) else None
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change < -threshold if higher_is_better else change > threshold
+            marker = "❌" if regressed else "  "
+            print(f"  {marker} {scenario['name']:<18} {'.'.join(path):<26} {old:>10} -> {new:<10} ({change:+.1%})")
+            ok = ok and not regressed
+    return ok
+
+def parse_list(value: str, cast) -> list:
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DevAI API proxy against fake Ollama backends")
+    parser.add_argument("--concurrency", type=lambda v: parse_list(v, int), default=[1, 4, 16], help="Closed-loop concurrency levels, e.g. 1,4,16")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--rates", type=lambda v: parse_list(v, float), default=[], help="Open-loop arrival rates in requests/sec, e.g. 5,10,20")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per arrival-rate scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="Warm-up requests before measuring")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True, help="Use streaming requests (needed for TTFT)")
+    parser.add_argument("--repeat-prompts", action="store_true", help="Send the same prompt every time to exercise caches and coalescing (coalescing needs --temperature 0)")
+    parser.add_argument("--model", default="devai-assistant")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request")
+    parser.add_argument("--seed", type=int, default=0)
+
+    fake = parser.add_argument_group("fake Ollama")
+    fake.add_argument("--backends", type=int, default=1, help="Number of fake Ollama processes")
+    fake.add_argument("--fake-models", nargs="+", default=["devai-assistant:starcoder"], help="Model names served by the fake backends")
+    fake.add_argument("--speedup", action="append", default=[], metavar="MODEL=FACTOR", help="Make a fake model FACTOR times faster, e.g. to compare routes")
+    fake.add_argument("--tokens", type=int, default=64, help="Maximum tokens generated per request")
+    fake.add_argument("--token-delay", type=float, default=0.01, help="Seconds per generated token")
+    fake.add_argument("--prefill-delay", type=float, default=0.05, help="Seconds before the first token")
+    fake.add_argument("--prefill-per-token", type=float, default=0.0, help="Extra prefill seconds per prompt token")
+    fake.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with HTTP 500")
+    fake.add_argument("--stream-error-rate", type=float, default=0.0, help="Fraction of requests failing mid-generation")
+
+    proxy = parser.add_argument_group("proxy")
+    proxy.add_argument("--proxy-url", help="Benchmark an already running proxy instead of starting one")
+    proxy.add_argument("--proxy-pid", type=int, help="PID of the running proxy, for CPU accounting")
+    proxy.add_argument("--proxy-env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment for the spawned proxy")
+
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--regression-threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    parser.add_argument("--check-recovery", action="store_true", help="Only check that prompts rejected under overload are served once load stops")
+    args = parser.parse_args()
+
+    print("⏱️ DevAI API Proxy Benchmark")
+    print("=" * 50)
+
+    env = BenchmarkEnvironment(args)
+    try:
+        env.start()
+        if args.check_recovery:
+            sys.exit(0 if asyncio.run(check_recovery(args, env)) else 1)
+        scenarios = asyncio.run(run_scenarios(args, env))
+    finally:
+        env.stop()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+        },
+        "scenarios": scenarios
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.regression_threshold):
+        print("\n❌ Regressions detected")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Fake Ollama server for benchmarking the DevAI API proxy
+Implements the parts of the Ollama API that webapp_api_server.py uses, with
+configurable prefill/decode timing and error injection - no GPU needed
+"""
+
+import json
+import random
+import asyncio
+import argparse
+import hashlib
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+WORDS = ["the", "login", "function", "checks", "token", "and", "returns", "user", "session", "handler", "auth", "route"]
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+    rng = random.Random(args.seed)
+    stats = {"generate_requests": 0, "embedding_requests": 0, "errors_injected": 0, "active": 0, "max_active": 0}
+    # Per-model speed factors, so a small model can be made faster than the default
+    speedups = {name: float(factor) for name, _, factor in (item.partition("=") for item in args.speedup)}
+
+    def generation_length(options: Dict[str, Any]) -> int:
+        num_predict = options.get("num_predict") or args.tokens
+        return max(1, min(int(num_predict), args.tokens))
+
+    def prefill_seconds(body: Dict[str, Any]) -> float:
+        # Only the new prompt needs prefill when a context array is passed
+        prompt_tokens = len(body.get("prompt", "")) / 4
+        return (args.prefill_delay + prompt_tokens * args.prefill_per_token) / speedups.get(body.get("model"), 1.0)
+
+    def final_chunk(body: Dict[str, Any], count: int, decode_seconds: float) -> Dict[str, Any]:
+        return {
+            "model": body.get("model"),
+            "response": "",
+            "done": True,
+            "done_reason": "length" if count >= generation_length(body.get("options", {})) else "stop",
+            "context": list(range(len(body.get("context") or []) + count + 8)),
+            "prompt_eval_count": int(len(body.get("prompt", "")) / 4),
+            "eval_count": count,
+            "eval_duration": int(decode_seconds * 1e9)
+        }
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": name, "size": 0, "modified_at": "2024-01-01T00:00:00Z"} for name in args.models]}
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "fake"}
+
+    @app.get("/fake/stats")
+    async def fake_stats():
+        return stats
+
+    @app.post("/api/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        stats["embedding_requests"] += 1
+        digest = hashlib.sha256(body.get("prompt", "").encode()).digest()
+        return {"embedding": [b / 255.0 - 0.5 for b in digest]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        stats["generate_requests"] += 1
+
+        if body.get("model") not in args.models:
+            return JSONResponse({"error": f"model '{body.get('model')}' not found"}, status_code=404)
+
+        if rng.random() < args.error_rate:
+            stats["errors_injected"] += 1
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+
+        count = generation_length(body.get("options", {}))
+        token_delay = args.token_delay / speedups.get(body.get("model"), 1.0)
+        fail_mid_stream = rng.random() < args.stream_error_rate
+
+        async def tokens():
+            stats["active"] += 1
+            stats["max_active"] = max(stats["max_active"], stats["active"])
+            try:
+                await asyncio.sleep(prefill_seconds(body))
+                for i in range(count):
+                    if fail_mid_stream and i == count // 2:
+                        stats["errors_injected"] += 1
+                        yield {"error": "injected mid-stream failure"}
+                        return
+                    await asyncio.sleep(token_delay)
+                    yield {"model": body.get("model"), "response": f" {WORDS[i % len(WORDS)]}", "done": False}
+            finally:
+                stats["active"] -= 1
+
+        if body.get("stream", True):
+            async def ndjson():
+                sent = 0
+                async for chunk in tokens():
+                    yield json.dumps(chunk) + "\n"
+                    if "error" in chunk:
+                        return
+                    sent += 1
+                yield json.dumps(final_chunk(body, sent, sent * token_delay)) + "\n"
+            return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+        parts = []
+        async for chunk in tokens():
+            if "error" in chunk:
+                return JSONResponse(chunk, status_code=500)
+            parts.append(chunk["response"])
+        return {**final_chunk(body, len(parts), len(parts) * token_delay), "response": "".join(parts)}
+
+    return app
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake Ollama server for proxy benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", nargs="+", default=["devai-assistant:starcoder"], help="Model names reported by /api/tags")
+    parser.add_argument("--tokens", type=int, default=64, help="Maximum tokens generated per request")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds per generated token")
+    parser.add_argument("--prefill-delay", type=float, default=0.05, help="Fixed seconds before the first token")
+    parser.add_argument("--prefill-per-token", type=float, default=0.0, help="Extra prefill seconds per prompt token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with HTTP 500")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="Fraction of requests failing mid-generation")
+    parser.add_argument("--speedup", action="append", default=[], metavar="MODEL=FACTOR", help="Make a model's prefill and decode FACTOR times faster")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"🧪 Fake Ollama on http://{args.host}:{args.port} serving {', '.join(args.models)}")
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,108 @@
+"""
+Fixtures running fake Ollama backends and the proxy as subprocesses, the
+same way benchmark_proxy.py does, so tests drive the real HTTP paths
+"""
+
+import os
+import sys
+import time
+import subprocess
+from typing import Dict, List
+
+import httpx
+import pytest
+
+DEPLOYMENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DEPLOYMENT_DIR)
+
+from benchmark_proxy import free_port, wait_until_ready  # noqa: E402
+
+MODEL = "devai-assistant:starcoder"
+
+def stop_process(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def wait_for(condition, timeout: float = 15.0, interval: float = 0.1):
+    """Poll condition() until it returns something truthy; fails the test on timeout"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(interval)
+    pytest.fail(f"Timed out after {timeout}s waiting for {getattr(condition, '__name__', 'condition')}")
+
+class FakeOllama:
+    """One fake_ollama.py process; stop() and start() again keep the same port"""
+
+    def __init__(self, args: List[str]):
+        self.args = args
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = None
+
+    def start(self) -> "FakeOllama":
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(DEPLOYMENT_DIR, "fake_ollama.py"), "--port", str(self.port), *self.args],
+            stdout=subprocess.DEVNULL
+        )
+        wait_until_ready(f"{self.url}/api/tags")
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            stop_process(self.process)
+            self.process = None
+
+    def stats(self) -> Dict[str, int]:
+        return httpx.get(f"{self.url}/fake/stats").json()
+
+@pytest.fixture
+def fake_ollama():
+    """Start fake Ollama backends: fake_ollama("--token-delay", "0.05", ...)"""
+    backends: List[FakeOllama] = []
+
+    def start(*args: str) -> FakeOllama:
+        backend = FakeOllama(list(args)).start()
+        backends.append(backend)
+        return backend
+
+    yield start
+    for backend in backends:
+        backend.stop()
+
+@pytest.fixture
+def proxy():
+    """Start webapp_api_server.py against backends: proxy([backend, ...], DEVAI_...="...")"""
+    processes: List[subprocess.Popen] = []
+
+    def start(backends: List[FakeOllama], **env: str) -> str:
+        port = free_port()
+        proxy_env = {
+            **os.environ,
+            "DEVAI_OLLAMA_BACKENDS": ",".join(b.url for b in backends),
+            # No tokenizer download; token counts fall back to estimates
+            "DEVAI_TOKENIZER_PATH": os.path.join(DEPLOYMENT_DIR, "missing-tokenizer"),
+            "HF_HUB_OFFLINE": "1",
+            **env
+        }
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "webapp_api_server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=DEPLOYMENT_DIR, env=proxy_env, stdout=subprocess.DEVNULL
+        ))
+        url = f"http://127.0.0.1:{port}"
+        wait_until_ready(f"{url}/health", timeout=120)
+        return url
+
+    yield start
+    for process in processes:
+        stop_process(process)
+
+def chat(url: str, content: str, **fields) -> httpx.Response:
+    body = {"model": "devai-assistant", "messages": [{"role": "user", "content": content}], "max_tokens": 8, **fields}
+    return httpx.post(f"{url}/v1/chat/completions", json=body, timeout=30)
@@ -0,0 +1,59 @@
+"""Backend pool routing, passive ejection and probe reinstatement against two fake backends"""
+
+import threading
+
+import httpx
+
+from conftest import chat, wait_for
+
+def backend_stats(url: str):
+    return {b["url"]: b for b in httpx.get(f"{url}/health").json()["backends"]}
+
+def test_routes_to_least_outstanding_backend(fake_ollama, proxy):
+    # 40 tokens at 0.1s keep the first request in flight for ~4s
+    first = fake_ollama("--tokens", "40", "--token-delay", "0.1")
+    second = fake_ollama("--tokens", "40", "--token-delay", "0.1")
+    url = proxy([first, second])
+
+    long_request = threading.Thread(target=chat, args=(url, "long request"), kwargs={"max_tokens": 40})
+    long_request.start()
+    busy = wait_for(lambda: next((b for b in (first, second) if b.stats()["active"]), None))
+    idle = second if busy is first else first
+
+    for i in range(3):
+        assert chat(url, f"short request {i}", max_tokens=1).status_code == 200
+    long_request.join()
+
+    assert busy.stats()["generate_requests"] == 1
+    assert idle.stats()["generate_requests"] == 3
+
+def test_ejects_backend_after_consecutive_failures(fake_ollama, proxy):
+    failing = fake_ollama("--tokens", "4", "--error-rate", "1")
+    working = fake_ollama("--tokens", "4")
+    # Probes would reinstate the failing backend (its /api/tags works), so keep them out
+    url = proxy([failing, working], DEVAI_BACKEND_MAX_FAILURES="2", DEVAI_BACKEND_PROBE_INTERVAL_SECONDS="3600")
+
+    statuses = [chat(url, f"request {i}").status_code for i in range(8)]
+
+    assert failing.stats()["generate_requests"] == 2
+    assert statuses.count(500) == 2
+    assert statuses.count(200) == 6
+    stats = backend_stats(url)
+    assert not stats[failing.url]["healthy"]
+    assert stats[working.url]["healthy"]
+
+def test_reinstates_backend_after_successful_probe(fake_ollama, proxy):
+    flaky = fake_ollama("--tokens", "4")
+    working = fake_ollama("--tokens", "4")
+    url = proxy([flaky, working], DEVAI_BACKEND_MAX_FAILURES="2", DEVAI_BACKEND_PROBE_INTERVAL_SECONDS="0.3")
+
+    flaky.stop()
+    wait_for(lambda: not backend_stats(url)[flaky.url]["healthy"])
+    assert chat(url, "while ejected").status_code == 200
+
+    flaky.start()
+    wait_for(lambda: backend_stats(url)[flaky.url]["healthy"])
+    # Both idle again, so ties rotate and the reinstated backend gets traffic
+    for i in range(4):
+        assert chat(url, f"after reinstatement {i}").status_code == 200
+    assert flaky.stats()["generate_requests"] >= 1
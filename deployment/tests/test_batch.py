@@ -0,0 +1,10 @@
+"""Batch upload validation"""
+
+import httpx
+
+def test_non_utf8_upload_is_rejected_with_400(fake_ollama, proxy):
+    url = proxy([fake_ollama("--tokens", "4")])
+    body = b'{"id": "1", "messages": [{"role": "user", "content": "hi"}]}\n{"id": "2", "content": "caf\xe9"}\n'
+    response = httpx.post(f"{url}/v1/batch", content=body, timeout=30)
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Line 2: not valid UTF-8")
@@ -0,0 +1,41 @@
+"""Model registry behaviour when Ollama backends go away"""
+
+import httpx
+
+from conftest import MODEL, chat, wait_for
+
+def backends_healthy(url: str):
+    return [b["healthy"] for b in httpx.get(f"{url}/health").json()["backends"]]
+
+def test_outage_returns_503_not_404(fake_ollama, proxy):
+    backend = fake_ollama("--tokens", "4")
+    url = proxy([backend], DEVAI_BACKEND_PROBE_INTERVAL_SECONDS="0.2", DEVAI_BACKEND_MAX_FAILURES="2")
+    assert chat(url, "hello").status_code == 200
+
+    backend.stop()
+    wait_for(lambda: backends_healthy(url) == [False])
+    response = chat(url, "hello")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    # The snapshot still lists what the backend last reported
+    assert MODEL in [m["id"] for m in httpx.get(f"{url}/v1/models").json()["data"]]
+
+    backend.start()
+    wait_for(lambda: backends_healthy(url) == [True])
+    assert chat(url, "hello").status_code == 200
+
+def test_failed_probe_keeps_last_known_models(fake_ollama, proxy):
+    backend = fake_ollama("--tokens", "4")
+    # Never ejected, so requests still reach the dead backend after its probes fail
+    url = proxy([backend], DEVAI_BACKEND_PROBE_INTERVAL_SECONDS="0.2", DEVAI_BACKEND_MAX_FAILURES="1000")
+
+    backend.stop()
+    wait_for(lambda: httpx.get(f"{url}/health").json()["backends"][0]["consecutive_failures"] >= 2)
+    response = chat(url, "hello")
+    assert response.status_code != 404, response.text
+
+def test_unknown_model_is_404(fake_ollama, proxy):
+    backend = fake_ollama("--tokens", "4")
+    url = proxy([backend])
+    response = chat(url, "hello", model="no-such-model")
+    assert response.status_code == 404
@@ -0,0 +1,109 @@
+"""Request coalescing: shared generations, late-joiner replay and stream cleanup"""
+
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import webapp_api_server as server
+from conftest import chat, wait_for
+
+def stream_text(url: str, content: str, **fields) -> str:
+    body = {"model": "devai-assistant", "messages": [{"role": "user", "content": content}], "max_tokens": 20, "stream": True, **fields}
+    parts = []
+    with httpx.stream("POST", f"{url}/v1/chat/completions", json=body, timeout=30) as response:
+        assert response.status_code == 200
+        for line in response.iter_lines():
+            if line.startswith("data: ") and line != "data: [DONE]":
+                delta = json.loads(line[len("data: "):])["choices"][0]["delta"]
+                parts.append(delta.get("content", ""))
+    return "".join(parts)
+
+def in_flight_requests(url: str) -> float:
+    for line in httpx.get(f"{url}/metrics").text.splitlines():
+        if line.startswith("devai_in_flight_requests"):
+            return float(line.split()[-1])
+    raise AssertionError("devai_in_flight_requests missing from /metrics")
+
+def test_identical_deterministic_requests_share_one_generation(fake_ollama, proxy):
+    backend = fake_ollama("--tokens", "10", "--token-delay", "0.05")
+    url = proxy([backend])
+
+    with ThreadPoolExecutor(5) as pool:
+        responses = list(pool.map(lambda _: chat(url, "same question", temperature=0, cache=False), range(5)))
+
+    assert [r.status_code for r in responses] == [200] * 5
+    assert len({r.json()["choices"][0]["message"]["content"] for r in responses}) == 1
+    assert backend.stats()["generate_requests"] == 1
+
+def test_sampled_requests_are_not_coalesced(fake_ollama, proxy):
+    backend = fake_ollama("--tokens", "10", "--token-delay", "0.05")
+    url = proxy([backend])
+
+    with ThreadPoolExecutor(3) as pool:
+        responses = list(pool.map(lambda _: chat(url, "same question", temperature=0.7), range(3)))
+
+    assert [r.status_code for r in responses] == [200] * 3
+    assert backend.stats()["generate_requests"] == 3
+
+def test_late_stream_joiner_gets_the_full_text(fake_ollama, proxy):
+    backend = fake_ollama("--tokens", "20", "--token-delay", "0.1", "--prefill-delay", "0")
+    url = proxy([backend])
+
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(stream_text, url, "same question", temperature=0, cache=False)
+        # Join once about half the tokens have been generated
+        time.sleep(1.0)
+        late = pool.submit(stream_text, url, "same question", temperature=0, cache=False)
+        first_text, late_text = first.result(), late.result()
+
+    assert backend.stats()["generate_requests"] == 1
+    assert first_text and late_text == first_text
+    assert len(first_text.split()) == 20
+
+def test_stream_abandoned_before_its_body_starts_is_released(fake_ollama, proxy):
+    # The client gives up during prefill, before the proxy sends anything
+    backend = fake_ollama("--tokens", "40", "--token-delay", "0.1", "--prefill-delay", "1.0")
+    url = proxy([backend])
+    body = {"model": "devai-assistant", "messages": [{"role": "user", "content": "abandoned"}], "max_tokens": 40, "stream": True}
+    try:
+        httpx.post(f"{url}/v1/chat/completions", json=body, timeout=0.3)
+    except httpx.TimeoutException:
+        pass
+
+    # Released well before the 4s generation would have finished on its own
+    wait_for(lambda: in_flight_requests(url) == 0, timeout=3.0)
+    wait_for(lambda: backend.stats()["active"] == 0, timeout=3.0)
+    assert httpx.get(f"{url}/health").json()["single_flight"]["in_flight"] == 0
+
+def test_stream_release_does_not_depend_on_the_body_running():
+    class Generation:
+        left = 0
+
+        def leave(self):
+            self.left += 1
+
+    async def body():
+        yield "data: never sent\n\n"
+
+    async def send(message):
+        # The client is gone before the response starts
+        raise OSError("connection reset")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    generation, tracker = Generation(), server.RequestTracker()
+    response = server.ReleasingStreamingResponse(body(), on_close=lambda: server.release_stream(generation, tracker))
+    try:
+        asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send))
+    except Exception:
+        pass
+
+    assert generation.left == 1
+    assert tracker.finished
+    # The generator's own cleanup running later must not leave twice
+    server.release_stream(generation, tracker, "200")
+    assert generation.left == 1
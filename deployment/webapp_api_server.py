@@ -5,18 +5,39 @@ Simple FastAPI server that your existing webapp can connect to
 """
 
 import os
+import json
 import time
 import httpx
 import asyncio
-from typing import List, Dict, Any, Optional
+import bisect
+import hashlib
+import math
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 import uvicorn
 
+# Optional NumPy support for the semantic response cache
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Optional tokenizer support for exact token accounting
+try:
+    from transformers import AutoTokenizer
+    TOKENIZER_AVAILABLE = True
+except ImportError:
+    TOKENIZER_AVAILABLE = False
+
 # Pydantic models for OpenAI-compatible API
 class ChatMessage(BaseModel):
     role: str = Field(..., description="Role: 'user' or 'assistant'")
@@ -28,6 +49,9 @@ class ChatCompletionRequest(BaseModel):
     temperature: Optional[float] = Field(default=0.7, ge=0, le=2)
     max_tokens: Optional[int] = Field(default=2048, ge=1, le=4000)
     stream: Optional[bool] = Field(default=False)
+    cache: Optional[bool] = Field(default=None, description="Force response caching on/off (default: only when temperature is 0)")
+    session_id: Optional[str] = Field(default=None, max_length=128, description="Reuse the previous turn's model context for this conversation")
+    repo: Optional[str] = Field(default=None, max_length=256, description="Repository the conversation is about; scopes the semantic cache")
 
 class ChatCompletionResponse(BaseModel):
     id: str
@@ -37,37 +61,1048 @@ class ChatCompletionResponse(BaseModel):
     choices: List[Dict[str, Any]]
     usage: Dict[str, int]
 
-# Global HTTP client for Ollama
-ollama_client = None
+# Prometheus-style metrics
+# Series are plain lists/floats keyed by label tuples so recording on the
+# request path is a dict lookup and an in-place update.
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+    
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+    
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, read=None):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+        # Optional callable sampled at scrape time instead of a stored value
+        self._read = read
+    
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+    
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+    
+    def collect(self) -> List[str]:
+        value = self._read() if self._read else self.value
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...], labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # Per series: [count per bucket..., count above last bucket, sum, total count]
+        self._series: Dict[tuple, list] = {}
+    
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+    
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = format_labels(self.labelnames + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{series_labels} {series[-2]}")
+            lines.append(f"{self.name}_count{series_labels} {series[-1]}")
+        return lines
+
+def format_labels(names: Tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TTFT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+REQUEST_LATENCY = Histogram("devai_request_duration_seconds", "End-to-end chat completion latency", LATENCY_BUCKETS, ("model",))
+UPSTREAM_LATENCY = Histogram("devai_upstream_duration_seconds", "Time spent waiting on Ollama per generation", LATENCY_BUCKETS, ("model", "backend"))
+TIME_TO_FIRST_TOKEN = Histogram("devai_time_to_first_token_seconds", "Time from request arrival to the first streamed token", TTFT_BUCKETS, ("model",))
+TOKENS_PER_SECOND = Histogram("devai_tokens_per_second", "Decode throughput reported by Ollama", TOKENS_PER_SECOND_BUCKETS, ("model",))
+REQUESTS_TOTAL = Counter("devai_requests_total", "Chat completion requests by outcome", ("model", "status"))
+ERRORS_TOTAL = Counter("devai_errors_total", "Chat completion requests that failed", ("model", "status"))
+CANCELLATIONS_TOTAL = Counter("devai_cancellations_total", "Chat completion requests abandoned by the client", ("model",))
+IN_FLIGHT_REQUESTS = Gauge("devai_in_flight_requests", "Chat completion requests currently being handled")
+ROUTE_REQUESTS_TOTAL = Counter("devai_route_requests_total", "Chat completion requests by routing rule and outcome", ("route", "model", "status"))
+ROUTE_LATENCY = Histogram("devai_route_duration_seconds", "End-to-end chat completion latency by routing rule", LATENCY_BUCKETS, ("route",))
+ROUTE_TIME_TO_FIRST_TOKEN = Histogram("devai_route_time_to_first_token_seconds", "Time to the first streamed token by routing rule", TTFT_BUCKETS, ("route",))
+ROUTE_TOKENS_PER_SECOND = Histogram("devai_route_tokens_per_second", "Decode throughput reported by Ollama by routing rule", TOKENS_PER_SECOND_BUCKETS, ("route",))
+
+class RequestTracker:
+    """Records latency and outcome metrics for one chat completion"""
+    
+    __slots__ = ("model", "route", "started", "first_token_at", "finished", "deferred")
+    
+    def __init__(self):
+        self.model = "unknown"
+        self.route = "none"
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished = False
+        # Set when a streaming response takes over finishing the request
+        self.deferred = False
+        IN_FLIGHT_REQUESTS.inc()
+    
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            TIME_TO_FIRST_TOKEN.observe(self.first_token_at - self.started, self.model)
+            ROUTE_TIME_TO_FIRST_TOKEN.observe(self.first_token_at - self.started, self.route)
+    
+    def finish(self, status: str):
+        if self.finished:
+            return
+        self.finished = True
+        IN_FLIGHT_REQUESTS.dec()
+        REQUESTS_TOTAL.inc(self.model, status)
+        REQUEST_LATENCY.observe(time.perf_counter() - self.started, self.model)
+        ROUTE_REQUESTS_TOTAL.inc(self.route, self.model, status)
+        ROUTE_LATENCY.observe(time.perf_counter() - self.started, self.route)
+        if status[0] in "45":
+            ERRORS_TOTAL.inc(self.model, status)
+    
+    def cancel(self):
+        if self.finished:
+            return
+        self.finished = True
+        IN_FLIGHT_REQUESTS.dec()
+        REQUESTS_TOTAL.inc(self.model, "cancelled")
+        ROUTE_REQUESTS_TOTAL.inc(self.route, self.model, "cancelled")
+        CANCELLATIONS_TOTAL.inc(self.model)
+
+# Response cache settings
+CACHE_MAX_ENTRIES = int(os.getenv("DEVAI_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("DEVAI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv("DEVAI_CACHE_TTL_SECONDS", "600"))
+
+class ResponseCache:
+    """In-memory LRU cache of completed generations with a TTL
+    
+    Bounded both by entry count and by the total size of cached content.
+    """
+    
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def make_key(model: str, prompt: str, options: Dict[str, Any]) -> str:
+        # Normalize line endings and surrounding whitespace so trivially
+        # different submissions of the same question share an entry
+        normalized = "\n".join(line.rstrip() for line in prompt.replace("\r\n", "\n").strip().split("\n"))
+        raw = json.dumps({"model": model, "prompt": normalized, "options": options}, sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def put(self, key: str, value: Dict[str, Any]):
+        size = len(key) + len(value.get("content", "").encode())
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        
+        if key in self._entries:
+            self._remove(key)
+        
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+        self._bytes += size
+        
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+    
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+
+# Admission control settings
+MAX_CONCURRENT_REQUESTS = int(os.getenv("DEVAI_MAX_CONCURRENT_REQUESTS", "4"))
+MAX_QUEUE_DEPTH = int(os.getenv("DEVAI_MAX_QUEUE_DEPTH", "32"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("DEVAI_QUEUE_TIMEOUT_SECONDS", "30"))
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted to the upstream model"""
+    
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Bounded concurrency limiter with a FIFO wait queue
+    
+    At most max_concurrent requests talk to Ollama at once. Up to max_queue
+    further requests wait in arrival order; beyond that, requests are
+    rejected immediately instead of piling up behind the upstream timeout.
+    """
+    
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: "OrderedDict[int, asyncio.Future]" = OrderedDict()
+        self._next_ticket = 0
+        # Exponentially weighted average of how long a slot is held, used
+        # to estimate Retry-After
+        self._avg_service_seconds = 5.0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+    
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+    
+    def retry_after(self) -> int:
+        backlog = self.queue_depth + 1
+        return max(1, math.ceil(backlog * self._avg_service_seconds / max(self.max_concurrent, 1)))
+    
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the time the slot was granted"""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return time.monotonic()
+        
+        if self.queue_depth >= self.max_queue:
+            self.rejected_full += 1
+            raise AdmissionRejected(429, "Server busy: request queue is full", self.retry_after())
+        
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[ticket] = future
+        
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done():
+                # The slot was handed over just as the wait expired
+                self.admitted += 1
+                return time.monotonic()
+            self._waiters.pop(ticket, None)
+            self.rejected_timeout += 1
+            raise AdmissionRejected(503, "Server overloaded: timed out waiting in queue", self.retry_after())
+        except asyncio.CancelledError:
+            # Client went away while queued; give the slot back if we got it
+            if self._waiters.pop(ticket, None) is None and future.done():
+                self.release()
+            raise
+        
+        self.admitted += 1
+        return time.monotonic()
+    
+    def release(self, started_at: Optional[float] = None):
+        """Hand the slot to the next waiter in FIFO order, or free it"""
+        if started_at is not None:
+            held = time.monotonic() - started_at
+            self._avg_service_seconds = 0.8 * self._avg_service_seconds + 0.2 * held
+        
+        while self._waiters:
+            _, future = self._waiters.popitem(last=False)
+            if not future.done():
+                future.set_result(None)
+                return
+        
+        self.active -= 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.queue_depth,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_queue_timeout": self.rejected_timeout,
+            "avg_service_seconds": round(self._avg_service_seconds, 3)
+        }
+
+admission = AdmissionController(MAX_CONCURRENT_REQUESTS, MAX_QUEUE_DEPTH, QUEUE_TIMEOUT_SECONDS)
+
+QUEUE_DEPTH = Gauge("devai_queue_depth", "Requests waiting for an admission slot", read=lambda: admission.queue_depth)
+ACTIVE_GENERATIONS = Gauge("devai_active_generations", "Requests holding an admission slot", read=lambda: admission.active)
+
+# Ollama backend pool settings
+OLLAMA_BACKENDS = [
+    url.strip() for url in os.getenv("DEVAI_OLLAMA_BACKENDS", "http://localhost:11434").split(",")
+    if url.strip()
+]
+OLLAMA_TIMEOUT_SECONDS = float(os.getenv("DEVAI_OLLAMA_TIMEOUT_SECONDS", "60"))
+BACKEND_MAX_FAILURES = int(os.getenv("DEVAI_BACKEND_MAX_FAILURES", "3"))
+BACKEND_PROBE_INTERVAL_SECONDS = float(os.getenv("DEVAI_BACKEND_PROBE_INTERVAL_SECONDS", "5"))
+
+class NoHealthyBackend(Exception):
+    """Raised when every Ollama backend is ejected or unreachable"""
+
+class OllamaBackend:
+    """A single Ollama server and its health bookkeeping"""
+    
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.client = httpx.AsyncClient(base_url=url, timeout=timeout)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.total_requests = 0
+        self.total_failures = 0
+        self.last_error: Optional[str] = None
+        # Model names reported by the last successful probe; None until known
+        self.models: Optional[set] = None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "models": sorted(self.models) if self.models is not None else None,
+            "in_flight": self.in_flight,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+            "last_error": self.last_error
+        }
+
+class BackendPool:
+    """Routes requests to the healthy Ollama backend with the fewest in-flight requests
+    
+    Backends are ejected after max_failures consecutive failures (passive
+    health checking) and reinstated once an active probe succeeds.
+    """
+    
+    def __init__(self, urls: List[str], timeout: float, max_failures: int):
+        self.backends = [OllamaBackend(url, timeout) for url in urls]
+        self.max_failures = max_failures
+        self._rotation = 0
+    
+    def healthy_backends(self) -> List[OllamaBackend]:
+        return [b for b in self.backends if b.healthy]
+    
+    def acquire(self, exclude: Optional[set] = None, model: Optional[str] = None, preferred: Optional[str] = None) -> OllamaBackend:
+        """Pick the least-loaded candidate backend
+        
+        A preferred backend (e.g. the one holding a session's KV cache) wins
+        as long as it is at most one request busier than the least loaded.
+        """
+        candidates = [
+            b for b in self.healthy_backends()
+            if (not exclude or b.url not in exclude)
+            and (model is None or b.models is None or model in b.models)
+        ]
+        if not candidates:
+            raise NoHealthyBackend("No healthy Ollama backend available")
+        
+        least_loaded = min(b.in_flight for b in candidates)
+        for b in candidates:
+            if b.url == preferred and b.in_flight <= least_loaded + 1:
+                b.in_flight += 1
+                b.total_requests += 1
+                return b
+        
+        # Rotate the starting point so ties don't always land on the first backend
+        self._rotation += 1
+        count = len(candidates)
+        backend = min(
+            enumerate(candidates),
+            key=lambda item: (item[1].in_flight, (item[0] - self._rotation) % count)
+        )[1]
+        backend.in_flight += 1
+        backend.total_requests += 1
+        return backend
+    
+    def release(self, backend: OllamaBackend, ok: bool, error: Optional[str] = None):
+        backend.in_flight -= 1
+        self.record(backend, ok, error)
+    
+    def record(self, backend: OllamaBackend, ok: bool, error: Optional[str] = None):
+        if ok:
+            backend.consecutive_failures = 0
+            return
+        
+        backend.consecutive_failures += 1
+        backend.total_failures += 1
+        backend.last_error = error
+        if backend.healthy and backend.consecutive_failures >= self.max_failures:
+            backend.healthy = False
+            print(f"🔌 Ejected Ollama backend {backend.url} after {backend.consecutive_failures} failures: {error}")
+    
+    async def probe(self, backend: OllamaBackend) -> Optional[List[Dict[str, Any]]]:
+        """Actively check a backend via /api/tags
+        
+        Reinstates the backend on success and returns its model list.
+        """
+        try:
+            response = await backend.client.get("/api/tags")
+            if response.status_code != 200:
+                self.record(backend, False, f"HTTP {response.status_code}")
+                return None
+            models = response.json().get("models", [])
+        except (httpx.HTTPError, ValueError) as e:
+            self.record(backend, False, str(e) or type(e).__name__)
+            return None
+        
+        if not backend.healthy:
+            print(f"🔌 Reinstated Ollama backend {backend.url}")
+        backend.healthy = True
+        backend.consecutive_failures = 0
+        backend.models = {m.get("name") for m in models if m.get("name")}
+        return models
+    
+    async def aclose(self):
+        await asyncio.gather(*(b.client.aclose() for b in self.backends))
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        return [b.stats() for b in self.backends]
+
+backend_pool: Optional[BackendPool] = None
+
+# Model registry settings
+DEFAULT_MODEL = os.getenv("DEVAI_DEFAULT_MODEL", "devai-assistant:starcoder")
+MODEL_ALIASES = {"devai-assistant": DEFAULT_MODEL, "auto": DEFAULT_MODEL}
+MODEL_REFRESH_INTERVAL_SECONDS = float(os.getenv("DEVAI_MODEL_REFRESH_INTERVAL_SECONDS", str(BACKEND_PROBE_INTERVAL_SECONDS)))
+
+class ModelRegistry:
+    """Background-refreshed snapshot of the models served by the backend pool
+    
+    Each refresh probes every backend once (which also drives ejection and
+    reinstatement in the pool) and swaps in a new snapshot, so request
+    handlers read model availability without calling Ollama. A backend whose
+    probe fails keeps its last known models, so an outage surfaces as 503
+    from the pool rather than as unknown models.
+    """
+    
+    def __init__(self, pool: BackendPool, refresh_interval: float):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self.refreshed_at: Optional[float] = None
+        self._refreshed_monotonic: Optional[float] = None
+        self.refresh_count = 0
+    
+    @property
+    def ready(self) -> bool:
+        return self.refreshed_at is not None
+    
+    def age_seconds(self) -> Optional[float]:
+        if self._refreshed_monotonic is None:
+            return None
+        return round(time.monotonic() - self._refreshed_monotonic, 3)
+    
+    async def refresh(self):
+        results = await asyncio.gather(*(self.pool.probe(b) for b in self.pool.backends))
+        details = {m.get("name"): m for backend_models in results for m in backend_models or []}
+        
+        # backend.models is only replaced by a successful probe
+        models: Dict[str, Dict[str, Any]] = {}
+        for backend in self.pool.backends:
+            for name in sorted(backend.models or ()):
+                previous = self.models.get(name, {})
+                model = details.get(name, previous)
+                entry = models.setdefault(name, {
+                    "name": name,
+                    "modified_at": model.get("modified_at"),
+                    "size": model.get("size"),
+                    "backends": []
+                })
+                entry["backends"].append(backend.url)
+        
+        self.models = models
+        self.refreshed_at = time.time()
+        self._refreshed_monotonic = time.monotonic()
+        self.refresh_count += 1
+    
+    async def refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"⚠️ Model registry refresh failed: {e}")
+    
+    def resolve(self, requested: str) -> Optional[str]:
+        """Map a requested model name to an Ollama model, or None if unknown
+        
+        Until some backend has reported its models every name is passed
+        through, so a cold start or an outage doesn't reject traffic.
+        """
+        name = MODEL_ALIASES.get(requested, requested)
+        if not self.ready or all(b.models is None for b in self.pool.backends):
+            return name
+        if name in self.models:
+            return name
+        if f"{name}:latest" in self.models:
+            return f"{name}:latest"
+        return None
+    
+    def is_available(self, name: str) -> bool:
+        return name in self.models
+
+model_registry: Optional[ModelRegistry] = None
+
+# Model routing settings
+# DEVAI_ROUTES holds a JSON list of rules (or DEVAI_ROUTES_FILE a path to one), e.g.
+#   [{"name": "quick", "model": "starcoder2:3b", "max_prompt_tokens": 300,
+#     "max_completion_tokens": 256, "allow_code": false},
+#    {"name": "full", "model": "devai-assistant:starcoder"}]
+ROUTES_CONFIG = os.getenv("DEVAI_ROUTES", "")
+ROUTES_FILE = os.getenv("DEVAI_ROUTES_FILE", "")
+ROUTABLE_MODELS = ("devai-assistant", "auto")
+
+class RouteRule:
+    """Conditions on a request and the model that serves it when they all hold
+    
+    Unset conditions always match. Prompt size is measured after the prompt
+    is fitted to the context window, in the proxy tokenizer's tokens.
+    """
+    
+    FIELDS = ("name", "model", "models", "min_prompt_tokens", "max_prompt_tokens", "max_completion_tokens", "max_turns", "allow_code")
+    
+    def __init__(self, name: str, model: str, models: Optional[List[str]] = None,
+                 min_prompt_tokens: Optional[int] = None, max_prompt_tokens: Optional[int] = None,
+                 max_completion_tokens: Optional[int] = None, max_turns: Optional[int] = None,
+                 allow_code: bool = True):
+        self.name = name
+        self.model = model
+        # Requested model names this rule applies to
+        self.models = set(models or ROUTABLE_MODELS)
+        self.min_prompt_tokens = min_prompt_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_completion_tokens = max_completion_tokens
+        self.max_turns = max_turns
+        self.allow_code = allow_code
+        self.matched = 0
+        self.skipped_unavailable = 0
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RouteRule":
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"unknown route field(s): {', '.join(sorted(unknown))}")
+        if not data.get("name") or not data.get("model"):
+            raise ValueError("every route needs a name and a model")
+        return cls(**data)
+    
+    def matches(self, requested: str, prompt_tokens: int, max_tokens: int, turns: int, has_code: bool) -> bool:
+        if requested not in self.models:
+            return False
+        if self.min_prompt_tokens is not None and prompt_tokens < self.min_prompt_tokens:
+            return False
+        if self.max_prompt_tokens is not None and prompt_tokens > self.max_prompt_tokens:
+            return False
+        if self.max_completion_tokens is not None and max_tokens > self.max_completion_tokens:
+            return False
+        if self.max_turns is not None and turns > self.max_turns:
+            return False
+        if has_code and not self.allow_code:
+            return False
+        return True
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **{field: getattr(self, field) for field in self.FIELDS if field != "models"},
+            "models": sorted(self.models),
+            "matched": self.matched,
+            "skipped_unavailable": self.skipped_unavailable
+        }
+
+class ModelRouter:
+    """Picks a model per request from ordered rules; the first match wins
+    
+    Rules whose model isn't in the registry snapshot are skipped, so a small
+    model that hasn't been pulled yet degrades to the next rule instead of
+    failing requests. Requests no rule matches keep the model they asked for.
+    """
+    
+    DEFAULT_ROUTE = "default"
+    
+    def __init__(self, rules: List[RouteRule]):
+        self.rules = rules
+        self.unrouted = 0
+    
+    @classmethod
+    def from_config(cls, config: str, path: str) -> "ModelRouter":
+        if not config and path:
+            with open(path) as f:
+                config = f.read()
+        if not config:
+            return cls([])
+        return cls([RouteRule.from_dict(rule) for rule in json.loads(config)])
+    
+    def route(self, requested: str, prompt_tokens: int, max_tokens: int, messages: List["ChatMessage"]) -> Tuple[str, str]:
+        """Return (route name, model name to resolve) for a request"""
+        has_code = "```" in messages[-1].content if messages else False
+        for rule in self.rules:
+            if not rule.matches(requested, prompt_tokens, max_tokens, len(messages), has_code):
+                continue
+            if model_registry.resolve(rule.model) is None:
+                rule.skipped_unavailable += 1
+                continue
+            rule.matched += 1
+            return rule.name, rule.model
+        self.unrouted += 1
+        return self.DEFAULT_ROUTE, requested
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rules": [rule.stats() for rule in self.rules],
+            "unrouted": self.unrouted
+        }
+
+try:
+    model_router = ModelRouter.from_config(ROUTES_CONFIG, ROUTES_FILE)
+except (OSError, ValueError, TypeError) as e:
+    print(f"⚠️ Invalid routing configuration ({e}) - model routing disabled")
+    model_router = ModelRouter([])
+
+# Tokenizer and context window settings
+TOKENIZER_PATH = os.getenv("DEVAI_TOKENIZER_PATH", "bigcode/starcoder2-7b")
+CONTEXT_WINDOW_TOKENS = int(os.getenv("DEVAI_CONTEXT_WINDOW_TOKENS", "4096"))
+MIN_PROMPT_TOKENS = int(os.getenv("DEVAI_MIN_PROMPT_TOKENS", "256"))
+
+class PromptTokenizer:
+    """Token counting with the fine-tuned model's tokenizer
+    
+    The tokenizer is loaded once at startup. If transformers isn't installed
+    or the tokenizer can't be loaded, counts fall back to a ~4 characters
+    per token estimate so the server still runs.
+    """
+    
+    CHARS_PER_TOKEN = 4
+    COUNT_CACHE_SIZE = 8192
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.tokenizer = None
+        # Token counts keyed by a 16-byte digest of the text, not the text
+        # itself, so whole prompts don't stay referenced by the cache
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+    
+    def load(self):
+        if not TOKENIZER_AVAILABLE:
+            print("⚠️ transformers not installed - token counts are estimated")
+            return
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(self.path)
+            print(f"✅ Loaded tokenizer from {self.path}")
+        except Exception as e:
+            print(f"⚠️ Could not load tokenizer from {self.path}, token counts are estimated: {e}")
+    
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+    
+    def count(self, text: str) -> int:
+        if self.tokenizer is None:
+            return max(1, math.ceil(len(text) / self.CHARS_PER_TOKEN)) if text else 0
+        # Cached because earlier turns of a conversation are re-sent every turn
+        key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        count = self._counts.get(key)
+        if count is not None:
+            self._counts.move_to_end(key)
+            return count
+        count = len(self.tokenizer.encode(text, add_special_tokens=False))
+        self._counts[key] = count
+        if len(self._counts) > self.COUNT_CACHE_SIZE:
+            self._counts.popitem(last=False)
+        return count
+    
+    def truncate_left(self, text: str, max_tokens: int) -> str:
+        """Keep only the last max_tokens tokens of text"""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[-max_tokens * self.CHARS_PER_TOKEN:]
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        return self.tokenizer.decode(ids[-max_tokens:])
+
+prompt_tokenizer = PromptTokenizer(TOKENIZER_PATH)
+
+# Session context settings
+SESSION_MAX_ENTRIES = int(os.getenv("DEVAI_SESSION_MAX_ENTRIES", "512"))
+SESSION_MAX_TOKENS = int(os.getenv("DEVAI_SESSION_MAX_TOKENS", str(2 * 1024 * 1024)))
+SESSION_TTL_SECONDS = float(os.getenv("DEVAI_SESSION_TTL_SECONDS", "1800"))
+
+def transcript_fingerprint(messages: List[Dict[str, str]]) -> str:
+    raw = json.dumps([[m["role"], m["content"].strip()] for m in messages])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class SessionStore:
+    """Keeps Ollama's context token array from each session's last turn
+    
+    A follow-up turn whose history matches the stored transcript only sends
+    the new user message plus the stored context, so Ollama skips
+    re-prefilling the conversation. Bounded by session count and by the
+    total number of stored context tokens, with LRU eviction and a TTL.
+    """
+    
+    def __init__(self, max_entries: int, max_tokens: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def lookup(self, session_id: str, model: str, history_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Return the stored session if it continues exactly from this history"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            self.misses += 1
+            return None
+        
+        if session["expires_at"] < time.monotonic():
+            self._remove(session_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        
+        if session["model"] != model or session["fingerprint"] != history_fingerprint:
+            # The client edited or branched the conversation
+            self.misses += 1
+            return None
+        
+        self._sessions.move_to_end(session_id)
+        self.hits += 1
+        return session
+    
+    def store(self, session_id: str, model: str, fingerprint: str, context: List[int], backend: Optional[str]):
+        if session_id in self._sessions:
+            self._remove(session_id)
+        if self.max_entries <= 0 or len(context) > self.max_tokens:
+            return
+        
+        self._sessions[session_id] = {
+            "model": model,
+            "fingerprint": fingerprint,
+            "context": context,
+            "backend": backend,
+            "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        self._tokens += len(context)
+        
+        while len(self._sessions) > self.max_entries or self._tokens > self.max_tokens:
+            self._remove(next(iter(self._sessions)))
+            self.evictions += 1
+    
+    def discard(self, session_id: str):
+        if session_id in self._sessions:
+            self._remove(session_id)
+    
+    def _remove(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self._tokens -= len(session["context"])
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "context_tokens": self._tokens,
+            "max_entries": self.max_entries,
+            "max_tokens": self.max_tokens,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+session_store = SessionStore(SESSION_MAX_ENTRIES, SESSION_MAX_TOKENS, SESSION_TTL_SECONDS)
+
+# Semantic cache settings
+SEMANTIC_CACHE_ENABLED = os.getenv("DEVAI_SEMANTIC_CACHE", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_EMBEDDER = os.getenv("DEVAI_SEMANTIC_CACHE_EMBEDDER", "hash")  # "hash" or "ollama:<embedding model>"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("DEVAI_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("DEVAI_SEMANTIC_CACHE_MAX_ENTRIES", "4096"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("DEVAI_SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+HASH_EMBEDDING_DIM = 512
+
+def hash_embedding(text: str, dim: int = HASH_EMBEDDING_DIM) -> "np.ndarray":
+    """Deterministic local embedding from hashed words and character trigrams
+    
+    No model needed, so it is stable across processes and useful for tests;
+    it catches rewordings that share vocabulary, not true paraphrases.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    words = "".join(c.lower() if c.isalnum() else " " for c in text).split()
+    features = words + [f"#{w[i:i + 3]}" for w in words for i in range(max(len(w) - 2, 1))]
+    for feature in features:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+        vector[digest % dim] += 1.0 if (digest >> 63) else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+async def ollama_embedding(model: str, text: str) -> "np.ndarray":
+    """Embed text with an embedding model served by the backend pool"""
+    backend = backend_pool.acquire(model=model)
+    try:
+        response = await backend.client.post("/api/embeddings", json={"model": model, "prompt": text})
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        backend_pool.release(backend, False, str(e) or type(e).__name__)
+        raise
+    backend_pool.release(backend, True)
+    vector = np.asarray(response.json()["embedding"], dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+SEMANTIC_LOOKUP_LATENCY = Histogram(
+    "devai_semantic_cache_lookup_seconds", "Semantic cache embed + search time",
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+)
+SEMANTIC_LOOKUPS_TOTAL = Counter("devai_semantic_cache_lookups_total", "Semantic cache lookups by result", ("result",))
+
+class SemanticScope:
+    """Vectors for one repo/model/history scope, stored as rows of a NumPy matrix"""
+    
+    def __init__(self, dim: int):
+        self.vectors = np.zeros((16, dim), dtype=np.float32)
+        self.entry_ids: List[int] = []
+    
+    def add(self, entry_id: int, vector: "np.ndarray") -> int:
+        row = len(self.entry_ids)
+        if row == len(self.vectors):
+            grown = np.zeros((len(self.vectors) * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[:row] = self.vectors
+            self.vectors = grown
+        self.vectors[row] = vector
+        self.entry_ids.append(entry_id)
+        return row
+    
+    def remove_row(self, row: int) -> Optional[int]:
+        """Remove a row by moving the last row into its place; returns the moved entry id"""
+        last = len(self.entry_ids) - 1
+        moved = None
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            moved = self.entry_ids[last]
+            self.entry_ids[row] = moved
+        self.entry_ids.pop()
+        return moved
+    
+    def search(self, vector: "np.ndarray") -> Tuple[int, float]:
+        scores = self.vectors[:len(self.entry_ids)] @ vector
+        row = int(np.argmax(scores))
+        return row, float(scores[row])
+
+class SemanticCache:
+    """Near-duplicate answer cache over an in-process vector index
+    
+    Final user messages are embedded and searched within a scope (repo,
+    model and the preceding conversation); a neighbour above the similarity
+    threshold returns its stored answer. Capacity is global across scopes
+    with LRU eviction and a TTL.
+    """
+    
+    def __init__(self, embedder: str, threshold: float, max_entries: int, ttl_seconds: float):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._scopes: Dict[str, SemanticScope] = {}
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lookup_seconds_total = 0.0
+    
+    async def embed(self, text: str) -> "np.ndarray":
+        if self.embedder.startswith("ollama:"):
+            return await ollama_embedding(self.embedder.split(":", 1)[1], text)
+        return hash_embedding(text)
+    
+    @staticmethod
+    def make_scope(repo: Optional[str], model: str, history: List[Dict[str, str]]) -> str:
+        return f"{repo or ''}|{model}|{transcript_fingerprint(history)}"
+    
+    async def lookup(self, scope_key: str, text: str) -> Tuple[Optional[Dict[str, Any]], "np.ndarray"]:
+        """Returns (cached entry or None, query embedding)"""
+        started = time.perf_counter()
+        vector = await self.embed(text)
+        entry = None
+        
+        scope = self._scopes.get(scope_key)
+        if scope is not None and scope.entry_ids and len(vector) == scope.vectors.shape[1]:
+            row, score = scope.search(vector)
+            if score >= self.threshold:
+                entry_id = scope.entry_ids[row]
+                candidate = self._entries[entry_id]
+                if candidate["expires_at"] < time.monotonic():
+                    self._remove(entry_id)
+                else:
+                    self._entries.move_to_end(entry_id)
+                    entry = candidate
+                    print(f"🧠 Semantic cache hit (similarity {score:.3f}) for: {candidate['question'][:50]}...")
+        
+        elapsed = time.perf_counter() - started
+        self.lookup_seconds_total += elapsed
+        SEMANTIC_LOOKUP_LATENCY.observe(elapsed)
+        if entry is not None:
+            self.hits += 1
+            SEMANTIC_LOOKUPS_TOTAL.inc("hit")
+        else:
+            self.misses += 1
+            SEMANTIC_LOOKUPS_TOTAL.inc("miss")
+        return entry, vector
+    
+    def put(self, scope_key: str, vector: "np.ndarray", question: str, content: str, finish_reason: str):
+        if self.max_entries <= 0:
+            return
+        
+        scope = self._scopes.get(scope_key)
+        if scope is None:
+            scope = self._scopes[scope_key] = SemanticScope(len(vector))
+        elif len(vector) != scope.vectors.shape[1]:
+            return
+        
+        entry_id = self._next_id
+        self._next_id += 1
+        row = scope.add(entry_id, vector)
+        self._entries[entry_id] = {
+            "scope": scope_key,
+            "row": row,
+            "question": question,
+            "content": content,
+            "finish_reason": finish_reason,
+            "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+    
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        scope = self._scopes[entry["scope"]]
+        moved = scope.remove_row(entry["row"])
+        if moved is not None:
+            self._entries[moved]["row"] = entry["row"]
+        if not scope.entry_ids:
+            del self._scopes[entry["scope"]]
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "embedder": self.embedder,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "scopes": len(self._scopes),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "avg_lookup_ms": round(1000 * self.lookup_seconds_total / lookups, 3) if lookups else 0.0
+        }
+
+semantic_cache: Optional[SemanticCache] = None
+if SEMANTIC_CACHE_ENABLED:
+    if NUMPY_AVAILABLE:
+        semantic_cache = SemanticCache(SEMANTIC_CACHE_EMBEDDER, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_TTL_SECONDS)
+    else:
+        print("⚠️ DEVAI_SEMANTIC_CACHE is set but numpy is not installed - semantic cache disabled")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global ollama_client
+    global backend_pool, model_registry
     
     # Startup
     print("🚀 Starting DevAI API Server for Webapp Integration")
-    ollama_client = httpx.AsyncClient(base_url="http://localhost:11434", timeout=60.0)
+    backend_pool = BackendPool(OLLAMA_BACKENDS, OLLAMA_TIMEOUT_SECONDS, BACKEND_MAX_FAILURES)
+    model_registry = ModelRegistry(backend_pool, MODEL_REFRESH_INTERVAL_SECONDS)
+    print(f"🔗 Ollama backends: {', '.join(OLLAMA_BACKENDS)}")
+    await asyncio.to_thread(prompt_tokenizer.load)
     
     # Check if model is available
-    try:
-        response = await ollama_client.get("/api/tags")
-        if response.status_code == 200:
-            models = response.json().get("models", [])
-            model_names = [m.get("name") for m in models]
-            if "devai-assistant:starcoder" in model_names:
-                print("✅ DevAI StarCoder model is available and ready!")
-            else:
-                print("❌ DevAI StarCoder model not found. Available models:", model_names)
-                print("💡 Run: ollama create devai-assistant:starcoder -f /path/to/Modelfile")
-    except Exception as e:
-        print(f"⚠️ Warning: Could not connect to Ollama: {e}")
+    await model_registry.refresh()
+    if not backend_pool.healthy_backends():
+        print("⚠️ Warning: Could not connect to Ollama")
         print("💡 Make sure Ollama is running: ollama serve")
+    elif model_registry.is_available(DEFAULT_MODEL):
+        print("✅ DevAI StarCoder model is available and ready!")
+    else:
+        print("❌ DevAI StarCoder model not found. Available models:", sorted(model_registry.models))
+        print(f"💡 Run: ollama create {DEFAULT_MODEL} -f /path/to/Modelfile")
+    
+    refresh_task = asyncio.create_task(model_registry.refresh_forever())
     
     yield
     
     # Shutdown
-    if ollama_client:
-        await ollama_client.aclose()
+    refresh_task.cancel()
+    await backend_pool.aclose()
     print("👋 DevAI API Server stopped")
 
 # Create FastAPI app
@@ -89,122 +1124,859 @@ app.add_middleware(
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint, answered from the model registry snapshot"""
+    ollama_connected = bool(backend_pool.healthy_backends())
+    model_available = ollama_connected and model_registry.is_available(DEFAULT_MODEL)
+    
+    if model_available:
+        status = "healthy"
+    elif ollama_connected:
+        status = "degraded"
+    else:
+        status = "unhealthy"
+    
+    return {
+        "status": status,
+        "model_available": model_available,
+        "ollama_connected": ollama_connected,
+        "snapshot_age_seconds": model_registry.age_seconds(),
+        "admission": admission.stats(),
+        "single_flight": single_flight.stats(),
+        "backends": backend_pool.stats(),
+        "timestamp": int(time.time())
+    }
+
+PROMPT_SUFFIX = "### Response:\n"
+
+def format_message(message: ChatMessage) -> str:
+    if message.role == "user":
+        return f"### Instruction:\n{message.content}\n\n"
+    if message.role == "assistant":
+        return f"### Response:\n{message.content}\n\n"
+    return ""
+
+def fit_to_context(messages: List[ChatMessage], max_tokens: int) -> Tuple[str, int, int]:
+    """Build a prompt that fits the context window together with max_tokens
+    
+    Drops the oldest turns first; if the latest message alone is still too
+    long, its beginning is truncated. max_tokens is reduced when needed so
+    at least MIN_PROMPT_TOKENS remain for the prompt.
+    
+    Returns (prompt, prompt_tokens, max_tokens).
+    """
+    max_tokens = min(max_tokens, max(CONTEXT_WINDOW_TOKENS - MIN_PROMPT_TOKENS, 1))
+    budget = CONTEXT_WINDOW_TOKENS - max_tokens - prompt_tokenizer.count(PROMPT_SUFFIX)
+    
+    blocks = [format_message(message) for message in messages]
+    counts = [prompt_tokenizer.count(block) for block in blocks]
+    total = sum(counts)
+    
+    start = 0
+    while total > budget and start < len(blocks) - 1:
+        total -= counts[start]
+        start += 1
+    
+    if start:
+        print(f"✂️ Dropped {start} oldest message(s) to fit the {CONTEXT_WINDOW_TOKENS}-token context window")
+    
+    kept = blocks[start:]
+    if total > budget and kept:
+        # Only the latest message is left and it is still too long
+        last = messages[-1]
+        header_tokens = prompt_tokenizer.count(format_message(ChatMessage(role=last.role, content="")))
+        content = prompt_tokenizer.truncate_left(last.content, budget - header_tokens)
+        kept = [format_message(ChatMessage(role=last.role, content=content))]
+        print(f"✂️ Truncated the latest message to fit the {CONTEXT_WINDOW_TOKENS}-token context window")
+    
+    prompt = "".join(kept) + PROMPT_SUFFIX
+    return prompt, prompt_tokenizer.count(prompt), max_tokens
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    """Format a payload as a server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def completion_chunk(completion_id: str, created: int, model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+    """Format a single chat.completion.chunk event"""
+    return sse_event({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "delta": delta,
+            "finish_reason": finish_reason
+        }]
+    })
+
+async def stream_shared_generation(generation: "SharedGeneration", completion_id: str, created: int, model: str, tracker: RequestTracker, on_complete=None):
+    """Relay a shared Ollama generation as OpenAI-style chat.completion.chunk events
+    
+    on_complete is called with the full content, finish reason and Ollama's
+    final chunk once the upstream generation finishes cleanly.
+    """
+    cancelled = False
+    failed = False
+    
     try:
-        response = await ollama_client.get("/api/tags")
-        model_available = False
+        yield completion_chunk(completion_id, created, model, {"role": "assistant"})
         
-        if response.status_code == 200:
-            models = response.json().get("models", [])
-            model_names = [m.get("name") for m in models]
-            model_available = "devai-assistant:starcoder" in model_names
+        async for text in generation.follow():
+            tracker.first_token()
+            yield completion_chunk(completion_id, created, model, {"content": text})
         
-        return {
-            "status": "healthy" if model_available else "degraded",
-            "model_available": model_available,
-            "ollama_connected": response.status_code == 200,
-            "timestamp": int(time.time())
+        if generation.error is not None:
+            failed = True
+            yield sse_event({"error": {"message": generation.error_message(), "type": "upstream_error"}})
+        else:
+            if on_complete:
+                on_complete(generation.content(), generation.finish_reason, generation.result)
+            yield completion_chunk(completion_id, created, model, {}, generation.finish_reason)
+        
+        yield "data: [DONE]\n\n"
+        print(f"✅ Streamed response {completion_id}")
+    except (asyncio.CancelledError, GeneratorExit):
+        cancelled = True
+        raise
+    finally:
+        release_stream(generation, tracker, None if cancelled else "502" if failed else "200")
+
+def release_stream(generation: "SharedGeneration", tracker: RequestTracker, status: Optional[str] = None):
+    """Leave the generation and record the outcome (cancelled without a status), once per request"""
+    if tracker.finished:
+        return
+    generation.leave()
+    if status is None:
+        tracker.cancel()
+    else:
+        tracker.finish(status)
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """StreamingResponse that runs on_close however the response ends
+    
+    A body generator's finally only runs once iteration has started, and
+    Starlette skips background tasks when the client disconnects, so a
+    stream that never starts would otherwise hold its resources forever.
+    """
+    
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+async def replay_chat_completion(content: str, finish_reason: str, completion_id: str, created: int, model: str):
+    """Replay a cached completion as a chat.completion.chunk stream"""
+    yield completion_chunk(completion_id, created, model, {"role": "assistant"})
+    if content:
+        yield completion_chunk(completion_id, created, model, {"content": content})
+    yield completion_chunk(completion_id, created, model, {}, finish_reason)
+    yield "data: [DONE]\n\n"
+
+def completion_response(content: str, finish_reason: str, prompt_tokens: int, completion_tokens: int, model: str) -> ChatCompletionResponse:
+    """Build an OpenAI-compatible (non-streaming) completion response"""
+    return ChatCompletionResponse(
+        id=f"chatcmpl-{int(time.time())}",
+        created=int(time.time()),
+        model=model,
+        choices=[{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": content
+            },
+            "finish_reason": finish_reason
+        }],
+        usage={
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
         }
-    except Exception as e:
+    )
+
+async def open_generation(ollama_request: Dict[str, Any], preferred: Optional[str] = None) -> Tuple[OllamaBackend, httpx.Response]:
+    """Send a generate request to the least-loaded healthy backend serving the model
+    
+    Connection failures are retried on the remaining backends. The caller
+    owns the returned (streaming) response and must release the backend.
+    """
+    tried = set()
+    while True:
+        backend = backend_pool.acquire(exclude=tried, model=ollama_request["model"], preferred=preferred)
+        try:
+            upstream = await backend.client.send(
+                backend.client.build_request("POST", "/api/generate", json=ollama_request),
+                stream=True
+            )
+        except httpx.TransportError as e:
+            backend_pool.release(backend, False, str(e) or type(e).__name__)
+            tried.add(backend.url)
+            print(f"⚠️ Ollama backend {backend.url} failed, trying another: {e}")
+            continue
+        
+        return backend, upstream
+
+# Single-flight settings
+SINGLE_FLIGHT_ENABLED = os.getenv("DEVAI_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+SINGLE_FLIGHT_TOTAL = Counter("devai_single_flight_total", "Generations started vs. requests that joined one in flight", ("role",))
+
+class SharedGeneration:
+    """One upstream Ollama generation that any number of identical requests can follow
+    
+    The generation runs in its own task so it outlives any single client;
+    it holds one admission slot and one backend no matter how many requests
+    follow it, and is cancelled when the last follower goes away.
+    """
+    
+    def __init__(self, key: str, ollama_request: Dict[str, Any], preferred_backend: Optional[str]):
+        self.key = key
+        self.ollama_request = ollama_request
+        self.preferred_backend = preferred_backend
+        self.tokens: List[str] = []
+        self.done = False
+        self.finish_reason = "stop"
+        self.result: Dict[str, Any] = {}
+        self.error: Optional[Exception] = None
+        self.backend_url: Optional[str] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Set once the upstream accepted the request (or failed), so HTTP
+        # errors can still be returned as a status code
+        self.started = asyncio.Event()
+        self._changed = asyncio.Condition()
+    
+    async def run(self):
+        model = self.ollama_request["model"]
+        try:
+            slot_started = await admission.acquire()
+        except asyncio.CancelledError:
+            # Every follower went away while queued
+            single_flight.forget(self)
+            self.error = RuntimeError("Generation cancelled")
+            self.done = True
+            self.started.set()
+            raise
+        except AdmissionRejected as e:
+            print(f"🚦 Rejected request: {e.reason}")
+            # Unregister first so later identical prompts start a fresh generation
+            single_flight.forget(self)
+            await self._fail(HTTPException(
+                status_code=e.status_code,
+                detail=e.reason,
+                headers={"Retry-After": str(e.retry_after)}
+            ))
+            return
+        
+        backend = None
+        upstream = None
+        backend_error = None
+        upstream_started = time.perf_counter()
+        try:
+            backend, upstream = await open_generation({**self.ollama_request, "stream": True}, preferred=self.preferred_backend)
+            
+            if upstream.status_code != 200:
+                detail = (await upstream.aread()).decode(errors="replace")
+                if upstream.status_code >= 500:
+                    backend_error = f"HTTP {upstream.status_code}"
+                raise HTTPException(
+                    status_code=upstream.status_code,
+                    detail=f"Ollama API error: {detail}"
+                )
+            
+            self.backend_url = backend.url
+            self.started.set()
+            
+            async for line in upstream.aiter_lines():
+                if not line.strip():
+                    continue
+                
+                data = json.loads(line)
+                if "error" in data:
+                    raise RuntimeError(f"Ollama API error: {data['error']}")
+                
+                token = data.get("response", "")
+                if token:
+                    async with self._changed:
+                        self.tokens.append(token)
+                        self._changed.notify_all()
+                
+                if data.get("done"):
+                    self.result = data
+                    self.finish_reason = "length" if data.get("done_reason") == "length" else "stop"
+                    break
+            
+            UPSTREAM_LATENCY.observe(time.perf_counter() - upstream_started, model, backend.url)
+            eval_count = self.result.get("eval_count")
+            eval_duration = self.result.get("eval_duration")
+            if eval_count and eval_duration:
+                TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), model)
+            
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+        except NoHealthyBackend as e:
+            await self._fail(HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(BACKEND_PROBE_INTERVAL_SECONDS))}))
+        except HTTPException as e:
+            await self._fail(e)
+        except asyncio.CancelledError:
+            # Every follower went away; closing the upstream stops generation in Ollama
+            self.error = RuntimeError("Generation cancelled")
+            self.done = True
+            self.started.set()
+            raise
+        except Exception as e:
+            backend_error = str(e) or type(e).__name__
+            print(f"❌ Error during generation: {backend_error}")
+            await self._fail(e)
+        finally:
+            try:
+                if upstream is not None:
+                    await upstream.aclose()
+            finally:
+                if backend is not None:
+                    backend_pool.release(backend, backend_error is None, backend_error)
+                admission.release(slot_started)
+                single_flight.forget(self)
+    
+    async def _fail(self, error: Exception):
+        async with self._changed:
+            self.error = error
+            self.done = True
+            self.started.set()
+            self._changed.notify_all()
+    
+    def error_message(self) -> str:
+        if isinstance(self.error, HTTPException):
+            return str(self.error.detail)
+        return str(self.error)
+    
+    def raise_error(self):
+        """Re-raise the generation's failure in a follower's context"""
+        if isinstance(self.error, HTTPException):
+            raise HTTPException(status_code=self.error.status_code, detail=self.error.detail, headers=self.error.headers)
+        raise RuntimeError(self.error_message())
+    
+    def content(self) -> str:
+        return "".join(self.tokens).strip()
+    
+    async def wait_started(self):
+        await self.started.wait()
+        if self.error is not None and not self.tokens:
+            self.raise_error()
+    
+    async def wait_done(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.done)
+        if self.error is not None:
+            self.raise_error()
+    
+    async def follow(self):
+        """Yield generated text from the beginning, then live as it arrives
+        
+        Late joiners get everything produced so far as a single chunk.
+        """
+        seen = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.tokens) > seen or self.done)
+                new_tokens = self.tokens[seen:]
+                seen = len(self.tokens)
+                finished = self.done
+            if new_tokens:
+                yield "".join(new_tokens)
+            if finished and seen == len(self.tokens):
+                return
+    
+    def leave(self):
+        self.subscribers -= 1
+        if self.subscribers <= 0 and not self.done and self.task is not None:
+            single_flight.forget(self)
+            self.task.cancel()
+
+class SingleFlight:
+    """Coalesces identical in-flight generations onto one SharedGeneration"""
+    
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._in_flight: Dict[str, SharedGeneration] = {}
+        self.started = 0
+        self.joined = 0
+    
+    @staticmethod
+    def make_key(ollama_request: Dict[str, Any]) -> str:
+        raw = json.dumps({
+            "model": ollama_request["model"],
+            "prompt": ollama_request["prompt"],
+            "context": ollama_request.get("context"),
+            "options": ollama_request["options"]
+        }, sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+    
+    def join(self, ollama_request: Dict[str, Any], preferred_backend: Optional[str] = None, coalesce: bool = True) -> SharedGeneration:
+        """Follow an identical generation in flight, or start one
+        
+        With coalesce False the generation is started but not shared, e.g.
+        for sampled requests that must each get their own answer.
+        """
+        key = self.make_key(ollama_request)
+        coalesce = coalesce and self.enabled
+        generation = self._in_flight.get(key) if coalesce else None
+        
+        if generation is None:
+            generation = SharedGeneration(key, ollama_request, preferred_backend)
+            generation.task = asyncio.create_task(generation.run())
+            if coalesce:
+                self._in_flight[key] = generation
+            self.started += 1
+            SINGLE_FLIGHT_TOTAL.inc("leader")
+        else:
+            self.joined += 1
+            SINGLE_FLIGHT_TOTAL.inc("follower")
+            print(f"🔗 Joined in-flight generation ({generation.subscribers} other request(s) waiting)")
+        
+        generation.subscribers += 1
+        return generation
+    
+    def forget(self, generation: SharedGeneration):
+        if self._in_flight.get(generation.key) is generation:
+            del self._in_flight[generation.key]
+    
+    def stats(self) -> Dict[str, Any]:
         return {
-            "status": "unhealthy",
-            "model_available": False,
-            "ollama_connected": False,
-            "error": str(e),
-            "timestamp": int(time.time())
+            "enabled": self.enabled,
+            "in_flight": len(self._in_flight),
+            "generations_started": self.started,
+            "requests_joined": self.joined
         }
 
+single_flight = SingleFlight(SINGLE_FLIGHT_ENABLED)
+
 @app.post("/v1/chat/completions", response_model=ChatCompletionResponse)
 async def chat_completions(request: ChatCompletionRequest):
     """OpenAI-compatible chat completions endpoint for your webapp"""
+    tracker = RequestTracker()
     
     try:
-        # Convert messages to prompt format that DevAI understands
-        prompt = ""
-        for message in request.messages:
-            if message.role == "user":
-                prompt += f"### Instruction:\n{message.content}\n\n"
-            elif message.role == "assistant":
-                prompt += f"### Response:\n{message.content}\n\n"
-        
-        prompt += "### Response:\n"
-        
-        # Call Ollama API
-        ollama_request = {
-            "model": "devai-assistant:starcoder",
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": request.temperature,
-                "num_predict": request.max_tokens,
-            }
+        response = await generate_chat_completion(request, tracker)
+    except HTTPException as e:
+        tracker.finish(str(e.status_code))
+        raise
+    except asyncio.CancelledError:
+        tracker.cancel()
+        raise
+    except Exception as e:
+        tracker.finish("500")
+        print(f"❌ Error processing request: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Internal server error: {str(e)}"
+        )
+    
+    if not tracker.deferred:
+        tracker.finish("200")
+    return response
+
+async def generate_chat_completion(request: ChatCompletionRequest, tracker: RequestTracker):
+    # Convert messages to prompt format that DevAI understands, bounded
+    # so prompt plus completion fits the context window
+    prompt, prompt_tokens, max_tokens = fit_to_context(request.messages, request.max_tokens)
+    
+    # Send short, simple requests to a smaller model when routing rules say so
+    route, routed_model = model_router.route(request.model, prompt_tokens, max_tokens, request.messages)
+    tracker.route = route
+    
+    # Fail fast while every backend is down; their models are still known
+    if not backend_pool.healthy_backends():
+        raise HTTPException(
+            status_code=503,
+            detail="No healthy Ollama backend available",
+            headers={"Retry-After": str(int(BACKEND_PROBE_INTERVAL_SECONDS))}
+        )
+    
+    # Reject unknown models before touching the upstream
+    ollama_model = model_registry.resolve(routed_model)
+    if ollama_model is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Model '{request.model}' not found. Available models: {sorted(model_registry.models)}"
+        )
+    tracker.model = ollama_model
+    if route != ModelRouter.DEFAULT_ROUTE:
+        print(f"🧭 Route '{route}' -> {ollama_model} ({prompt_tokens} prompt tokens, max_tokens {max_tokens})")
+    
+    # Call Ollama API
+    ollama_request = {
+        "model": ollama_model,
+        "prompt": prompt,
+        "stream": bool(request.stream),
+        "options": {
+            "temperature": request.temperature,
+            "num_predict": max_tokens,
+            "num_ctx": CONTEXT_WINDOW_TOKENS,
         }
+    }
+    
+    print(f"🤖 Processing request: {request.messages[-1].content[:50]}...")
+    
+    # Only deterministic generations are cached unless the caller opts in
+    use_cache = request.cache if request.cache is not None else request.temperature == 0
+    cache_key = None
+    
+    def cached_completion(cached: Dict[str, Any]):
+        if request.stream:
+            created = int(time.time())
+            return StreamingResponse(
+                replay_chat_completion(cached["content"], cached["finish_reason"], f"chatcmpl-{created}", created, request.model),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+        return completion_response(
+            cached["content"], cached["finish_reason"],
+            prompt_tokens, prompt_tokenizer.count(cached["content"]), request.model
+        )
+    
+    history = [{"role": m.role, "content": m.content} for m in request.messages]
+    semantic_scope = None
+    semantic_vector = None
+    
+    if use_cache:
+        cache_key = ResponseCache.make_key(ollama_request["model"], prompt, ollama_request["options"])
+        cached = response_cache.get(cache_key)
+        
+        if cached is not None:
+            print("⚡ Serving cached response")
+            return cached_completion(cached)
         
-        print(f"🤖 Processing request: {request.messages[-1].content[:50]}...")
+        # Fall back to a near-duplicate question asked earlier in the same scope
+        if semantic_cache is not None and request.messages[-1].role == "user":
+            semantic_scope = SemanticCache.make_scope(request.repo, ollama_model, history[:-1])
+            try:
+                cached, semantic_vector = await semantic_cache.lookup(semantic_scope, request.messages[-1].content)
+            except Exception as e:
+                print(f"⚠️ Semantic cache lookup failed: {e}")
+                cached = None
+            
+            if cached is not None:
+                return cached_completion(cached)
+    
+    # Continue from the session's stored context when the history matches,
+    # so only the new user turn needs prefill
+    preferred_backend = None
+    if request.session_id:
+        session = None
+        if request.messages[-1].role == "user":
+            session = session_store.lookup(request.session_id, ollama_model, transcript_fingerprint(history[:-1]))
         
-        response = await ollama_client.post("/api/generate", json=ollama_request)
+        if session is not None:
+            turn_prompt = "\n\n" + format_message(request.messages[-1]) + PROMPT_SUFFIX
+            if len(session["context"]) + prompt_tokenizer.count(turn_prompt) + max_tokens <= CONTEXT_WINDOW_TOKENS:
+                ollama_request["prompt"] = turn_prompt
+                ollama_request["context"] = session["context"]
+                preferred_backend = session["backend"]
+                print(f"♻️ Reusing context for session {request.session_id} ({len(session['context'])} tokens)")
+            else:
+                # The conversation outgrew the window; fall back to a trimmed full prompt
+                session_store.discard(request.session_id)
+    
+    def on_generation_complete(content: str, finish_reason: str, result: Dict[str, Any], backend_url: Optional[str] = None):
+        eval_count = result.get("eval_count")
+        eval_duration = result.get("eval_duration")
+        if eval_count and eval_duration:
+            ROUTE_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), route)
+        if cache_key is not None:
+            response_cache.put(cache_key, {"content": content, "finish_reason": finish_reason})
+        if semantic_vector is not None:
+            semantic_cache.put(semantic_scope, semantic_vector, request.messages[-1].content, content, finish_reason)
+        if request.session_id and result.get("context"):
+            fingerprint = transcript_fingerprint(history + [{"role": "assistant", "content": content}])
+            session_store.store(request.session_id, ollama_model, fingerprint, result["context"], backend_url)
+    
+    # Identical deterministic requests already in flight share one upstream
+    # generation; sampled ones each get their own answer
+    generation = single_flight.join(ollama_request, preferred_backend, coalesce=request.temperature == 0)
+    
+    try:
+        await generation.wait_started()
         
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Ollama API error: {response.text}"
+        if request.stream:
+            created = int(time.time())
+            tracker.deferred = True
+            return ReleasingStreamingResponse(
+                stream_shared_generation(
+                    generation, f"chatcmpl-{created}", created, request.model, tracker,
+                    on_complete=lambda content, finish_reason, result: on_generation_complete(content, finish_reason, result, generation.backend_url)
+                ),
+                on_close=lambda: release_stream(generation, tracker),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
             )
         
-        result = response.json()
-        content = result.get("response", "").strip()
-        
-        print(f"✅ Generated response: {content[:50]}...")
-        
-        # Return OpenAI-compatible response
-        return ChatCompletionResponse(
-            id=f"chatcmpl-{int(time.time())}",
-            created=int(time.time()),
-            model=request.model,
-            choices=[{
-                "index": 0,
-                "message": {
-                    "role": "assistant",
-                    "content": content
-                },
-                "finish_reason": "stop"
-            }],
-            usage={
-                "prompt_tokens": len(prompt.split()),
-                "completion_tokens": len(content.split()),
-                "total_tokens": len(prompt.split()) + len(content.split())
-            }
-        )
+        await generation.wait_done()
+    finally:
+        # A streaming response leaves the generation when its stream closes
+        if not tracker.deferred:
+            generation.leave()
+    
+    content = generation.content()
+    finish_reason = generation.finish_reason
+    result = generation.result
+    on_generation_complete(content, finish_reason, result, generation.backend_url)
+    
+    print(f"✅ Generated response: {content[:50]}...")
+    
+    # Ollama reports the exact number of generated tokens
+    completion_tokens = result.get("eval_count") or prompt_tokenizer.count(content)
+    
+    # Return OpenAI-compatible response
+    return completion_response(content, finish_reason, prompt_tokens, completion_tokens, request.model)
+
+# Batch settings
+BATCH_PARALLELISM = int(os.getenv("DEVAI_BATCH_PARALLELISM", "2"))
+BATCH_MAX_PARALLELISM = int(os.getenv("DEVAI_BATCH_MAX_PARALLELISM", str(MAX_CONCURRENT_REQUESTS)))
+BATCH_MAX_ITEMS = int(os.getenv("DEVAI_BATCH_MAX_ITEMS", "10000"))
+BATCH_MAX_JOBS = int(os.getenv("DEVAI_BATCH_MAX_JOBS", "64"))
+BATCH_TTL_SECONDS = float(os.getenv("DEVAI_BATCH_TTL_SECONDS", "3600"))
+BATCH_MAX_RETRIES = int(os.getenv("DEVAI_BATCH_MAX_RETRIES", "3"))
+
+BATCH_ITEMS_TOTAL = Counter("devai_batch_items_total", "Batch items finished by outcome", ("status",))
+
+class BatchJob:
+    """Items of one batch, run in the background with bounded parallelism
+    
+    Items keep running when the client disconnects; posting again with the
+    same batch id returns finished items from memory and waits for the rest.
+    """
+    
+    def __init__(self, batch_id: str, parallelism: int):
+        self.batch_id = batch_id
+        self.parallelism = parallelism
+        self.semaphore = asyncio.Semaphore(parallelism)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.created_at = time.time()
+        self.touched = time.monotonic()
+    
+    def submit(self, item_id: str, request: ChatCompletionRequest):
+        task = self.tasks.get(item_id)
+        # Cancelled items run again when the batch is resumed
+        if task is None or task.cancelled():
+            self.tasks[item_id] = asyncio.create_task(self._run(item_id, request))
+    
+    async def _run(self, item_id: str, request: ChatCompletionRequest) -> Dict[str, Any]:
+        async with self.semaphore:
+            for attempt in range(BATCH_MAX_RETRIES + 1):
+                try:
+                    response = await chat_completions(request)
+                    result = {"id": item_id, "status": 200, "response": jsonable_encoder(response)}
+                    break
+                except HTTPException as e:
+                    result = {"id": item_id, "status": e.status_code, "error": e.detail}
+                    retry_after = (e.headers or {}).get("Retry-After")
+                    if e.status_code not in (429, 503) or retry_after is None or attempt == BATCH_MAX_RETRIES:
+                        break
+                    # Back off like any well-behaved client when the proxy is saturated
+                    await asyncio.sleep(min(float(retry_after), QUEUE_TIMEOUT_SECONDS))
         
-    except Exception as e:
-        print(f"❌ Error processing request: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Internal server error: {str(e)}"
-        )
+        self.results[item_id] = result
+        BATCH_ITEMS_TOTAL.inc(str(result["status"]))
+        return result
+    
+    def cancel(self) -> int:
+        pending = [task for task in self.tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        return len(pending)
+    
+    @property
+    def done(self) -> bool:
+        return all(task.done() for task in self.tasks.values())
+    
+    def stats(self) -> Dict[str, Any]:
+        failed = sum(1 for r in self.results.values() if r["status"] != 200)
+        cancelled = sum(1 for task in self.tasks.values() if task.cancelled())
+        return {
+            "batch_id": self.batch_id,
+            "created": int(self.created_at),
+            "parallelism": self.parallelism,
+            "total": len(self.tasks),
+            "completed": len(self.results) - failed,
+            "failed": failed,
+            "cancelled": cancelled,
+            "pending": len(self.tasks) - len(self.results) - cancelled,
+            "done": self.done
+        }
+
+class BatchStore:
+    """Batch jobs by id, dropped once finished and idle for the TTL"""
+    
+    def __init__(self, max_jobs: int, ttl_seconds: float):
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.jobs: Dict[str, BatchJob] = {}
+    
+    def _purge(self):
+        now = time.monotonic()
+        for batch_id, job in list(self.jobs.items()):
+            if job.done and now - job.touched > self.ttl_seconds:
+                del self.jobs[batch_id]
+    
+    def get(self, batch_id: str) -> Optional[BatchJob]:
+        self._purge()
+        job = self.jobs.get(batch_id)
+        if job is not None:
+            job.touched = time.monotonic()
+        return job
+    
+    def create(self, batch_id: str, parallelism: int) -> BatchJob:
+        self._purge()
+        if len(self.jobs) >= self.max_jobs:
+            # Make room by dropping the oldest finished job
+            finished = [job for job in self.jobs.values() if job.done]
+            if not finished:
+                raise HTTPException(status_code=429, detail=f"Too many active batches (limit {self.max_jobs})")
+            del self.jobs[min(finished, key=lambda job: job.touched).batch_id]
+        job = BatchJob(batch_id, parallelism)
+        self.jobs[batch_id] = job
+        return job
+
+batch_store = BatchStore(BATCH_MAX_JOBS, BATCH_TTL_SECONDS)
+
+def parse_batch_lines(body: bytes) -> List[Tuple[str, Dict[str, Any]]]:
+    """Parse a JSONL batch into (id, request fields) pairs"""
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError as e:
+        line_no = body.count(b"\n", 0, e.start) + 1
+        raise HTTPException(status_code=400, detail=f"Line {line_no}: not valid UTF-8 ({e.reason})")
+    
+    items = []
+    seen = set()
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: invalid JSON ({e.msg})")
+        if not isinstance(item, dict) or item.get("id") in (None, ""):
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: every item needs an 'id'")
+        item_id = str(item.pop("id"))
+        if item_id in seen:
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: duplicate id '{item_id}'")
+        seen.add(item_id)
+        # Accept both flat chat requests and OpenAI batch style {"id", "body": {...}}
+        items.append((item_id, item.get("body", item)))
+    
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(items)} items (limit {BATCH_MAX_ITEMS})")
+    return items
+
+async def stream_batch_results(job: BatchJob, item_ids: List[str], invalid: List[Dict[str, Any]]):
+    """Yield one JSON line per item as it finishes"""
+    for result in invalid:
+        yield json.dumps(result) + "\n"
+    
+    for item_id in item_ids:
+        if item_id in job.results:
+            yield json.dumps(job.results[item_id]) + "\n"
+    
+    pending = {job.tasks[item_id]: item_id for item_id in item_ids if item_id not in job.results}
+    # Abandoning this stream leaves the items running for a later resume
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            item_id = pending.pop(task)
+            if task.cancelled():
+                yield json.dumps({"id": item_id, "status": 499, "error": "Batch item cancelled"}) + "\n"
+            else:
+                yield json.dumps(task.result()) + "\n"
+
+@app.post("/v1/batch")
+async def create_batch(request: Request, batch_id: Optional[str] = None, parallelism: Optional[int] = None):
+    """Run a JSONL batch of chat requests and stream JSONL results in completion order
+    
+    Each line is a chat completion request with an "id". Pass the returned
+    X-Batch-Id as batch_id to resume: finished items are returned at once and
+    unfinished ones are awaited instead of being generated again.
+    """
+    items = parse_batch_lines(await request.body())
+    
+    job = batch_store.get(batch_id) if batch_id else None
+    if job is None:
+        parallelism = max(1, min(parallelism or BATCH_PARALLELISM, BATCH_MAX_PARALLELISM))
+        job = batch_store.create(batch_id or f"batch-{uuid.uuid4().hex[:16]}", parallelism)
+    
+    item_ids = []
+    invalid = []
+    for item_id, fields in items:
+        if item_id in job.tasks and not job.tasks[item_id].cancelled():
+            item_ids.append(item_id)
+            continue
+        try:
+            chat_request = ChatCompletionRequest(**fields)
+        except (TypeError, ValueError) as e:
+            invalid.append({"id": item_id, "status": 422, "error": str(e)})
+            continue
+        # Results come back as whole completions
+        chat_request.stream = False
+        job.submit(item_id, chat_request)
+        item_ids.append(item_id)
+    
+    print(f"📦 Batch {job.batch_id}: {len(item_ids)} item(s), parallelism {job.parallelism}")
+    return StreamingResponse(
+        stream_batch_results(job, item_ids, invalid),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": job.batch_id}
+    )
+
+@app.get("/v1/batch/{batch_id}")
+async def batch_status(batch_id: str):
+    """Progress counters for a batch"""
+    job = batch_store.get(batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' not found")
+    return job.stats()
+
+@app.delete("/v1/batch/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """Cancel the unfinished items of a batch"""
+    job = batch_store.get(batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' not found")
+    cancelled = job.cancel()
+    print(f"🛑 Batch {batch_id}: cancelled {cancelled} pending item(s)")
+    return {**job.stats(), "cancelled_now": cancelled}
 
 @app.get("/v1/models")
 async def list_models():
     """List available models - for compatibility"""
-    try:
-        response = await ollama_client.get("/api/tags")
-        if response.status_code == 200:
-            ollama_models = response.json().get("models", [])
-            return {
-                "object": "list",
-                "data": [
-                    {
-                        "id": model.get("name", "unknown"),
-                        "object": "model",
-                        "created": int(time.time()),
-                        "owned_by": "devai"
-                    }
-                    for model in ollama_models
-                    if "devai" in model.get("name", "")
-                ]
-            }
-    except Exception as e:
-        print(f"Error listing models: {e}")
-        
+    created = int(model_registry.refreshed_at or time.time())
+    devai_models = [name for name in sorted(model_registry.models) if "devai" in name]
+    
+    if devai_models:
+        return {
+            "object": "list",
+            "data": [
+                {
+                    "id": name,
+                    "object": "model",
+                    "created": created,
+                    "owned_by": "devai"
+                }
+                for name in devai_models
+            ],
+            "snapshot_age_seconds": model_registry.age_seconds()
+        }
+    
     return {
         "object": "list", 
         "data": [{
@@ -212,9 +1984,48 @@ async def list_models():
             "object": "model", 
             "created": int(time.time()),
             "owned_by": "devai"
-        }]
+        }],
+        "snapshot_age_seconds": model_registry.age_seconds()
     }
 
+METRICS = [
+    REQUEST_LATENCY, UPSTREAM_LATENCY, TIME_TO_FIRST_TOKEN, TOKENS_PER_SECOND,
+    REQUESTS_TOTAL, ERRORS_TOTAL, CANCELLATIONS_TOTAL,
+    IN_FLIGHT_REQUESTS, QUEUE_DEPTH, ACTIVE_GENERATIONS,
+    SEMANTIC_LOOKUP_LATENCY, SEMANTIC_LOOKUPS_TOTAL, SINGLE_FLIGHT_TOTAL, BATCH_ITEMS_TOTAL,
+    ROUTE_REQUESTS_TOTAL, ROUTE_LATENCY, ROUTE_TIME_TO_FIRST_TOKEN, ROUTE_TOKENS_PER_SECOND
+]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of proxy metrics"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Response cache counters for sizing the cache"""
+    return response_cache.stats()
+
+@app.get("/cache/semantic/stats")
+async def semantic_cache_stats():
+    """Semantic cache counters and lookup latency"""
+    if semantic_cache is None:
+        return {"enabled": False}
+    return semantic_cache.stats()
+
+@app.get("/routes")
+async def routes():
+    """Routing rules and how often each one matched"""
+    return model_router.stats()
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """Session context store counters"""
+    return session_store.stats()
+
 @app.get("/")
 async def root():
     """Root endpoint with API info"""
@@ -224,7 +2035,13 @@ async def root():
         "endpoints": {
             "health": "/health",
             "chat": "/v1/chat/completions",
-            "models": "/v1/models"
+            "batch": "/v1/batch",
+            "models": "/v1/models",
+            "cache_stats": "/cache/stats",
+            "semantic_cache_stats": "/cache/semantic/stats",
+            "metrics": "/metrics",
+            "session_stats": "/sessions/stats",
+            "routes": "/routes"
         },
         "webapp_integration": {
             "base_url": "http://localhost:8080",
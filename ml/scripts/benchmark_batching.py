@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+SFT batching benchmark
+Trains LoRA on a (tiny) causal LM for one epoch with each batching mode
+from train.py - right-padded random batches, length-bucketed batches and
+packed rows - and reports padding waste, step count and effective
+(non-padding) tokens/sec. Also checks that a packed row gives the same
+loss as its examples run one by one, i.e. packed examples don't attend to
+each other. Runs on CPU.
+"""
+
+import json
+import time
+import random
+import argparse
+
+import numpy as np
+import torch
+from transformers import AutoModelForCausalLM
+from peft import LoraConfig, get_peft_model
+
+from train import BatchCollator, LengthBucketSampler, load_tokenizer, packed_rows, tokenized_training_data
+
+def padded_batches(count, batch_size, seed):
+    order = list(range(count))
+    random.Random(seed).shuffle(order)
+    return [order[i:i + batch_size] for i in range(0, count, batch_size)]
+
+def run_epoch(model, rows, batches, collator, lr):
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=lr)
+    model.train()
+    started = time.perf_counter()
+    for batch in batches:
+        loss = model(**collator([rows[i] for i in batch])).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+    return time.perf_counter() - started
+
+def packed_loss_matches(model, examples, max_length, pad_token_id):
+    """Summed token loss of one packed row vs the same examples run separately"""
+    model.eval()
+    # The shortest examples, so the row holds several of them
+    row = packed_rows(sorted(examples, key=len)[:8], max_length)[0]
+    starts = [i for i, position in enumerate(row["position_ids"]) if position == 0]
+    with torch.no_grad():
+        batch = BatchCollator(pad_token_id, packed=True)([row])
+        logits = model(input_ids=batch["input_ids"], position_ids=batch["position_ids"]).logits[0]
+        packed = torch.nn.functional.cross_entropy(logits[:-1], batch["labels"][0, 1:], ignore_index=-100, reduction="sum")
+
+        separate = 0.0
+        for start, end in zip(starts, starts[1:] + [len(row["input_ids"])]):
+            ids = torch.tensor([row["input_ids"][start:end]])
+            logits = model(input_ids=ids).logits[0]
+            separate += torch.nn.functional.cross_entropy(logits[:-1], ids[0, 1:], reduction="sum")
+    return abs(float(packed) - float(separate)) <= 1e-5 * max(1.0, abs(float(separate))), len(starts)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark padded vs bucketed vs packed SFT batching")
+    parser.add_argument("--model", required=True, help="Causal LM (a tiny one is fine on CPU)")
+    parser.add_argument("--data", required=True, help="Training export (JSON or JSONL) from the backend")
+    parser.add_argument("--max-length", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-batch-tokens", type=int, help="Bucketed token budget (default: batch size x p95 example length)")
+    parser.add_argument("--modes", default="padded,bucketed,packed")
+    parser.add_argument("--lr", type=float, default=2e-4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    print("⏱️ DevAI SFT Batching Benchmark")
+    print("=" * 50)
+    torch.manual_seed(args.seed)
+    tokenizer = load_tokenizer(args.model)
+    examples = tokenized_training_data(args.data, tokenizer, max_length=args.max_length)
+    lengths = [len(example) for example in examples]
+    print(f"📊 {len(examples)} examples, {sum(lengths):,} tokens, max length {args.max_length}")
+    max_batch_tokens = args.max_batch_tokens or args.batch_size * int(np.percentile(lengths, 95))
+
+    results = []
+    for mode in args.modes.split(","):
+        torch.manual_seed(args.seed)
+        model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32)
+        model.config.use_cache = False
+        model = get_peft_model(model, LoraConfig(r=8, lora_alpha=16, target_modules="all-linear", task_type="CAUSAL_LM"))
+
+        if mode == "packed":
+            rows = packed_rows(examples, args.max_length)
+            collator = BatchCollator(tokenizer.pad_token_id, packed=True)
+            batches = padded_batches(len(rows), args.batch_size, args.seed)
+        else:
+            rows = [{"input_ids": example} for example in examples]
+            collator = BatchCollator(tokenizer.pad_token_id)
+            batches = (LengthBucketSampler(lengths, args.batch_size, max_batch_tokens, seed=args.seed).batches(0)
+                       if mode == "bucketed" else padded_batches(len(rows), args.batch_size, args.seed))
+
+        seconds = run_epoch(model, rows, batches, collator, args.lr)
+        result = {
+            "mode": mode,
+            "steps": len(batches),
+            "seconds": round(seconds, 2),
+            "padding_waste": round(collator.padding_waste, 4),
+            "effective_tokens_per_second": round(collator.real_tokens / seconds, 1),
+            "padded_tokens_per_second": round(collator.padded_tokens / seconds, 1)
+        }
+        if mode == "packed":
+            result["packed_loss_matches"], result["checked_examples"] = packed_loss_matches(model, examples, args.max_length, tokenizer.pad_token_id)
+        print(
+            f"  {mode:<9} {result['steps']:>5} steps  {result['seconds']:>8.2f}s  padding {100 * result['padding_waste']:>5.1f}%  "
+            f"{result['effective_tokens_per_second']:>9.1f} effective tok/s"
+            + (f"  packed loss {'matches' if result['packed_loss_matches'] else 'DIFFERS from'} separate examples" if mode == "packed" else "")
+        )
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "config": vars(args), "results": results}, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+DevAI training data preparation
+Streams training pairs out of backend exports without holding them in
+memory. Two formats are read and written:
+- JSONL (.jsonl/.ndjson): one pair per line, plus one {"export": {...}} line
+  with the export's other fields (stats, exportedAt, ...)
+- legacy JSON: {"trainingPairs": [...], "stats": {...}} as served by
+  /api/training/export-data, parsed incrementally
+"""
+
+import json
+import codecs
+import argparse
+from itertools import islice
+
+PAIRS_KEY = "trainingPairs"
+HEADER_KEY = "export"
+JSONL_EXTENSIONS = (".jsonl", ".ndjson")
+
+def is_jsonl(path):
+    return str(path).lower().endswith(JSONL_EXTENSIONS)
+
+def batches(iterable, size):
+    """Lists of up to size items from any iterable"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+class TrainingExport:
+    """Training pairs streamed from a backend export file or HTTP response
+
+    Iterating yields the pairs one at a time. The export's other fields fill
+    in header as the file is read; the backend writes stats after the pairs,
+    so they are complete once iteration finishes.
+    """
+
+    def __init__(self, source, jsonl=None, chunk_size=1 << 16):
+        self.source = source
+        self.jsonl = is_jsonl(source) if jsonl is None and isinstance(source, str) else bool(jsonl)
+        self.chunk_size = chunk_size
+        self.header = {}
+        self.count = 0
+
+    @property
+    def stats(self):
+        return self.header.get("stats", {})
+
+    def __iter__(self):
+        self.header = {}
+        self.count = 0
+        if not isinstance(self.source, str):
+            yield from self._counted(self._read(self.source))
+            return
+        with open(self.source, "rb") as f:
+            yield from self._counted(self._read(f))
+
+    def _counted(self, pairs):
+        for pair in pairs:
+            self.count += 1
+            yield pair
+
+    def _read(self, stream):
+        return self._jsonl_pairs(stream) if self.jsonl else self._json_pairs(stream)
+
+    def _jsonl_pairs(self, stream):
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Line {number} of the training export is not valid JSON: {e}") from e
+            if isinstance(record, dict) and HEADER_KEY in record and "instruction" not in record:
+                self.header.update(record[HEADER_KEY])
+            else:
+                yield record
+
+    def _json_pairs(self, stream):
+        """Pairs from {"trainingPairs": [...], ...}, decoding one value at a time"""
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        state = {"buffer": "", "pos": 0, "eof": False}
+
+        def fill():
+            # Read at least as much as is buffered so a value larger than
+            # chunk_size is re-decoded a logarithmic number of times
+            raw = stream.read(max(self.chunk_size, len(state["buffer"]) - state["pos"]))
+            text = utf8.decode(raw, final=not raw) if isinstance(raw, bytes) else raw
+            state["buffer"] = state["buffer"][state["pos"]:] + text
+            state["pos"] = 0
+            state["eof"] = not raw
+            return bool(raw)
+
+        def peek():
+            """Next non-whitespace character, left unconsumed"""
+            while True:
+                buffer, pos = state["buffer"], state["pos"]
+                while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                    pos += 1
+                state["pos"] = pos
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not fill():
+                    raise ValueError("Training export ended unexpectedly")
+
+        def next_char():
+            char = peek()
+            state["pos"] += 1
+            return char
+
+        def value():
+            peek()
+            while True:
+                try:
+                    decoded, end = decoder.raw_decode(state["buffer"], state["pos"])
+                    # A number at the end of the buffer may continue in the next chunk
+                    if end < len(state["buffer"]) or state["eof"]:
+                        state["pos"] = end
+                        return decoded
+                except json.JSONDecodeError:
+                    if state["eof"]:
+                        raise
+                fill()
+
+        def expect(char):
+            found = next_char()
+            if found != char:
+                raise ValueError(f"Expected '{char}' in training export, found '{found}'")
+
+        expect("{")
+        while peek() != "}":
+            key = value()
+            expect(":")
+            if key == PAIRS_KEY:
+                expect("[")
+                while peek() != "]":
+                    yield value()
+                    if peek() == ",":
+                        next_char()
+                    elif peek() != "]":
+                        raise ValueError(f"Expected ',' or ']' between training pairs, found '{peek()}'")
+                next_char()
+            else:
+                self.header[key] = value()
+            if peek() == ",":
+                next_char()
+            elif peek() != "}":
+                raise ValueError(f"Expected ',' or '}}' in training export, found '{peek()}'")
+
+def write_export(export, path, header=None):
+    """Stream pairs to path as JSONL or legacy JSON; returns the pair count
+
+    export is a TrainingExport (its header is written too) or any iterable
+    of pairs. The header goes last because streamed sources only finish it
+    after the pairs.
+    """
+    count = 0
+    with open(path, "w") as f:
+        if is_jsonl(path):
+            for pair in export:
+                f.write(json.dumps(pair) + "\n")
+                count += 1
+            f.write(json.dumps({HEADER_KEY: getattr(export, "header", {}) if header is None else header}) + "\n")
+        else:
+            f.write(f'{{"{PAIRS_KEY}": [')
+            for pair in export:
+                f.write((",\n" if count else "\n") + json.dumps(pair))
+                count += 1
+            f.write("\n]")
+            for key, value in (getattr(export, "header", {}) if header is None else header).items():
+                f.write(f",\n{json.dumps(key)}: {json.dumps(value)}")
+            f.write("\n}\n")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a DevAI training export between legacy JSON and JSONL")
+    parser.add_argument("input", help="Training export (.json or .jsonl)")
+    parser.add_argument("output", help="Converted export; .jsonl/.ndjson writes JSONL, anything else legacy JSON")
+    args = parser.parse_args()
+
+    export = TrainingExport(args.input)
+    count = write_export(export, args.output)
+    print(f"✅ Wrote {count} training pairs to {args.output}")
+    print(f"📈 Stats: {export.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Export a DevAI fine-tune for fast-start inference
+Merges the LoRA adapter saved by train.py into the base weights, writes
+sharded safetensors that load memory-mapped, optionally adds an int8
+dynamically quantized CPU variant, and compares load time, resident memory
+and tokens/sec against loading base + adapter at runtime
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from pathlib import Path
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import PeftModel
+
+# Shared with the serving engine so exports load the same way there
+sys.path.insert(0, str(Path(__file__).parent.parent / "serve"))
+from utils import load_causal_lm, quantize_int8, save_int8
+
+DTYPES = {"auto": "auto", "float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+def resolve_base_model(adapter_dir: str, base_model: str = None) -> str:
+    if base_model:
+        return base_model
+    with open(os.path.join(adapter_dir, "adapter_config.json")) as f:
+        base_model = json.load(f).get("base_model_name_or_path")
+    return base_model or "bigcode/starcoder2-7b"
+
+def tokenizer_source(adapter_dir: str, base_model: str) -> str:
+    # train.py saves the tokenizer next to the adapter
+    return adapter_dir if os.path.exists(os.path.join(adapter_dir, "tokenizer_config.json")) else base_model
+
+def dir_size_mb(path: str) -> float:
+    return round(sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file()) / 1e6, 1)
+
+def rss_mb() -> float:
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / 1e6, 1)
+    except ImportError:
+        import resource
+        # ru_maxrss is a peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1e6 if sys.platform == "darwin" else 1024), 1)
+
+def merge_adapter(adapter_dir: str, base_model: str, output_dir: str, dtype: str, max_shard_size: str):
+    print(f"🔧 Loading base model {base_model} ({dtype})")
+    model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=DTYPES[dtype])
+    print(f"🧩 Merging adapter {adapter_dir}")
+    model = PeftModel.from_pretrained(model, adapter_dir).merge_and_unload()
+
+    print(f"💾 Writing merged safetensors shards (max {max_shard_size}) to {output_dir}")
+    model.save_pretrained(output_dir, safe_serialization=True, max_shard_size=max_shard_size)
+    AutoTokenizer.from_pretrained(tokenizer_source(adapter_dir, base_model)).save_pretrained(output_dir)
+    print(f"✅ Merged model: {dir_size_mb(output_dir)} MB")
+
+def export_int8(merged_dir: str, output_dir: str):
+    print("🔧 Quantizing Linear layers to int8 (dynamic, CPU)")
+    model = AutoModelForCausalLM.from_pretrained(merged_dir, torch_dtype=torch.float32)
+    save_int8(quantize_int8(model.eval()), output_dir)
+    AutoTokenizer.from_pretrained(merged_dir).save_pretrained(output_dir)
+    if os.path.exists(os.path.join(merged_dir, "generation_config.json")):
+        shutil.copy(os.path.join(merged_dir, "generation_config.json"), output_dir)
+    print(f"✅ int8 model: {dir_size_mb(output_dir)} MB")
+
+def measure(variant: str, args: argparse.Namespace) -> dict:
+    """Cold-load one variant in this (fresh) process and time generation"""
+    torch.manual_seed(0)
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    if variant == "unmerged":
+        base_model = resolve_base_model(args.adapter, args.base)
+        model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch.float32)
+        model = PeftModel.from_pretrained(model, args.adapter)
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_source(args.adapter, base_model))
+        path = args.adapter
+    else:
+        path = args.output if variant == "merged" else f"{args.output}-int8"
+        model = load_causal_lm(path)
+        tokenizer = AutoTokenizer.from_pretrained(path)
+    model.eval()
+    load_seconds = time.perf_counter() - started
+    rss_loaded = rss_mb()
+
+    inputs = tokenizer(args.prompt, return_tensors="pt")
+    settings = dict(do_sample=False, pad_token_id=tokenizer.eos_token_id)
+    with torch.inference_mode():
+        # The first call pays one-off kernel and allocator setup
+        model.generate(**inputs, max_new_tokens=2, **settings)
+        started = time.perf_counter()
+        output = model.generate(**inputs, max_new_tokens=args.max_new_tokens, min_new_tokens=args.max_new_tokens, **settings)
+        seconds = time.perf_counter() - started
+
+    generated = output[0, inputs["input_ids"].shape[1]:].tolist()
+    return {
+        "variant": variant,
+        "path": path,
+        "disk_mb": dir_size_mb(path) if variant != "unmerged" else None,
+        "load_seconds": round(load_seconds, 3),
+        "rss_mb": rss_loaded,
+        "rss_delta_mb": round(rss_loaded - rss_before, 1),
+        "tokens_per_second": round(len(generated) / seconds, 2),
+        "generated_ids": generated
+    }
+
+def benchmark(args: argparse.Namespace, variants: list) -> list:
+    """Measure each variant in its own process so load time and memory are cold"""
+    results = []
+    for variant in variants:
+        command = [sys.executable, __file__, "--adapter", args.adapter, "--output", args.output,
+                   "--measure", variant, "--prompt", args.prompt, "--max-new-tokens", str(args.max_new_tokens)]
+        if args.base:
+            command += ["--base", args.base]
+        completed = subprocess.run(command, capture_output=True, text=True, check=True)
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    reference = results[0]["generated_ids"]
+    print("\n📊 Load and generation comparison")
+    for result in results:
+        result["matches_unmerged"] = result["generated_ids"] == reference
+        print(
+            f"  {result['variant']:<9} load {result['load_seconds']:>7.2f}s  rss {result['rss_mb']:>9.1f} MB  "
+            f"{result['tokens_per_second']:>8.2f} tok/s  "
+            f"disk {result['disk_mb'] if result['disk_mb'] is not None else '-':>8} MB  "
+            f"greedy output {'matches' if result['matches_unmerged'] else 'differs from'} unmerged"
+        )
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and quantize a DevAI adapter for fast-start inference")
+    parser.add_argument("--adapter", required=True, help="Adapter directory written by train.py")
+    parser.add_argument("--base", help="Base model (default: from adapter_config.json)")
+    parser.add_argument("--output", help="Merged model directory (default: <adapter>-merged)")
+    parser.add_argument("--dtype", choices=list(DTYPES), default="auto", help="Weight dtype of the merged export")
+    parser.add_argument("--max-shard-size", default="2GB", help="Largest safetensors shard")
+    parser.add_argument("--int8", action="store_true", help="Also write an int8 dynamically quantized CPU variant to <output>-int8")
+    parser.add_argument("--benchmark", action="store_true", help="Compare load time, memory and tokens/sec against base + adapter")
+    parser.add_argument("--prompt", default="### Instruction:\nHow do I create a React component?\n\n### Response:\n")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--report", help="Write the benchmark results to this JSON file")
+    parser.add_argument("--measure", choices=["unmerged", "merged", "int8"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.output = args.output or f"{args.adapter.rstrip('/')}-merged"
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args)))
+        return
+
+    print("📦 DevAI Model Export")
+    print("=" * 50)
+    base_model = resolve_base_model(args.adapter, args.base)
+    merge_adapter(args.adapter, base_model, args.output, args.dtype, args.max_shard_size)
+    if args.int8:
+        export_int8(args.output, f"{args.output}-int8")
+
+    if args.benchmark:
+        results = benchmark(args, ["unmerged", "merged"] + (["int8"] if args.int8 else []))
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump({"base_model": base_model, "adapter": args.adapter, "results": results}, f, indent=2)
+            print(f"\n💾 Report written to {args.report}")
+
+    print("\n📋 Next steps:")
+    print(f"   • Serve merged: DEVAI_BASE_MODEL={args.output} python serve/api.py")
+    if args.int8:
+        print(f"   • Serve int8 on CPU: DEVAI_BASE_MODEL={args.output}-int8 python serve/api.py")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,24 @@
 import os 
+import sys
+import math
+import time
+import random
+from bisect import bisect_left, insort
 import numpy as np 
 import pandas as pd 
 import torch
 import json
+import shutil
+import tempfile
+import hashlib
 import argparse
-from datasets import Dataset
-from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments
-from peft import LoraConfig, get_peft_model
-from trl import SFTTrainer
+from datetime import datetime, timezone
+from torch.utils.data import DataLoader
+import transformers
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, Trainer, TrainerCallback, TrainingArguments
+from peft import LoraConfig, PeftModel, get_peft_model
+
+from data_preparation import TrainingExport, batches, write_export
 
 # Optional bitsandbytes import for quantization (RunPod only)
 try:
@@ -19,6 +30,15 @@ except ImportError:
     print("💡 This is normal on Mac - quantization will run on RunPod")
     QUANTIZATION_AVAILABLE = False
 
+# --batching packed needs the model to build block-diagonal masks from
+# restarting position ids; older transformers let packed examples attend
+# to each other instead
+try:
+    from transformers.masking_utils import find_packed_sequence_indices  # noqa: F401
+    PACKED_ATTENTION_AVAILABLE = True
+except ImportError:
+    PACKED_ATTENTION_AVAILABLE = False
+
 # --- 1. Load a Quantized model ------------------------------------------------
 # Article: https://huggingface.co/blog/dvgodoy/fine-tuning-llm-hugging-face
 # QLoRA: https://arxiv.org/pdf/2305.14314
@@ -35,36 +55,22 @@ else:
 
 repo_id = 'bigcode/starcoder2-7b' # Good coding reasoning
 
-# Load model with conditional quantization
-if QUANTIZATION_AVAILABLE and bnb_config:
-    print("🔧 Loading model with 4-bit quantization (QLoRA)")
-    model = AutoModelForCausalLM.from_pretrained(
-        repo_id, device_map="cuda:0", quantization_config=bnb_config
-    )
-else:
-    print("⚠️ Loading model without quantization (Mac compatibility)")
-    model = AutoModelForCausalLM.from_pretrained(
-        repo_id, device_map="auto" if torch.cuda.is_available() else "cpu"
-    )
+# Training shape shared by the trainer and --plan
+MAX_SEQ_LENGTH = 1024
+GRADIENT_ACCUMULATION_STEPS = 2
+
+# Pairs formatted and tokenized per call while streaming the export
+TOKENIZE_BATCH = 1000
 
-print(model.get_memory_footprint()/1e6)
-# Even after quantization, the model still takes up a bit more than 2 gigabytes of RAM. 
-# The quantization procedure focuses on the linear layers within the Transformer decoder blocks (also referred to as "layers" in some cases):
-# Quantized model can be used for inference but not for any further training.
-# So we reduce the space those layers take, but we can't update them -> LoRA.
+# Pre-tokenized datasets, shared by runs, sweeps and resumed jobs
+TOKEN_CACHE_DIR = os.getenv("DEVAI_TOKEN_CACHE_DIR", os.path.expanduser("~/.cache/devai/tokens"))
+TOKEN_CACHE_MAX_GB = float(os.getenv("DEVAI_TOKEN_CACHE_MAX_GB", "20"))
 
 # --- 2. Configure LoRA ---------------------------------------------------------
 # Low-rank adapters can be attached to each and every quantized layer.
 # The adapters are (mostly) regular Linear layers that can be updated.
 # The trick: They're significantly smaller than the quantized layers.
 
-# Prepare model for training (quantized or standard)
-if QUANTIZATION_AVAILABLE and bnb_config:
-    model = prepare_model_for_kbit_training(model)
-    print("✅ Model prepared for quantized training")
-else:
-    print("✅ Model prepared for standard training")
-
 config = LoraConfig(
     r=8, # the rank of the adopter, the lower the fewer parameters we'll need to train
     lora_alpha=16, # multiplier, typically 2x
@@ -74,56 +80,725 @@ config = LoraConfig(
     target_modules=['o_proj', 'qkv_proj', 'gate_up_proj', 'down_proj'],
 )
 
-model = get_peft_model(model, config)
+def load_model(model_id=repo_id, adapter=None):
+    """Load the base model (4-bit when bitsandbytes is available) with LoRA adapters attached
+
+    adapter continues training a saved adapter instead of new LoRA weights.
+    Called from main() only, so --help, --plan and importing this module
+    never pay for the weights.
+    """
+    # Load model with conditional quantization
+    if QUANTIZATION_AVAILABLE and bnb_config:
+        print("🔧 Loading model with 4-bit quantization (QLoRA)")
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id, device_map="cuda:0", quantization_config=bnb_config
+        )
+    else:
+        print("⚠️ Loading model without quantization (Mac compatibility)")
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id, device_map="auto" if torch.cuda.is_available() else "cpu"
+        )
+
+    print(model.get_memory_footprint()/1e6)
+    # Even after quantization, the model still takes up a bit more than 2 gigabytes of RAM. 
+    # The quantization procedure focuses on the linear layers within the Transformer decoder blocks (also referred to as "layers" in some cases):
+    # Quantized model can be used for inference but not for any further training.
+    # So we reduce the space those layers take, but we can't update them -> LoRA.
+
+    # Prepare model for training (quantized or standard)
+    if QUANTIZATION_AVAILABLE and bnb_config:
+        model = prepare_model_for_kbit_training(model)
+        print("✅ Model prepared for quantized training")
+    else:
+        print("✅ Model prepared for standard training")
 
-# The quantized layers (Linear4bit) have turned into lora.Linear4bit modules 
-# There the quantized layer itself became the base_layer with some regular Linear layers (lora_A and lora_B) added to the mix.
+    if adapter:
+        print(f"🧩 Continuing adapter {adapter}")
+        model = PeftModel.from_pretrained(model, adapter, is_trainable=True)
+    else:
+        model = get_peft_model(model, config)
 
-# Since most parameters are frozen, only a tiny fraction of the total number of parameters are currently trainable, thanks to LoRA!
-train_p, tot_p = model.get_nb_trainable_parameters()
-print(f'Trainable parameters:      {train_p/1e6:.2f}M')
-print(f'Total parameters:          {tot_p/1e6:.2f}M')
-print(f'% of trainable parameters: {100*train_p/tot_p:.2f}%')
+    # The quantized layers (Linear4bit) have turned into lora.Linear4bit modules 
+    # There the quantized layer itself became the base_layer with some regular Linear layers (lora_A and lora_B) added to the mix.
+
+    # Since most parameters are frozen, only a tiny fraction of the total number of parameters are currently trainable, thanks to LoRA!
+    train_p, tot_p = model.get_nb_trainable_parameters()
+    print(f'Trainable parameters:      {train_p/1e6:.2f}M')
+    print(f'Total parameters:          {tot_p/1e6:.2f}M')
+    print(f'% of trainable parameters: {100*train_p/tot_p:.2f}%')
+    return model
 
 
 # 3. Load & format the data
-def load_training_data(data_file):
-    """Load training data from TypeScript backend export"""
-    print(f"📊 Loading training data from: {data_file}")
-    
-    with open(data_file, 'r') as f:
-        data = json.load(f)
-    
-    training_pairs = data['trainingPairs']
-    print(f"✅ Found {len(training_pairs)} training pairs")
-    print(f"📈 Stats: {data['stats']}")
-    
-    # Format for SFTTrainer - instruction-response format
-    formatted_data = []
-    for pair in training_pairs:
-        # Create conversational format
-        conversation = f"### Instruction:\n{pair['instruction']}\n\n### Response:\n{pair['response']}"
-        formatted_data.append(conversation)
-    
-    return formatted_data
+def format_pair(pair):
+    """Instruction-response format the model is fine-tuned (and served) on"""
+    return f"### Instruction:\n{pair['instruction']}\n\n### Response:\n{pair['response']}"
 
 # 4. Tokenizer  
-tokenizer = AutoTokenizer.from_pretrained(repo_id)
-tokenizer.pad_token = tokenizer.eos_token
-tokenizer.padding_side = "right"
+def load_tokenizer(model_id=repo_id):
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "right"
+    return tokenizer
+
+# --- Batching: padding, packing and length buckets -------------------------------
+# Most pairs are far shorter than MAX_SEQ_LENGTH, so right-padded batches are
+# largely padding. "packed" concatenates examples into full rows; "bucketed"
+# batches examples of similar length under a token budget. All three modes
+# share the trainer and collator, so they differ only in how batches form.
+
+def tokenize_examples(texts, tokenizer, max_length=MAX_SEQ_LENGTH):
+    """Token ids per example, truncated to max_length and ending in eos"""
+    ids = tokenizer(texts, truncation=True, max_length=max_length - 1)["input_ids"]
+    return [example + [tokenizer.eos_token_id] for example in ids]
+
+def pack_examples(lengths, max_length=MAX_SEQ_LENGTH):
+    """Best-fit-decreasing bins of example indices, each bin at most max_length tokens"""
+    bins = []
+    free = []  # sorted (free space, bin index)
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        slot = bisect_left(free, (lengths[i], -1))
+        if slot == len(free):
+            bins.append([i])
+            insort(free, (max_length - lengths[i], len(bins) - 1))
+        else:
+            space, b = free.pop(slot)
+            bins[b].append(i)
+            insort(free, (space - lengths[i], b))
+    return bins
+
+def packed_rows(examples, max_length=MAX_SEQ_LENGTH):
+    """Rows of concatenated examples with position ids restarting per example
+
+    The first token of each example gets label -100 so no example learns
+    to predict the start of the next one.
+    """
+    rows = []
+    for group in pack_examples([len(example) for example in examples], max_length):
+        input_ids, position_ids, labels = [], [], []
+        for i in group:
+            input_ids += examples[i]
+            position_ids += range(len(examples[i]))
+            labels += [-100] + examples[i][1:]
+        rows.append({"input_ids": input_ids, "position_ids": position_ids, "labels": labels})
+    return rows
+
+class BatchCollator:
+    """Right-pads rows into a batch and counts real vs padded tokens
+
+    Packed rows carry position_ids and no attention mask: the model then
+    builds a block-diagonal causal mask from the restarting positions, so
+    packed examples never attend to each other (padding becomes one more
+    such block, with labels -100). Needs use_cache=False while training.
+    """
+
+    def __init__(self, pad_token_id, packed=False):
+        self.pad_token_id = pad_token_id
+        self.packed = packed
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def __call__(self, rows):
+        longest = max(len(row["input_ids"]) for row in rows)
+        batch = {"input_ids": [], "labels": [], "position_ids" if self.packed else "attention_mask": []}
+        for row in rows:
+            length = len(row["input_ids"])
+            pad = longest - length
+            batch["input_ids"].append(row["input_ids"] + [self.pad_token_id] * pad)
+            batch["labels"].append(row.get("labels", row["input_ids"]) + [-100] * pad)
+            if self.packed:
+                batch["position_ids"].append(row["position_ids"] + list(range(pad)))
+            else:
+                batch["attention_mask"].append([1] * length + [0] * pad)
+            self.real_tokens += length
+        self.padded_tokens += longest * len(rows)
+        return {key: torch.tensor(value) for key, value in batch.items()}
+
+    @property
+    def padding_waste(self):
+        return 1 - self.real_tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+class LengthBucketSampler:
+    """Batch sampler grouping examples of similar length under a token budget
+
+    Each epoch shuffles, cuts the order into buckets of bucket_size, sorts
+    each bucket by length and fills batches up to batch_size examples or
+    max_batch_tokens padded tokens; batch order is shuffled again.
+    """
+
+    def __init__(self, lengths, batch_size, max_batch_tokens, bucket_size=None, seed=0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.bucket_size = bucket_size or batch_size * 50
+        self.seed = seed
+        self.epoch = 0
+
+    def batches(self, epoch):
+        rng = random.Random(self.seed + epoch)
+        order = list(range(len(self.lengths)))
+        rng.shuffle(order)
+        batches = []
+        for start in range(0, len(order), self.bucket_size):
+            batch, longest = [], 0
+            for i in sorted(order[start:start + self.bucket_size], key=lambda i: self.lengths[i]):
+                longest_with = max(longest, self.lengths[i])
+                if batch and (len(batch) == self.batch_size or longest_with * (len(batch) + 1) > self.max_batch_tokens):
+                    batches.append(batch)
+                    batch, longest_with = [], self.lengths[i]
+                batch.append(i)
+                longest = longest_with
+            if batch:
+                batches.append(batch)
+        rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        batches = self.batches(self.epoch)
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        return len(self.batches(self.epoch))
+
+# --- Tokenized dataset cache -----------------------------------------------------
+# Keyed on the export's bytes, the tokenizer and the prompt template, so an
+# unchanged dataset is never re-read, re-formatted or re-tokenized. Token ids
+# are stored as flat int32 shards plus offsets and opened memory-mapped.
+
+class TokenizedExamples:
+    """Read-only sequence of token id lists over memory-mapped shards"""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.shards = []
+        for shard in range(len(meta["shards"])):
+            tokens = np.load(os.path.join(path, f"tokens-{shard:05d}.npy"), mmap_mode="r")
+            offsets = np.load(os.path.join(path, f"offsets-{shard:05d}.npy"), mmap_mode="r")
+            self.shards.append((tokens, offsets))
+        self.starts = np.cumsum([0] + meta["shards"])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        shard = int(np.searchsorted(self.starts, i, side="right")) - 1
+        tokens, offsets = self.shards[shard]
+        row = i - self.starts[shard]
+        return tokens[offsets[row]:offsets[row + 1]].tolist()
+
+    def __iter__(self):
+        for tokens, offsets in self.shards:
+            for row in range(len(offsets) - 1):
+                yield tokens[offsets[row]:offsets[row + 1]].tolist()
+
+    @property
+    def lengths(self):
+        return np.concatenate([np.diff(offsets) for _, offsets in self.shards]) if self.shards else np.zeros(0, dtype=np.int64)
+
+class TokenCache:
+    """Content-addressed directory of tokenized training exports
+
+    Each entry is <root>/<key>/ with meta.json and tokens/offsets shards.
+    Entries are written to a temporary directory and renamed into place, so
+    concurrent runs never see half-written shards. Least recently used
+    entries are evicted once the directory exceeds max_bytes.
+    """
+
+    VERSION = 1
+    SHARD_EXAMPLES = 50_000
+
+    def __init__(self, root=TOKEN_CACHE_DIR, max_bytes=int(TOKEN_CACHE_MAX_GB * 1e9)):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def file_hash(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def tokenizer_hash(tokenizer):
+        """Identity from the tokenizer's rules, not its path or hub name"""
+        backend = getattr(tokenizer, "backend_tokenizer", None)
+        if backend is not None:
+            # Truncation and padding are per-call settings the tokenizer remembers
+            state = {key: value for key, value in json.loads(backend.to_str()).items() if key not in ("truncation", "padding")}
+        else:
+            state = sorted(tokenizer.get_vocab().items())
+        state = json.dumps(state, sort_keys=True)
+        special = json.dumps([type(tokenizer).__name__, tokenizer.eos_token_id, tokenizer.all_special_tokens])
+        return hashlib.sha256((state + special).encode()).hexdigest()
+
+    def key(self, data_file, tokenizer, max_length=MAX_SEQ_LENGTH):
+        template = format_pair({"instruction": "\x00instruction\x00", "response": "\x00response\x00"})
+        parts = [str(self.VERSION), self.file_hash(data_file), self.tokenizer_hash(tokenizer), template, str(max_length)]
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            examples = TokenizedExamples(path, meta)
+        except (OSError, ValueError, KeyError):
+            return None
+        # The meta file's mtime is the entry's last use for eviction
+        os.utime(os.path.join(path, "meta.json"))
+        return examples
+
+    def put(self, key, shards, meta):
+        """Write an iterable of token id list shards under key and return the entry
+
+        meta is written after the last shard, so a shard generator can still
+        fill it in.
+        """
+        scratch = os.path.join(self.root, f".{key}.{os.getpid()}.tmp")
+        shutil.rmtree(scratch, ignore_errors=True)
+        os.makedirs(scratch)
+        counts = []
+        tokens_total = 0
+        for shard, examples in enumerate(shards):
+            offsets = np.zeros(len(examples) + 1, dtype=np.int64)
+            np.cumsum([len(example) for example in examples], out=offsets[1:])
+            tokens = np.concatenate([np.asarray(example, dtype=np.int32) for example in examples] or [np.zeros(0, dtype=np.int32)])
+            np.save(os.path.join(scratch, f"tokens-{shard:05d}.npy"), tokens)
+            np.save(os.path.join(scratch, f"offsets-{shard:05d}.npy"), offsets)
+            counts.append(len(examples))
+            tokens_total += int(offsets[-1])
+        with open(os.path.join(scratch, "meta.json"), "w") as f:
+            json.dump({**meta, "examples": sum(counts), "tokens": tokens_total, "shards": counts, "created": time.time()}, f)
+        try:
+            os.rename(scratch, os.path.join(self.root, key))
+        except OSError:
+            # Another run cached the same key first; its shards are identical
+            shutil.rmtree(scratch, ignore_errors=True)
+        self.evict(keep=key)
+        return self.get(key)
+
+    def entries(self):
+        """(last used, bytes, key) of every complete entry"""
+        entries = []
+        for key in os.listdir(self.root):
+            path = os.path.join(self.root, key)
+            meta = os.path.join(path, "meta.json")
+            if key.startswith(".") or not os.path.exists(meta):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            entries.append((os.path.getmtime(meta), size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= size
+            print(f"🧹 Evicted tokenized dataset {key[:12]} ({size / 1e6:.1f} MB) from {self.root}")
+
+def tokenized_training_data(data_file, tokenizer, cache=None, max_length=MAX_SEQ_LENGTH):
+    """Token ids per training pair, from the cache when this export was tokenized before
+
+    Without a cache the same shards are written to a scratch directory that
+    is removed with the returned examples, so memory stays at one shard.
+    """
+    if cache is None:
+        scratch = tempfile.TemporaryDirectory(prefix="devai-tokens-")
+        examples = write_tokenized(data_file, tokenizer, TokenCache(scratch.name), "scratch", max_length)
+        examples.scratch = scratch
+        return examples
+
+    key = cache.key(data_file, tokenizer, max_length)
+    examples = cache.get(key)
+    if examples is not None:
+        print(f"🎯 Token cache hit {key[:12]}: {len(examples)} examples, {examples.meta['tokens']:,} tokens (tokenization skipped)")
+        print(f"📈 Stats: {examples.meta['stats']}")
+        return examples
+
+    print(f"🔤 Token cache miss {key[:12]}, tokenizing")
+    examples = write_tokenized(data_file, tokenizer, cache, key, max_length)
+    print(f"💾 Cached {len(examples)} tokenized examples ({examples.meta['tokens']:,} tokens) in {os.path.join(cache.root, key)}")
+    return examples
+
+def write_tokenized(data_file, tokenizer, cache, key, max_length=MAX_SEQ_LENGTH):
+    """Tokenize an export into cache entry key, one shard of pairs in memory at a time"""
+    print(f"📊 Loading training data from: {data_file}")
+    export = TrainingExport(data_file)
+    meta = {"data_file": os.path.abspath(data_file), "tokenizer": tokenizer.name_or_path, "max_length": max_length}
+    latest = None
+
+    def shards():
+        nonlocal latest
+        for shard in batches(export, cache.SHARD_EXAMPLES):
+            # Newest pair timestamp for the watermark, so cache hits needn't re-read the export
+            latest = max(filter(None, [latest] + [pair_timestamp(pair) for pair in shard]), default=None)
+            # int32 arrays take a tenth of the memory of lists of Python ints
+            yield [np.asarray(example, dtype=np.int32) for batch in batches(shard, TOKENIZE_BATCH)
+                   for example in tokenize_examples([format_pair(pair) for pair in batch], tokenizer, max_length)]
+        # The backend writes stats after the pairs
+        meta["stats"] = export.stats
+        meta["latestTimestamp"] = latest.isoformat() if latest else None
+
+    examples = cache.put(key, shards(), meta)
+    print(f"✅ Found {export.count} training pairs")
+    print(f"📈 Stats: {export.stats}")
+    return examples
+
+class TokenizedRows(torch.utils.data.Dataset):
+    """{"input_ids": ...} rows over tokenized examples, read on demand"""
+
+    def __init__(self, examples):
+        self.examples = examples
+
+    def __len__(self):
+        return len(self.examples)
+
+    def __getitem__(self, i):
+        return {"input_ids": self.examples[i]}
+
+class BatchingTrainer(Trainer):
+    """Trainer that can take a batch sampler for its training dataloader"""
+
+    def __init__(self, *args, batch_sampler=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_sampler = batch_sampler
+
+    def get_train_dataloader(self):
+        if self.batch_sampler is None:
+            return super().get_train_dataloader()
+        dataloader = DataLoader(self.train_dataset, batch_sampler=self.batch_sampler, collate_fn=self.data_collator)
+        return self.accelerator.prepare(dataloader)
+
+class ThroughputCallback(TrainerCallback):
+    """Adds padding waste and effective (non-padding) tokens/sec to the logs"""
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.started = None
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.started = time.perf_counter()
+
+    def summary(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            "padding_waste": round(self.collator.padding_waste, 4),
+            "effective_tokens_per_second": round(self.collator.real_tokens / seconds, 1) if seconds else 0.0
+        }
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is not None and self.started is not None:
+            logs.update(self.summary())
+
+    def on_train_end(self, args, state, control, **kwargs):
+        summary = self.summary()
+        print(f"📦 Padding waste {100 * summary['padding_waste']:.1f}%, {summary['effective_tokens_per_second']:.0f} effective tokens/sec")
+
+def batching_trainer(model, tokenizer, examples, training_arguments, batching, max_batch_tokens=None):
+    """Trainer for any --batching mode over pre-tokenized examples
+
+    Padded batches are right-padded and length-grouped by the Trainer
+    (group_by_length in training_arguments). Bucketed batches hold at most max_batch_tokens padded tokens, by default
+    batch size times the p95 example length: batches of short examples fill
+    up to the batch size, batches of the longest ones get fewer examples.
+    """
+    training_arguments.remove_unused_columns = False
+    # Packed rows rely on position ids for their attention boundaries
+    model.config.use_cache = False
+
+    if batching == "padded":
+        dataset = TokenizedRows(examples)
+        collator = BatchCollator(tokenizer.pad_token_id)
+        sampler = None
+        print(f"📦 Right-padded batches of {training_arguments.per_device_train_batch_size} examples"
+              f"{', grouped by length' if getattr(training_arguments, 'group_by_length', False) else ''}")
+    elif batching == "packed":
+        training_arguments.group_by_length = False
+        dataset = packed_rows(examples)
+        collator = BatchCollator(tokenizer.pad_token_id, packed=True)
+        sampler = None
+        print(f"📦 Packed {len(examples)} examples into {len(dataset)} rows of up to {MAX_SEQ_LENGTH} tokens")
+    else:
+        training_arguments.group_by_length = False
+        dataset = TokenizedRows(examples)
+        collator = BatchCollator(tokenizer.pad_token_id)
+        per_batch = training_arguments.per_device_train_batch_size
+        lengths = examples.lengths.tolist() if isinstance(examples, TokenizedExamples) else [len(example) for example in examples]
+        if max_batch_tokens is None:
+            max_batch_tokens = per_batch * int(np.percentile(lengths, 95)) if lengths else per_batch * MAX_SEQ_LENGTH
+        # A batch always takes at least one example, however long
+        sampler = LengthBucketSampler(lengths, per_batch, max_batch_tokens, seed=training_arguments.seed)
+        print(f"📦 Length-bucketed batches of up to {per_batch} examples / {max_batch_tokens} tokens")
+
+    return BatchingTrainer(
+        model=model,
+        args=training_arguments,
+        train_dataset=dataset,
+        data_collator=collator,
+        batch_sampler=sampler,
+        callbacks=[ThroughputCallback(collator)]
+    )
+
+# --- Incremental training ----------------------------------------------------------
+# Continues the previous adapter on pairs newer than its watermark, mixed
+# with a replayed sample of older pairs so it doesn't forget them. Each run
+# saves the watermark and optimizer state next to its adapter.
+
+WATERMARK_FILE = "watermark.json"
+OPTIMIZER_STATE_FILE = "optimizer.pt"
+INCREMENTAL_DATA_FILE = "incremental_data.jsonl"
+
+def parse_timestamp(value):
+    """ISO 8601 string (as the backend writes them) to an aware datetime, UTC if no offset"""
+    timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+def pair_timestamp(pair):
+    """metadata.timestamp of a pair, or None"""
+    try:
+        return parse_timestamp(pair["metadata"]["timestamp"])
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return None
+
+def read_watermark(adapter_dir):
+    try:
+        with open(os.path.join(adapter_dir, WATERMARK_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def latest_timestamp(data_file):
+    """Newest pair timestamp in an export, streamed"""
+    timestamps = (pair_timestamp(pair) for pair in TrainingExport(data_file))
+    return max((timestamp for timestamp in timestamps if timestamp), default=None)
+
+def select_incremental_pairs(data_file, since, replay_ratio, output_file):
+    """Write pairs newer than since plus a replay sample of older ones to output_file
+
+    Two streamed passes: count the new pairs, then reservoir-sample
+    replay_ratio older pairs per new pair. Pairs without a timestamp count
+    as older. Returns (new pairs, replayed pairs, newest timestamp).
+    """
+    new_count = sum(1 for pair in TrainingExport(data_file) if (pair_timestamp(pair) or since) > since)
+    replay_size = math.ceil(new_count * replay_ratio)
+    # Seeded by the watermark: reproducible per run, a different sample each run
+    rng = random.Random(since.isoformat())
+    replay, older, latest = [], 0, since
+    header = {}
+
+    def new_pairs(export):
+        nonlocal older, latest
+        for pair in export:
+            timestamp = pair_timestamp(pair)
+            if timestamp and timestamp > since:
+                latest = max(latest, timestamp)
+                yield pair
+                continue
+            older += 1
+            if len(replay) < replay_size:
+                replay.append(pair)
+            elif (slot := rng.randrange(older)) < replay_size:
+                replay[slot] = pair
+        yield from replay
+        # write_export writes the header after the last pair
+        header.update({
+            "source": os.path.abspath(data_file),
+            "exportedAt": export.header.get("exportedAt"),
+            "since": since.isoformat(),
+            "stats": {"totalPairs": new_count + len(replay), "newPairs": new_count, "replayPairs": len(replay), "olderPairs": older}
+        })
+
+    write_export(new_pairs(TrainingExport(data_file)), output_file, header=header)
+    return new_count, len(replay), latest
+
+class OptimizerStateCallback(TrainerCallback):
+    """Restores the previous run's optimizer state (Adam moments) before the first step"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def on_train_begin(self, args, state, control, optimizer=None, **kwargs):
+        try:
+            optimizer.load_state_dict(torch.load(self.path, map_location="cpu", weights_only=False))
+            print(f"♻️ Restored optimizer state from {self.path}")
+        except (ValueError, KeyError, RuntimeError) as e:
+            print(f"⚠️ Optimizer state in {self.path} doesn't match this run, starting fresh: {e}")
+
+def save_training_state(trainer, output_dir, watermark):
+    """Optimizer state and data watermark for the next incremental run"""
+    torch.save(trainer.optimizer.state_dict(), os.path.join(output_dir, OPTIMIZER_STATE_FILE))
+    with open(os.path.join(output_dir, WATERMARK_FILE), "w") as f:
+        json.dump(watermark, f, indent=2)
+    print(f"🔖 Data watermark {watermark['lastDataTimestamp']} saved to {os.path.join(output_dir, WATERMARK_FILE)}")
+
+# --- Dry run ---------------------------------------------------------------------
+def validate_pairs(training_pairs, seen=None, start=0):
+    """(problems that would fail the run or train on garbage, number of duplicate pairs)
+
+    Pass the same seen set and a running start index to validate a stream
+    one batch at a time.
+    """
+    problems = []
+    duplicates = 0
+    seen = set() if seen is None else seen
+    for i, pair in enumerate(training_pairs, start):
+        if not isinstance(pair, dict):
+            problems.append(f"pair {i}: not an object")
+            continue
+        for field in ("instruction", "response"):
+            if not isinstance(pair.get(field), str):
+                problems.append(f"pair {i}: missing or non-string '{field}'")
+            elif not pair[field].strip():
+                problems.append(f"pair {i}: empty '{field}'")
+        # A digest rather than the text keeps seen small on large exports
+        key = hashlib.sha1(json.dumps([str(pair.get("instruction")), str(pair.get("response"))]).encode()).digest()
+        duplicates += key in seen
+        seen.add(key)
+    return problems, duplicates
+
+def lora_parameter_count(model_config):
+    """Base and LoRA parameter counts from an empty (meta device) model"""
+    with torch.device("meta"):
+        skeleton = AutoModelForCausalLM.from_config(model_config)
+    total = sum(p.numel() for p in skeleton.parameters())
+    linear = 0
+    lora = 0
+    targeted = {}
+    for name, module in skeleton.named_modules():
+        if isinstance(module, torch.nn.Linear):
+            linear += module.weight.numel()
+            suffix = name.rsplit(".", 1)[-1]
+            if suffix in config.target_modules:
+                lora += config.r * (module.in_features + module.out_features)
+                targeted[suffix] = targeted.get(suffix, 0) + 1
+    return total, linear, lora, targeted
+
+def plan(args):
+    """Report what a run would do without loading any weights"""
+    started = time.perf_counter()
+    print(f"📋 Planning run on {args.data} (no weights are loaded)")
+    export = TrainingExport(args.data)
+    tokenizer = load_tokenizer(args.model)
+    # One pass over the (streamed) export: validate, then tokenize while it's still valid
+    problems, problem_count, duplicates, seen = [], 0, 0, set()
+    lengths, prompt_lengths = [], []
+    for batch in batches(export, TOKENIZE_BATCH):
+        batch_problems, batch_duplicates = validate_pairs(batch, seen, start=export.count - len(batch))
+        problems += batch_problems[:20 - len(problems)]
+        problem_count += len(batch_problems)
+        duplicates += batch_duplicates
+        if problem_count:
+            continue
+        lengths += [len(ids) for ids in tokenizer([format_pair(p) for p in batch])["input_ids"]]
+        prompt_lengths += [len(ids) for ids in tokenizer([format_pair({**p, "response": ""}) for p in batch])["input_ids"]]
+    for problem in problems:
+        print(f"   ❌ {problem}")
+    if problem_count > len(problems):
+        print(f"   ... and {problem_count - len(problems)} more")
+    if not export.count or problem_count:
+        print(f"❌ Dataset has {problem_count} problem(s) in {export.count} pairs")
+        return 1
+    print(f"✅ {export.count} valid pairs ({export.stats})")
+    if duplicates:
+        print(f"   ⚠️ {duplicates} duplicate pair(s) will be trained on more than once")
+
+    lengths = np.array(lengths)
+    prompt_lengths = np.array(prompt_lengths)
+    trained = np.minimum(lengths, MAX_SEQ_LENGTH)
+    truncated = int((lengths > MAX_SEQ_LENGTH).sum())
+    no_response = int((prompt_lengths >= MAX_SEQ_LENGTH).sum())
+
+    print("\n📏 Sequence lengths (tokens)")
+    for label, q in (("min", 0), ("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)):
+        print(f"   {label}: {int(np.percentile(lengths, q))}")
+    print(f"   truncated at {MAX_SEQ_LENGTH}: {truncated} ({100 * truncated / len(lengths):.1f}%)")
+    if no_response:
+        print(f"   ⚠️ {no_response} pair(s) lose their whole response to truncation")
+
+    # Batches are padded to their longest example; group_by_length sorts first
+    examples_per_step = args.batch_size * GRADIENT_ACCUMULATION_STEPS
+    steps_per_epoch = math.ceil(len(trained) / examples_per_step)
+    sorted_lengths = np.sort(trained)
+    padded = sum(int(sorted_lengths[i:i + args.batch_size].max()) * len(sorted_lengths[i:i + args.batch_size])
+                 for i in range(0, len(sorted_lengths), args.batch_size))
+    tokens_per_epoch = int(trained.sum())
+    print("\n🧮 Schedule")
+    print(f"   steps/epoch: {steps_per_epoch} (batch {args.batch_size} x accumulation {GRADIENT_ACCUMULATION_STEPS})")
+    print(f"   total steps: {steps_per_epoch * args.epochs} over {args.epochs} epoch(s)")
+    print(f"   tokens: {tokens_per_epoch:,}/epoch, {tokens_per_epoch * args.epochs:,} total")
+    print(f"   padding: {100 * (1 - tokens_per_epoch / padded):.1f}% of batch tokens with length-grouped batches")
+
+    model_config = AutoConfig.from_pretrained(args.model)
+    total, linear, lora, targeted = lora_parameter_count(model_config)
+    hidden = model_config.hidden_size
+    layers = model_config.num_hidden_layers
+    heads = model_config.num_attention_heads
+    seq = int(min(np.percentile(lengths, 95), MAX_SEQ_LENGTH))
+    quantized = QUANTIZATION_AVAILABLE
+    # 4-bit linear weights (~0.5 B/param), the rest in 16-bit; LoRA weights,
+    # grads and 8-bit Adam states ~10 B/param; activations with gradient
+    # checkpointing: one hidden state per layer plus one full layer
+    weights = linear * (0.5 if quantized else 2) + (total - linear) * 2
+    adapters = lora * 10
+    activations = args.batch_size * (layers * 2 * seq * hidden + 34 * seq * hidden + 5 * heads * seq * seq)
+    print("\n💾 Memory estimate (GPU)")
+    print(f"   base parameters: {total / 1e9:.2f}B ({'4-bit' if quantized else '16-bit'} weights ~{weights / 1e9:.1f} GB)")
+    matched = ", ".join(f"{name} x{count}" for name, count in targeted.items()) or "no matching modules"
+    print(f"   LoRA parameters: {lora / 1e6:.2f}M on {matched} (~{adapters / 1e9:.2f} GB with grads and optimizer)")
+    unmatched = sorted(set(config.target_modules) - set(targeted))
+    if unmatched:
+        print(f"   ⚠️ LoRA target modules not found in {args.model}: {', '.join(unmatched)}")
+    print(f"   activations at p95 length {seq}: ~{activations / 1e9:.2f} GB")
+    print(f"   total: ~{(weights + adapters + activations) / 1e9:.1f} GB")
+
+    # Frozen base still runs forward, backward through activations and the
+    # checkpoint recompute: ~6 FLOPs per parameter per token
+    flops = 6 * total * padded * args.epochs
+    seconds = flops / (args.plan_tflops * 1e12)
+    print("\n⏱️ Wall-clock estimate")
+    print(f"   ~{seconds / 3600:.2f} h at a sustained {args.plan_tflops:g} TFLOPS")
+    print(f"\n✅ Plan finished in {time.perf_counter() - started:.1f}s")
+    return 0
 
 def main():
     parser = argparse.ArgumentParser(description="Fine-tune DevAI Assistant on RunPod")
-    parser.add_argument("--data", required=True, help="Path to training data JSON file from backend")
+    parser.add_argument("--data", required=True, help="Path to training data export (JSON or JSONL) from backend")
     parser.add_argument("--output", default="./devai_model", help="Output directory for fine-tuned model")
     parser.add_argument("--epochs", type=int, default=3, help="Number of training epochs")
     parser.add_argument("--batch_size", type=int, default=4, help="Training batch size")
+    parser.add_argument("--model", default=repo_id, help="Base model to fine-tune")
+    parser.add_argument("--batching", choices=["padded", "bucketed", "packed"], default="padded",
+                        help="padded: right-padded length-grouped batches; bucketed: similar-length batches under a token budget; "
+                             "packed: examples concatenated into full rows with per-example attention")
+    parser.add_argument("--max_batch_tokens", type=int,
+                        help="--batching bucketed: padded tokens per batch (default: batch size x p95 example length)")
+    parser.add_argument("--resume_adapter", help="Incremental run: continue this adapter on pairs newer than its watermark plus a replay sample")
+    parser.add_argument("--replay_ratio", type=float, default=0.2, help="Older pairs replayed per new pair in an incremental run")
+    parser.add_argument("--since", help="Incremental run: ISO timestamp to use instead of the adapter's saved watermark")
+    parser.add_argument("--token_cache", default=TOKEN_CACHE_DIR, help="Directory of cached tokenized datasets")
+    parser.add_argument("--no_token_cache", action="store_true", help="Always re-tokenize and don't write to the token cache")
+    parser.add_argument("--plan", action="store_true", help="Validate and tokenize the data and estimate the run without loading weights")
+    parser.add_argument("--plan_tflops", type=float, default=60.0, help="Sustained training TFLOPS for the --plan wall-clock estimate")
     
     args = parser.parse_args()
+
+    if args.plan:
+        sys.exit(plan(args))
     
     print("🔥 DevAI Fine-tuning on RunPod")
     print("=" * 50)
-    print(f"🎯 Base model: {repo_id}")
+    print(f"🎯 Base model: {args.model}")
     print(f"📊 Training data: {args.data}")
     print(f"💾 Output directory: {args.output}")
     print(f"🖥️ Device: {'CUDA' if torch.cuda.is_available() else 'CPU'}")
@@ -131,20 +806,48 @@ def main():
     if not torch.cuda.is_available():
         print("❌ ERROR: CUDA not available. This script requires GPU!")
         return
+
+    if args.batching == "packed" and not PACKED_ATTENTION_AVAILABLE:
+        print(f"❌ --batching packed needs a transformers release with packed-sequence masks (transformers.masking_utils); "
+              f"installed {transformers.__version__} would let packed examples attend to each other. Upgrade it or use --batching bucketed")
+        return
     
-    # Load training data
-    conversations = load_training_data(args.data)
-    
-    # Create dataset
-    dataset = Dataset.from_dict({"text": conversations})
-    print(f"📦 Dataset created with {len(dataset)} examples")
+    data_file = args.data
+    if args.resume_adapter:
+        since = args.since or read_watermark(args.resume_adapter).get("lastDataTimestamp")
+        if not since:
+            print(f"❌ No watermark in {args.resume_adapter}; pass --since to choose where new data starts")
+            return
+        since = parse_timestamp(since)
+        os.makedirs(args.output, exist_ok=True)
+        # The selected pairs are kept with the output as a record of what was trained
+        data_file = os.path.join(args.output, INCREMENTAL_DATA_FILE)
+        new_count, replayed, latest = select_incremental_pairs(args.data, since, args.replay_ratio, data_file)
+        print(f"🔁 Incremental run: {new_count} new pairs since {since.isoformat()} + {replayed} replayed older pairs")
+        if not new_count:
+            print("✅ No pairs newer than the watermark, nothing to train")
+            return
+
+    # Load training data before the model so a bad export fails fast
+    tokenizer = load_tokenizer(args.model)
+    cache = None if args.no_token_cache else TokenCache(args.token_cache)
+    examples = tokenized_training_data(data_file, tokenizer, cache)
+    if not args.resume_adapter:
+        if "latestTimestamp" in examples.meta:
+            latest = examples.meta["latestTimestamp"] and parse_timestamp(examples.meta["latestTimestamp"])
+        else:
+            # Cached before timestamps were recorded
+            latest = latest_timestamp(args.data)
+    print(f"📦 Dataset created with {len(examples)} examples")
+
+    model = load_model(args.model, adapter=args.resume_adapter)
     
-    # 5. Fine-tuning with SFTTrainer
+    # 5. Fine-tuning
     training_arguments = TrainingArguments(
         output_dir=args.output,
         num_train_epochs=args.epochs,
         per_device_train_batch_size=args.batch_size,
-        gradient_accumulation_steps=2,
+        gradient_accumulation_steps=GRADIENT_ACCUMULATION_STEPS,
         optim="adamw_bnb_8bit",
         save_steps=100,
         logging_steps=25,
@@ -160,17 +863,11 @@ def main():
         report_to="tensorboard"
     )
     
-    # SFT Trainer
-    trainer = SFTTrainer(
-        model=model,
-        train_dataset=dataset,
-        peft_config=config,
-        dataset_text_field="text",
-        tokenizer=tokenizer,
-        args=training_arguments,
-        packing=False,
-        max_seq_length=1024,
-    )
+    # load_model already attached the LoRA adapter (fresh or resumed)
+    trainer = batching_trainer(model, tokenizer, examples, training_arguments, args.batching, args.max_batch_tokens)
+
+    if args.resume_adapter and os.path.exists(os.path.join(args.resume_adapter, OPTIMIZER_STATE_FILE)):
+        trainer.add_callback(OptimizerStateCallback(os.path.join(args.resume_adapter, OPTIMIZER_STATE_FILE)))
     
     # 6. Train the model
     print("🚀 Starting training...")
@@ -179,6 +876,13 @@ def main():
     # 7. Save the model
     trainer.model.save_pretrained(args.output)
     tokenizer.save_pretrained(args.output)
+    save_training_state(trainer, args.output, {
+        "lastDataTimestamp": latest.isoformat() if latest else None,
+        "data": os.path.abspath(args.data),
+        "trainedExamples": len(examples),
+        "resumedFrom": args.resume_adapter,
+        "completedAt": datetime.now(timezone.utc).isoformat()
+    })
     
     print(f"✅ Training complete! Model saved to: {args.output}")
     
@@ -215,6 +919,8 @@ def main():
     print("   2. Load into Ollama: ollama create devai-assistant -f ./Modelfile")
     print("   3. Test: ollama run devai-assistant")
     print("   4. Update your RAG service to use 'devai-assistant'")
+    print(f"   5. For fast-start local serving: python scripts/export_model.py --adapter {args.output} --int8 --benchmark")
+    print(f"   6. Next retrain on new conversations only: python scripts/train.py --data <new export> --resume_adapter {args.output} --output <new dir>")
 
 def create_ollama_modelfile(model_dir):
     """Create Ollama Modelfile for the fine-tuned model"""
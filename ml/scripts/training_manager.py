@@ -5,7 +5,6 @@ For internal team use - complete training pipeline with RunPod support
 """
 
 import requests
-import json
 import argparse
 import sys
 import os
@@ -13,6 +12,8 @@ import subprocess
 import time
 from datetime import datetime
 
+from data_preparation import TrainingExport, write_export
+
 try:
     import runpod
     RUNPOD_AVAILABLE = True
@@ -56,24 +57,29 @@ class TrainingManager:
             print(f"❌ Error: {e}")
             return False
     
-    def export_data(self, output_file: str = "training_data.json", min_pairs: int = 200):
-        """Export training data from backend"""
+    def export_data(self, output_file: str = "training_data.jsonl", min_pairs: int = 200):
+        """Export training data from backend as JSONL (or legacy JSON for a .json output_file)
+
+        The response is parsed and written one pair at a time, so memory
+        use doesn't grow with the export.
+        """
         try:
             response = requests.get(
                 f"{self.base_url}/api/training/export-data?min_pairs={min_pairs}",
-                headers=self.headers
+                headers=self.headers,
+                stream=True
             )
             
             if response.status_code == 200:
-                data = response.json()
-                
-                with open(output_file, 'w') as f:
-                    json.dump(data, f, indent=2)
+                response.raw.decode_content = True
+                export = TrainingExport(response.raw)
+                count = write_export(export, output_file)
+                stats = export.stats
                 
                 print(f"✅ Training data exported to {output_file}")
-                print(f"📊 {data['stats']['totalPairs']} training pairs")
-                print(f"👥 {data['stats']['uniqueUsers']} users")
-                print(f"📁 {data['stats']['uniqueRepos']} repositories")
+                print(f"📊 {stats.get('totalPairs', count)} training pairs")
+                print(f"👥 {stats.get('uniqueUsers', 0)} users")
+                print(f"📁 {stats.get('uniqueRepos', 0)} repositories")
                 
                 return True
                 
@@ -143,7 +149,7 @@ class TrainingManager:
             print("✅ CUDA GPU detected")
             
             # Export data with job-specific filename
-            data_file = f"training_data_{job_id}.json"
+            data_file = f"training_data_{job_id}.jsonl"
             output_dir = f"./models/fine-tuned/devai_{job_id}"
             
             print(f"📊 Exporting training data to {data_file}...")
@@ -170,6 +176,7 @@ class TrainingManager:
                 print(f"📁 Model saved to: {output_dir}")
                 print("\n🚀 Next steps:")
                 print(f"   ollama create devai-assistant-{job_id} -f {output_dir}/Modelfile")
+                print(f"   or serve it next to other fine-tunes: model=\"devai_{job_id}\" on serve/api.py")
                 return True
             else:
                 print("❌ Local training failed")
@@ -189,7 +196,7 @@ class TrainingManager:
                 print("🔄 Falling back to manual RunPod setup instructions...")
             
             # Export data first
-            data_file = f"training_data_{job_id}.json"
+            data_file = f"training_data_{job_id}.jsonl"
             print(f"📊 Exporting training data to {data_file}...")
             if not self.export_data(data_file, min_pairs):
                 return False
@@ -243,7 +250,7 @@ def main():
     
     # Export data command
     export_parser = subparsers.add_parser("export", help="Export training data")
-    export_parser.add_argument("--output", default="training_data.json", help="Output file")
+    export_parser.add_argument("--output", default="training_data.jsonl", help="Output file (.jsonl, or .json for the legacy format)")
     
     # Trigger training command
     trigger_parser = subparsers.add_parser("trigger", help="Trigger training job")
@@ -256,7 +263,7 @@ def main():
     
     # Full workflow command
     workflow_parser = subparsers.add_parser("workflow", help="Full workflow: check -> export -> trigger -> train")
-    workflow_parser.add_argument("--output", default="training_data.json", help="Output file")
+    workflow_parser.add_argument("--output", default="training_data.jsonl", help="Output file (.jsonl, or .json for the legacy format)")
     workflow_parser.add_argument("--auto", action="store_true", help="Automatically start training")
     workflow_parser.add_argument("--local", action="store_true", help="Use local GPU (requires CUDA)")
     
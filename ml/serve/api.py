@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+DevAI ML Serving API
+Hosts the fine-tuned DevAI model (base model + PEFT adapter) behind the same
+OpenAI-compatible chat API as deployment/webapp_api_server.py, using a
+continuous-batching engine, plus local embeddings with micro-batching and
+hybrid (BM25 + vector) code retrieval over per-commit indexes and
+cross-encoder reranking
+"""
+
+import os
+import json
+import time
+import base64
+import asyncio
+from typing import Any, Dict, List, Optional, Union
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+import uvicorn
+
+from utils import ContinuousBatchingEngine, CrossEncoderReranker, GenerationRequest, HybridIndex, IndexStore, MicroBatcher, QueueFull, SentenceEmbedder
+
+def env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+SERVE_GENERATION = env_flag("DEVAI_SERVE_GENERATION", "true")
+SERVE_EMBEDDINGS = env_flag("DEVAI_SERVE_EMBEDDINGS", "true")
+SERVE_RERANK = env_flag("DEVAI_SERVE_RERANK", "true")
+
+# Generation settings
+# DEVAI_ADAPTER_PATH is the output directory of scripts/train.py; without
+# DEVAI_BASE_MODEL the base model is read from its adapter_config.json
+ADAPTER_PATH = os.getenv("DEVAI_ADAPTER_PATH") or None
+# Further adapters are served by directory name (e.g. "devai_<job_id>" from
+# run_local_training) over the same base model, at most DEVAI_MAX_ADAPTERS
+# resident at once
+ADAPTER_DIR = os.getenv("DEVAI_ADAPTER_DIR", str(Path(__file__).parent.parent / "models" / "fine-tuned"))
+MAX_ADAPTERS = int(os.getenv("DEVAI_MAX_ADAPTERS", "4"))
+BASE_MODEL = os.getenv("DEVAI_BASE_MODEL", "")
+GENERATION_MODEL_NAME = os.getenv("DEVAI_GENERATION_MODEL_NAME", "devai-assistant")
+GENERATION_DEVICE = os.getenv("DEVAI_GENERATION_DEVICE", "cpu")
+ENGINE_MAX_BATCH_SIZE = int(os.getenv("DEVAI_ENGINE_MAX_BATCH_SIZE", "8"))
+ENGINE_MAX_PREFILL_TOKENS = int(os.getenv("DEVAI_ENGINE_MAX_PREFILL_TOKENS", "2048"))
+ENGINE_MAX_QUEUE = int(os.getenv("DEVAI_ENGINE_MAX_QUEUE", "64"))
+ENGINE_CONTEXT_TOKENS = int(os.getenv("DEVAI_ENGINE_CONTEXT_TOKENS", "4096"))
+ENGINE_TOP_P = float(os.getenv("DEVAI_ENGINE_TOP_P", "0.9"))
+# Same stop sequences as the Ollama Modelfile written by train.py
+STOP_SEQUENCES = ["### Instruction:", "User:"]
+
+# Embedding settings
+EMBEDDING_MODEL = os.getenv("DEVAI_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("DEVAI_EMBEDDING_DEVICE", "cpu")
+EMBEDDING_MAX_TOKENS = int(os.getenv("DEVAI_EMBEDDING_MAX_TOKENS", "256"))
+EMBED_MAX_BATCH_SIZE = int(os.getenv("DEVAI_EMBED_MAX_BATCH_SIZE", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("DEVAI_EMBED_MAX_WAIT_MS", "5"))
+EMBED_MAX_QUEUE = int(os.getenv("DEVAI_EMBED_MAX_QUEUE", "8192"))
+EMBED_MAX_INPUTS = int(os.getenv("DEVAI_EMBED_MAX_INPUTS", "2048"))
+
+# Rerank settings: pairs from concurrent requests share micro-batches, which
+# are split into length-sorted padded batches of RERANK_BATCH_SIZE
+RERANK_MODEL = os.getenv("DEVAI_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_DEVICE = os.getenv("DEVAI_RERANK_DEVICE", "cpu")
+RERANK_MAX_TOKENS = int(os.getenv("DEVAI_RERANK_MAX_TOKENS", "512"))
+RERANK_BATCH_SIZE = int(os.getenv("DEVAI_RERANK_BATCH_SIZE", "16"))
+RERANK_MAX_PAIRS = int(os.getenv("DEVAI_RERANK_MAX_PAIRS", "128"))
+RERANK_MAX_WAIT_MS = float(os.getenv("DEVAI_RERANK_MAX_WAIT_MS", "2"))
+RERANK_MAX_QUEUE = int(os.getenv("DEVAI_RERANK_MAX_QUEUE", "4096"))
+RERANK_MAX_DOCUMENTS = int(os.getenv("DEVAI_RERANK_MAX_DOCUMENTS", "1000"))
+RERANK_CACHE_SIZE = int(os.getenv("DEVAI_RERANK_CACHE_SIZE", "50000"))
+
+# Retrieval settings (indexes are embedded with EMBEDDING_MODEL)
+INDEX_DIR = os.getenv("DEVAI_INDEX_DIR", str(Path(__file__).parent.parent / "indexes"))
+INDEX_MAX_OPEN = int(os.getenv("DEVAI_INDEX_MAX_OPEN", "16"))
+RETRIEVAL_CANDIDATES = int(os.getenv("DEVAI_RETRIEVAL_CANDIDATES", "50"))
+RETRIEVAL_NPROBE = int(os.getenv("DEVAI_RETRIEVAL_NPROBE", "8"))
+RRF_K = int(os.getenv("DEVAI_RRF_K", "60"))
+
+class ChatMessage(BaseModel):
+    role: str = Field(..., description="Role: 'user' or 'assistant'")
+    content: str = Field(..., description="Message content")
+
+class ChatCompletionRequest(BaseModel):
+    model: str = Field(default="devai-assistant", description="Model name")
+    messages: List[ChatMessage] = Field(..., description="Conversation messages")
+    temperature: Optional[float] = Field(default=0.7, ge=0, le=2)
+    max_tokens: Optional[int] = Field(default=2048, ge=1, le=4000)
+    stream: Optional[bool] = Field(default=False)
+
+class EmbeddingRequest(BaseModel):
+    input: Union[str, List[str]]
+    model: Optional[str] = None
+    encoding_format: str = "float"
+    user: Optional[str] = None
+
+class CodeChunk(BaseModel):
+    declarationName: Optional[str] = None
+    startLine: int
+    endLine: int
+    pageContent: str
+
+class IndexedFile(BaseModel):
+    filePath: str
+    chunks: List[CodeChunk]
+
+class IndexRequest(BaseModel):
+    repo: str = Field(..., description="Repository id (metadata.repoId)")
+    commit: str = Field(..., description="Commit SHA being indexed")
+    base_commit: Optional[str] = Field(default=None, description="Indexed commit to update from; omit for a full build")
+    files: List[IndexedFile] = Field(default_factory=list, description="Every file (full build) or the changed and added files")
+    deleted: List[str] = Field(default_factory=list, description="Paths deleted since base_commit")
+
+class SearchRequest(BaseModel):
+    repo: str
+    commit: Optional[str] = Field(default=None, description="Defaults to the latest indexed commit")
+    query: str
+    k: int = Field(default=8, ge=1, le=100)
+    mode: str = Field(default="hybrid", description="'hybrid', 'dense' or 'bm25'")
+
+class RerankRequest(BaseModel):
+    """Same shape as Cohere's /v1/rerank, which rag.service calls today"""
+    query: str
+    documents: List[Union[str, Dict[str, Any]]] = Field(..., description="Texts, or objects with 'text' or 'pageContent'")
+    top_n: Optional[int] = Field(default=None, ge=1)
+    model: Optional[str] = None
+    return_documents: bool = False
+
+def resolve_base_model(adapter_path: Optional[str]) -> str:
+    if BASE_MODEL:
+        return BASE_MODEL
+    config_path = os.path.join(adapter_path or "", "adapter_config.json")
+    if adapter_path and os.path.exists(config_path):
+        with open(config_path) as f:
+            base_model = json.load(f).get("base_model_name_or_path")
+        if base_model:
+            return base_model
+    return "bigcode/starcoder2-7b"
+
+embedder = SentenceEmbedder(EMBEDDING_MODEL, EMBEDDING_DEVICE, EMBEDDING_MAX_TOKENS)
+embedding_batcher: Optional[MicroBatcher] = None
+reranker = CrossEncoderReranker(RERANK_MODEL, RERANK_DEVICE, RERANK_MAX_TOKENS, RERANK_BATCH_SIZE, RERANK_CACHE_SIZE)
+rerank_batcher: Optional[MicroBatcher] = None
+index_store = IndexStore(INDEX_DIR, INDEX_MAX_OPEN, HybridIndex)
+index_locks: Dict[str, asyncio.Lock] = {}
+engine: Optional[ContinuousBatchingEngine] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global embedding_batcher, engine, rerank_batcher
+
+    # Startup
+    print("🚀 Starting DevAI ML Serving API")
+    if SERVE_GENERATION:
+        engine = ContinuousBatchingEngine(
+            resolve_base_model(ADAPTER_PATH), ADAPTER_PATH, GENERATION_DEVICE,
+            ENGINE_MAX_BATCH_SIZE, ENGINE_MAX_PREFILL_TOKENS, ENGINE_MAX_QUEUE, ENGINE_CONTEXT_TOKENS,
+            ADAPTER_DIR, MAX_ADAPTERS, GENERATION_MODEL_NAME
+        )
+        await asyncio.to_thread(engine.load)
+        engine.start()
+
+    if SERVE_EMBEDDINGS:
+        await asyncio.to_thread(embedder.load)
+        embedding_batcher = MicroBatcher(embedder.embed_items, EMBED_MAX_BATCH_SIZE, EMBED_MAX_WAIT_MS, EMBED_MAX_QUEUE)
+        embedding_batcher.start()
+        print(f"📦 Embedding micro-batches: up to {EMBED_MAX_BATCH_SIZE} inputs, {EMBED_MAX_WAIT_MS}ms max wait")
+
+    if SERVE_RERANK:
+        await asyncio.to_thread(reranker.load)
+        rerank_batcher = MicroBatcher(reranker.score_pairs, RERANK_MAX_PAIRS, RERANK_MAX_WAIT_MS, RERANK_MAX_QUEUE)
+        rerank_batcher.start()
+        print(f"📦 Rerank micro-batches: up to {RERANK_MAX_PAIRS} pairs in padded batches of {RERANK_BATCH_SIZE}")
+
+    yield
+
+    # Shutdown
+    if rerank_batcher is not None:
+        await rerank_batcher.stop()
+    if embedding_batcher is not None:
+        await embedding_batcher.stop()
+    if engine is not None:
+        await asyncio.to_thread(engine.stop)
+    print("👋 DevAI ML Serving API stopped")
+
+app = FastAPI(
+    title="DevAI ML Serving API",
+    description="Local model serving for DevAI",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+def format_prompt(messages: List[ChatMessage]) -> str:
+    """Same instruction format the model was fine-tuned on in train.py"""
+    prompt = ""
+    for message in messages:
+        if message.role == "user":
+            prompt += f"### Instruction:\n{message.content}\n\n"
+        elif message.role == "assistant":
+            prompt += f"### Response:\n{message.content}\n\n"
+    return prompt + "### Response:\n"
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    """Format a payload as a server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def completion_chunk(completion_id: str, created: int, model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+    """Format a single chat.completion.chunk event"""
+    return sse_event({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "delta": delta,
+            "finish_reason": finish_reason
+        }]
+    })
+
+async def stream_completion(generation: GenerationRequest, completion_id: str, created: int, model: str):
+    """Relay engine events as OpenAI-style chat.completion.chunk events"""
+    try:
+        yield completion_chunk(completion_id, created, model, {"role": "assistant"})
+        async for kind, value in generation.events():
+            if kind == "token":
+                yield completion_chunk(completion_id, created, model, {"content": value})
+            elif kind == "done":
+                yield completion_chunk(completion_id, created, model, {}, value)
+            else:
+                yield sse_event({"error": {"message": value, "type": "engine_error"}})
+        yield "data: [DONE]\n\n"
+    finally:
+        # Frees the batch slot at the next step if the client went away
+        generation.cancel()
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatCompletionRequest):
+    """OpenAI-compatible chat completions served by the in-process engine"""
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Generation is disabled (DEVAI_SERVE_GENERATION=false)")
+
+    try:
+        adapter = engine.adapters.resolve(request.model)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model '{request.model}'")
+
+    try:
+        generation = engine.submit(
+            format_prompt(request.messages), request.max_tokens,
+            temperature=request.temperature, top_p=ENGINE_TOP_P, stop=STOP_SEQUENCES, adapter=adapter
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+
+    created = int(time.time())
+    completion_id = f"chatcmpl-{created}"
+    if request.stream:
+        return StreamingResponse(
+            stream_completion(generation, completion_id, created, request.model),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    try:
+        content = await generation.result()
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=f"Generation failed: {e}")
+    finally:
+        generation.cancel()
+
+    prompt_tokens = len(generation.prompt_ids)
+    completion_tokens = len(generation.output_ids)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": request.model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": generation.finish_reason
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+def encode_vector(vector: np.ndarray, encoding_format: str) -> Union[List[float], str]:
+    if encoding_format == "base64":
+        return base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+    return vector.tolist()
+
+@app.post("/v1/embeddings")
+async def create_embeddings(request: EmbeddingRequest):
+    """OpenAI-compatible embeddings endpoint"""
+    if embedding_batcher is None:
+        raise HTTPException(status_code=503, detail="Embeddings are disabled (DEVAI_SERVE_EMBEDDINGS=false)")
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    if not texts:
+        raise HTTPException(status_code=400, detail="input must not be empty")
+    if len(texts) > EMBED_MAX_INPUTS:
+        raise HTTPException(status_code=400, detail=f"Too many inputs ({len(texts)}, limit {EMBED_MAX_INPUTS})")
+    if any(not text for text in texts):
+        raise HTTPException(status_code=400, detail="input must not contain empty strings")
+    if request.encoding_format not in ("float", "base64"):
+        raise HTTPException(status_code=400, detail="encoding_format must be 'float' or 'base64'")
+
+    try:
+        results = await embedding_batcher.submit_many(texts)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+
+    prompt_tokens = sum(count for _, count in results)
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": encode_vector(vector, request.encoding_format)}
+            for i, (vector, _) in enumerate(results)
+        ],
+        "model": EMBEDDING_MODEL,
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}
+    }
+
+async def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed any number of texts through the micro-batcher, EMBED_MAX_INPUTS at a time"""
+    vectors = []
+    for start in range(0, len(texts), EMBED_MAX_INPUTS):
+        results = await embedding_batcher.submit_many(texts[start:start + EMBED_MAX_INPUTS])
+        vectors.extend(vector for vector, _ in results)
+    return np.stack(vectors) if vectors else np.empty((0, embedder.dimension), dtype=np.float32)
+
+@app.post("/v1/index")
+async def index_commit(request: IndexRequest):
+    """Index a repo at a commit, from scratch or by file from base_commit
+
+    With base_commit only the listed files are embedded and tokenized;
+    chunks of every other file carry over from the base commit's index.
+    """
+    if embedding_batcher is None:
+        raise HTTPException(status_code=503, detail="Indexing needs embeddings (DEVAI_SERVE_EMBEDDINGS=false)")
+    chunks = [
+        {"filePath": file.filePath, **chunk.model_dump()}
+        for file in request.files for chunk in file.chunks
+    ]
+
+    async with index_locks.setdefault(request.repo, asyncio.Lock()):
+        base = None
+        if request.base_commit:
+            try:
+                base = await asyncio.to_thread(index_store.open, request.repo, request.base_commit)
+            except KeyError:
+                raise HTTPException(status_code=404, detail=f"{request.repo}@{request.base_commit} is not indexed; send a full build")
+        elif not chunks:
+            raise HTTPException(status_code=400, detail="A full build needs at least one chunk")
+
+        started = time.perf_counter()
+        try:
+            vectors = await embed_texts([HybridIndex.chunk_text(chunk) for chunk in chunks])
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+        embed_seconds = time.perf_counter() - started
+
+        def build() -> HybridIndex:
+            if base is None:
+                index = HybridIndex.build(vectors, chunks)
+            else:
+                replaced = [file.filePath for file in request.files] + request.deleted
+                index = base.update(replaced, vectors, chunks)
+            index_store.save(request.repo, request.commit, index)
+            return index
+
+        started = time.perf_counter()
+        try:
+            index = await asyncio.to_thread(build)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        build_seconds = time.perf_counter() - started
+
+    return {
+        "repo": request.repo,
+        "commit": request.commit,
+        "base_commit": request.base_commit,
+        "chunks": len(index),
+        "embedded": len(chunks),
+        "carried_over": len(index) - len(chunks),
+        "embed_seconds": round(embed_seconds, 3),
+        "build_seconds": round(build_seconds, 3)
+    }
+
+@app.post("/v1/search")
+async def search(request: SearchRequest):
+    """Hybrid code search: BM25 and vector rankings fused with reciprocal-rank fusion"""
+    if request.mode not in ("hybrid", "dense", "bm25"):
+        raise HTTPException(status_code=400, detail="mode must be 'hybrid', 'dense' or 'bm25'")
+    if request.mode != "bm25" and embedding_batcher is None:
+        raise HTTPException(status_code=503, detail="Dense search needs embeddings (DEVAI_SERVE_EMBEDDINGS=false)")
+    try:
+        index = await asyncio.to_thread(index_store.open, request.repo, request.commit)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No index for {request.repo}" + (f"@{request.commit}" if request.commit else ""))
+
+    started = time.perf_counter()
+    query_vector = None
+    if request.mode != "bm25":
+        try:
+            query_vector, _ = await embedding_batcher.submit(request.query)
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+    hits = await asyncio.to_thread(
+        index.search, request.query, query_vector, request.k, request.mode, RETRIEVAL_CANDIDATES, RETRIEVAL_NPROBE, RRF_K
+    )
+    return {
+        "repo": request.repo,
+        "commit": request.commit or index_store.latest(request.repo),
+        "mode": request.mode,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+        "hits": hits
+    }
+
+@app.get("/v1/index")
+async def list_indexes():
+    return {
+        "data": [
+            {"repo": repo, "latest": index_store.latest(repo), "commits": index_store.commits(repo)}
+            for repo in index_store.repos()
+        ]
+    }
+
+def document_text(document: Union[str, Dict[str, Any]]) -> str:
+    if isinstance(document, str):
+        return document
+    return str(document.get("text") or document.get("pageContent") or "")
+
+@app.post("/v1/rerank")
+async def rerank(request: RerankRequest):
+    """Cohere-compatible rerank with a local cross-encoder"""
+    if rerank_batcher is None:
+        raise HTTPException(status_code=503, detail="Reranking is disabled (DEVAI_SERVE_RERANK=false)")
+    if len(request.documents) > RERANK_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"Too many documents ({len(request.documents)}, limit {RERANK_MAX_DOCUMENTS})")
+
+    started = time.perf_counter()
+    texts = [document_text(document) for document in request.documents]
+    keys = [reranker.cache_key(request.query, text) for text in texts]
+    scores = reranker.cached(keys)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        try:
+            computed = await rerank_batcher.submit_many([(request.query, texts[i]) for i in missing])
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+        reranker.remember([keys[i] for i in missing], computed)
+        for i, score in zip(missing, computed):
+            scores[i] = score
+    seconds = time.perf_counter() - started
+    reranker.record_latency(len(texts), seconds)
+
+    ranked = sorted(range(len(texts)), key=lambda i: -scores[i])[:request.top_n or len(texts)]
+    return {
+        "results": [
+            {"index": i, "relevance_score": scores[i], **({"document": {"text": texts[i]}} if request.return_documents else {})}
+            for i in ranked
+        ],
+        "meta": {
+            "model": RERANK_MODEL,
+            "candidates": len(texts),
+            "cached": len(texts) - len(missing),
+            "latency_ms": round(seconds * 1000, 2)
+        }
+    }
+
+@app.get("/health")
+async def health_check():
+    return {
+        "status": "healthy",
+        "generation_model": engine.base_model if engine else None,
+        "adapter": engine.adapter_path if engine else None,
+        "embedding_model": EMBEDDING_MODEL if embedding_batcher else None,
+        "rerank_model": RERANK_MODEL if rerank_batcher else None,
+        "dimension": embedder.dimension,
+        "timestamp": int(time.time())
+    }
+
+@app.get("/stats")
+async def stats():
+    """Batching counters for tuning batch sizes and wait times"""
+    return {
+        "generation": engine.stats() if engine else None,
+        "embeddings": embedding_batcher.stats() if embedding_batcher else None,
+        "rerank": {**reranker.stats(), "batcher": rerank_batcher.stats()} if rerank_batcher else None
+    }
+
+@app.get("/v1/models")
+async def list_models():
+    created = int(time.time())
+    models = []
+    if engine is not None:
+        models.append({"id": GENERATION_MODEL_NAME, "object": "model", "created": created, "owned_by": "devai"})
+        models.append({"id": engine.adapters.BASE, "object": "model", "created": created, "owned_by": "devai"})
+        resident = engine.adapters.resident
+        for name in engine.adapters.available():
+            if name != "default":
+                models.append({"id": name, "object": "model", "created": created, "owned_by": "devai", "loaded": name in resident})
+    if embedding_batcher is not None:
+        models.append({"id": EMBEDDING_MODEL, "object": "model", "created": created, "owned_by": "devai"})
+    return {"object": "list", "data": models}
+
+if __name__ == "__main__":
+    port = int(os.getenv("DEVAI_SERVE_PORT", "8090"))
+    print(f"🔗 Chat: http://localhost:{port}/v1/chat/completions")
+    print(f"🔗 Embeddings: http://localhost:{port}/v1/embeddings")
+    print(f"🔗 Rerank: http://localhost:{port}/v1/rerank")
+    uvicorn.run("api:app", host="0.0.0.0", port=port, reload=False)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Embedding micro-batching benchmark
+Runs the local embedding model in-process under query-style traffic (many
+concurrent single texts) and ingestion-style traffic (large input lists)
+for each max batch size / max wait combination
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Any, Dict, List
+
+from utils import MicroBatcher, SentenceEmbedder
+
+WORDS = ["function", "returns", "user", "token", "component", "state", "router", "query", "index", "cache", "handler", "config"]
+
+def make_texts(count: int, rng: random.Random, min_words: int, max_words: int) -> List[str]:
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))) for _ in range(count)]
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2) if ordered else 0.0
+
+async def run_scenario(embedder: SentenceEmbedder, batch_size: int, wait_ms: float, args: argparse.Namespace, rng: random.Random) -> Dict[str, Any]:
+    batcher = MicroBatcher(embedder.embed_items, batch_size, wait_ms, max_queue=1_000_000)
+    batcher.start()
+
+    # Query traffic: closed loop of single-text requests
+    queries = make_texts(args.queries, rng, 4, 16)
+    latencies: List[float] = []
+    remaining = iter(queries)
+
+    async def client():
+        for text in remaining:
+            started = time.perf_counter()
+            await batcher.submit(text)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    query_seconds = time.perf_counter() - started
+    query_batches = batcher.stats()
+
+    # Ingestion traffic: a few large requests of chunk-sized texts
+    chunks = make_texts(args.chunks, rng, 40, 200)
+    requests = [chunks[i:i + args.chunk_request_size] for i in range(0, len(chunks), args.chunk_request_size)]
+    started = time.perf_counter()
+    await asyncio.gather(*(batcher.submit_many(request) for request in requests))
+    ingest_seconds = time.perf_counter() - started
+    total = batcher.stats()
+
+    await batcher.stop()
+    return {
+        "max_batch_size": batch_size,
+        "max_wait_ms": wait_ms,
+        "query": {
+            "requests": len(queries),
+            "concurrency": args.concurrency,
+            "texts_per_second": round(len(queries) / query_seconds, 1),
+            "latency_p50_ms": percentile(latencies, 0.50),
+            "latency_p95_ms": percentile(latencies, 0.95),
+            "avg_batch_size": query_batches["avg_batch_size"]
+        },
+        "ingest": {
+            "texts": len(chunks),
+            "texts_per_second": round(len(chunks) / ingest_seconds, 1),
+            "avg_batch_size": round((total["items"] - query_batches["items"]) / max(total["batches"] - query_batches["batches"], 1), 2)
+        }
+    }
+
+def parse_list(value: str, cast) -> list:
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding micro-batching settings")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--batch-sizes", type=lambda v: parse_list(v, int), default=[1, 8, 32, 64])
+    parser.add_argument("--wait-ms", type=lambda v: parse_list(v, float), default=[0, 2, 5, 10])
+    parser.add_argument("--queries", type=int, default=256, help="Single-text requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent query clients")
+    parser.add_argument("--chunks", type=int, default=512, help="Texts embedded in the ingestion phase")
+    parser.add_argument("--chunk-request-size", type=int, default=64, help="Texts per ingestion request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    print("⏱️ DevAI Embedding Micro-batching Benchmark")
+    print("=" * 50)
+    embedder = SentenceEmbedder(args.model, max_tokens=args.max_tokens)
+    embedder.load()
+    # Warm up kernels and allocator before measuring
+    embedder.embed(make_texts(8, random.Random(args.seed), 4, 16))
+
+    results = []
+    for batch_size, wait_ms in itertools.product(args.batch_sizes, args.wait_ms):
+        result = asyncio.run(run_scenario(embedder, batch_size, wait_ms, args, random.Random(args.seed)))
+        query, ingest = result["query"], result["ingest"]
+        print(
+            f"  batch {batch_size:>3} wait {wait_ms:>5.1f}ms  "
+            f"query {query['texts_per_second']:>8.1f}/s p50 {query['latency_p50_ms']:>7.2f}ms p95 {query['latency_p95_ms']:>7.2f}ms avg batch {query['avg_batch_size']:>5.1f}  "
+            f"ingest {ingest['texts_per_second']:>8.1f}/s avg batch {ingest['avg_batch_size']:>5.1f}"
+        )
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "config": vars(args), "results": results}, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
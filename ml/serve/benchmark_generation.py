@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Continuous-batching generation benchmark
+Runs the in-process engine at several concurrency levels and max batch
+sizes (batch size 1 is the one-generation-at-a-time baseline) and reports
+token throughput, latency and time to first token. Works on CPU with a
+tiny causal LM.
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Any, Dict, List
+
+from utils import ContinuousBatchingEngine
+
+WORDS = ["explain", "the", "login", "function", "and", "how", "the", "router", "handles", "auth", "tokens", "state"]
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2) if ordered else 0.0
+
+async def run_scenario(engine: ContinuousBatchingEngine, concurrency: int, args: argparse.Namespace, rng: random.Random) -> Dict[str, Any]:
+    prompts = [
+        "### Instruction:\n" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(args.min_prompt_words, args.max_prompt_words))) + "\n\n### Response:\n"
+        for _ in range(args.requests)
+    ]
+    remaining = iter(prompts)
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    tokens = 0
+
+    async def client():
+        nonlocal tokens
+        for prompt in remaining:
+            started = time.perf_counter()
+            generation = engine.submit(prompt, args.max_tokens, temperature=args.temperature, ignore_eos=True)
+            await generation.result()
+            latencies.append((time.perf_counter() - started) * 1000)
+            ttfts.append((generation.first_token_at - generation.submitted_at) * 1000)
+            tokens += len(generation.output_ids)
+
+    before = engine.stats()
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    after = engine.stats()
+
+    steps = after["decode_steps"] - before["decode_steps"]
+    rows = after["avg_decode_batch"] * after["decode_steps"] - before["avg_decode_batch"] * before["decode_steps"]
+    return {
+        "max_batch_size": engine.max_batch_size,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "tokens": tokens,
+        "seconds": round(seconds, 3),
+        "tokens_per_second": round(tokens / seconds, 1),
+        "requests_per_second": round(args.requests / seconds, 2),
+        "latency_p50_ms": percentile(latencies, 0.50),
+        "latency_p95_ms": percentile(latencies, 0.95),
+        "ttft_p50_ms": percentile(ttfts, 0.50),
+        "ttft_p95_ms": percentile(ttfts, 0.95),
+        "avg_decode_batch": round(rows / steps, 2) if steps else 0.0
+    }
+
+def parse_list(value: str, cast) -> list:
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the continuous-batching generation engine")
+    parser.add_argument("--model", required=True, help="Base causal LM (a tiny one is fine on CPU)")
+    parser.add_argument("--adapter", help="Optional PEFT adapter directory from train.py")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--concurrency", type=lambda v: parse_list(v, int), default=[1, 4, 16])
+    parser.add_argument("--batch-sizes", type=lambda v: parse_list(v, int), default=[1, 8, 16], help="Engine max batch sizes; 1 serializes generations")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per scenario")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--min-prompt-words", type=int, default=8)
+    parser.add_argument("--max-prompt-words", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    print("⏱️ DevAI Continuous-batching Benchmark")
+    print("=" * 50)
+    engine = ContinuousBatchingEngine(args.model, args.adapter, args.device, max_queue=args.requests)
+    engine.load()
+    engine.start()
+
+    results = []
+    try:
+        for batch_size, concurrency in itertools.product(args.batch_sizes, args.concurrency):
+            engine.max_batch_size = batch_size
+            result = asyncio.run(run_scenario(engine, concurrency, args, random.Random(args.seed)))
+            print(
+                f"  batch {batch_size:>3} concurrency {concurrency:>3}  "
+                f"{result['tokens_per_second']:>8.1f} tok/s  {result['requests_per_second']:>6.2f} req/s  "
+                f"p50 {result['latency_p50_ms']:>8.1f}ms  p95 {result['latency_p95_ms']:>8.1f}ms  "
+                f"ttft p50 {result['ttft_p50_ms']:>7.1f}ms  avg decode batch {result['avg_decode_batch']:>5.2f}"
+            )
+            results.append(result)
+    finally:
+        engine.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "adapter": args.adapter, "config": vars(args), "results": results}, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
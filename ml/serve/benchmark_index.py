@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Local vector index benchmark
+Builds the IVF index over clustered synthetic vectors (or saved embeddings),
+saves and reopens it memory-mapped, and reports recall@k and query latency
+for each nprobe against brute-force search over the same vectors. With
+--changed-files it also times a per-commit HybridIndex update against a full
+rebuild (embedding time excluded; only the changed files need embedding)
+"""
+
+import json
+import time
+import argparse
+import tempfile
+from typing import Any, Dict, List
+
+import numpy as np
+
+from utils import HybridIndex, IndexStore, VectorIndex, normalize_rows
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3) if ordered else 0.0
+
+def synthetic_vectors(count: int, dimension: int, topics: int, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors around topic centers, roughly how code-chunk embeddings cluster"""
+    centers = normalize_rows(rng.standard_normal((topics, dimension)))
+    vectors = centers[rng.integers(0, topics, count)] + 1.2 * rng.standard_normal((count, dimension)) / np.sqrt(dimension)
+    return normalize_rows(vectors)
+
+def timed_search(search, queries: np.ndarray) -> tuple:
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, latencies
+
+def run(index: VectorIndex, queries: np.ndarray, k: int, nprobes: List[int]) -> Dict[str, Any]:
+    exact, exact_latencies = timed_search(lambda q: index.search_exact(q, k), queries)
+    truth = [{id for id, _ in hits} for hits in exact]
+    results = {
+        "brute_force": {"latency_p50_ms": percentile(exact_latencies, 0.50), "latency_p95_ms": percentile(exact_latencies, 0.95)},
+        "ivf": []
+    }
+    for nprobe in nprobes:
+        hits, latencies = timed_search(lambda q: index.search_ids(q, k, nprobe), queries)
+        recall = np.mean([len(expected & {id for id, _ in found}) / len(expected) for expected, found in zip(truth, hits)])
+        results["ivf"].append({
+            "nprobe": nprobe,
+            f"recall_at_{k}": round(float(recall), 4),
+            "latency_p50_ms": percentile(latencies, 0.50),
+            "latency_p95_ms": percentile(latencies, 0.95)
+        })
+    return results
+
+def time_update(vectors: np.ndarray, chunks: List[Dict[str, Any]], changed_files: int, scratch: str, rng: np.random.Generator) -> Dict[str, Any]:
+    """Full hybrid build vs an update that replaces changed_files files"""
+    store = IndexStore(scratch, index_class=HybridIndex)
+    started = time.perf_counter()
+    store.save("benchmark/hybrid", "base", HybridIndex.build(vectors, chunks))
+    full_seconds = time.perf_counter() - started
+
+    files = sorted({chunk["filePath"] for chunk in chunks})
+    changed = set(rng.choice(files, min(changed_files, len(files)), replace=False).tolist())
+    new_chunks = [dict(chunk, pageContent=chunk["pageContent"] + " updated") for chunk in chunks if chunk["filePath"] in changed]
+    new_vectors = vectors[rng.integers(0, len(vectors), len(new_chunks))]
+
+    started = time.perf_counter()
+    base = store.open("benchmark/hybrid", "base")
+    store.save("benchmark/hybrid", "next", base.update(sorted(changed), new_vectors, new_chunks))
+    update_seconds = time.perf_counter() - started
+    return {
+        "files": len(files),
+        "changed_files": len(changed),
+        "changed_chunks": len(new_chunks),
+        "full_build_seconds": round(full_seconds, 3),
+        "update_seconds": round(update_seconds, 3)
+    }
+
+def parse_list(value: str, cast) -> list:
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local IVF vector index against brute force")
+    parser.add_argument("--embeddings", help="Use vectors from this .npy file instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=100_000, help="Synthetic vectors")
+    parser.add_argument("--dimension", type=int, default=384, help="Synthetic dimension (all-MiniLM-L6-v2 is 384)")
+    parser.add_argument("--topics", type=int, default=2000, help="Synthetic topic clusters")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8, help="Top k (createCodeRetriever uses 8)")
+    parser.add_argument("--nlist", type=int, help="Inverted lists (default ~4*sqrt(count))")
+    parser.add_argument("--nprobe", type=lambda v: parse_list(v, int), default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--index-dir", help="Keep the saved index here (default: a temporary directory)")
+    parser.add_argument("--changed-files", type=int, help="Also time a hybrid per-commit update touching this many files")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    print("⏱️ DevAI Vector Index Benchmark")
+    print("=" * 50)
+    rng = np.random.default_rng(args.seed)
+    vectors = normalize_rows(np.load(args.embeddings)) if args.embeddings else synthetic_vectors(args.count, args.dimension, args.topics, rng)
+    # Queries are perturbed copies of indexed vectors, like a question about an indexed chunk
+    queries = vectors[rng.integers(0, len(vectors), args.queries)]
+    queries = normalize_rows(queries + 1.0 * rng.standard_normal(queries.shape) / np.sqrt(vectors.shape[1]))
+    chunks = [
+        {
+            "filePath": f"src/file_{i // 20}.ts", "declarationName": f"symbol_{i}", "startLine": (i % 20) * 30 + 1, "endLine": (i % 20) * 30 + 30,
+            "pageContent": f"function symbol_{i}(state) {{ return handle{i % 97}(state.value{i % 13}) }}"
+        }
+        for i in range(len(vectors))
+    ]
+
+    started = time.perf_counter()
+    index = VectorIndex.build(vectors, chunks, nlist=args.nlist, seed=args.seed)
+    build_seconds = time.perf_counter() - started
+    print(f"🔧 Built {len(index)} x {index.dimension} vectors into {index.nlist} lists in {build_seconds:.2f}s")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        store = IndexStore(args.index_dir or scratch)
+        started = time.perf_counter()
+        store.save("benchmark/repo", "HEAD", index)
+        save_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        mapped = store.open("benchmark/repo")
+        load_seconds = time.perf_counter() - started
+        print(f"💾 Saved in {save_seconds:.2f}s, reopened memory-mapped in {load_seconds * 1000:.1f}ms")
+
+        results = run(mapped, queries, args.k, args.nprobe)
+        if args.changed_files:
+            results["update"] = time_update(vectors, chunks, args.changed_files, scratch, rng)
+
+    brute = results["brute_force"]
+    print(f"  brute force           p50 {brute['latency_p50_ms']:>8.3f}ms  p95 {brute['latency_p95_ms']:>8.3f}ms")
+    for result in results["ivf"]:
+        print(
+            f"  ivf nprobe {result['nprobe']:>4}  recall@{args.k} {result[f'recall_at_{args.k}']:.3f}  "
+            f"p50 {result['latency_p50_ms']:>8.3f}ms  p95 {result['latency_p95_ms']:>8.3f}ms"
+        )
+
+    if "update" in results:
+        update = results["update"]
+        print(
+            f"🔄 Hybrid index, {update['changed_files']}/{update['files']} files changed: "
+            f"update {update['update_seconds']:.2f}s vs full rebuild {update['full_build_seconds']:.2f}s"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "config": vars(args),
+                "count": len(index),
+                "dimension": index.dimension,
+                "nlist": index.nlist,
+                "build_seconds": round(build_seconds, 3),
+                "save_seconds": round(save_seconds, 3),
+                "load_seconds": round(load_seconds, 4),
+                **results
+            }, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
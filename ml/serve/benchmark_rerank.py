@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Cross-encoder rerank benchmark
+Scores one query against N code-chunk-like candidates for each candidate
+count and batch size, cold (empty score cache) and warm (the same
+candidates again), to show what each extra retrieval top-k costs
+"""
+
+import json
+import time
+import random
+import argparse
+import itertools
+from typing import Any, Dict, List
+
+from utils import CrossEncoderReranker
+
+WORDS = ["const", "user", "await", "fetch", "state", "return", "props", "router", "token", "handleSubmit", "useEffect", "config"]
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2) if ordered else 0.0
+
+def rerank_once(reranker: CrossEncoderReranker, query: str, passages: List[str]) -> float:
+    """Same cache-then-score path as the /v1/rerank endpoint; returns milliseconds"""
+    started = time.perf_counter()
+    keys = [reranker.cache_key(query, passage) for passage in passages]
+    scores = reranker.cached(keys)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        reranker.remember([keys[i] for i in missing], reranker.score_pairs([(query, passages[i]) for i in missing]))
+    return (time.perf_counter() - started) * 1000
+
+def run_scenario(reranker: CrossEncoderReranker, candidates: int, args: argparse.Namespace, rng: random.Random) -> Dict[str, Any]:
+    cold, warm = [], []
+    reranker.clear_cache()
+    batches, real, padded = reranker.batches, reranker.real_tokens, reranker.padded_tokens
+    for _ in range(args.repeats):
+        query = " ".join(rng.choice(WORDS) for _ in range(8))
+        passages = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(args.min_words, args.max_words))) for _ in range(candidates)]
+        cold.append(rerank_once(reranker, query, passages))
+        warm.append(rerank_once(reranker, query, passages))
+    padded = reranker.padded_tokens - padded
+    real = reranker.real_tokens - real
+    return {
+        "candidates": candidates,
+        "batch_size": reranker.batch_size,
+        "cold_p50_ms": percentile(cold, 0.50),
+        "cold_p95_ms": percentile(cold, 0.95),
+        "warm_p50_ms": percentile(warm, 0.50),
+        "pairs_per_second": round(candidates * len(cold) / (sum(cold) / 1000), 1),
+        "batches_per_request": round((reranker.batches - batches) / args.repeats, 2),
+        "padding_ratio": round(1 - real / padded, 3) if padded else 0.0
+    }
+
+def parse_list(value: str, cast) -> list:
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local cross-encoder reranking against candidate count")
+    parser.add_argument("--model", default="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--candidates", type=lambda v: parse_list(v, int), default=[8, 16, 32, 64, 128])
+    parser.add_argument("--batch-sizes", type=lambda v: parse_list(v, int), default=[8, 16, 32])
+    parser.add_argument("--repeats", type=int, default=10, help="Queries per scenario")
+    parser.add_argument("--min-words", type=int, default=40, help="Shortest candidate chunk")
+    parser.add_argument("--max-words", type=int, default=300, help="Longest candidate chunk")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    print("⏱️ DevAI Rerank Benchmark")
+    print("=" * 50)
+    reranker = CrossEncoderReranker(args.model, max_tokens=args.max_tokens)
+    reranker.load()
+    # Warm up kernels and allocator before measuring
+    reranker.score_pairs([("warm up", "the reranker")] * 4)
+
+    results = []
+    for batch_size, candidates in itertools.product(args.batch_sizes, args.candidates):
+        reranker.batch_size = batch_size
+        result = run_scenario(reranker, candidates, args, random.Random(args.seed))
+        print(
+            f"  batch {batch_size:>3} candidates {candidates:>4}  "
+            f"cold p50 {result['cold_p50_ms']:>8.1f}ms p95 {result['cold_p95_ms']:>8.1f}ms  "
+            f"warm p50 {result['warm_p50_ms']:>6.2f}ms  {result['pairs_per_second']:>7.1f} pairs/s  padding {result['padding_ratio']:.0%}"
+        )
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "config": vars(args), "results": results}, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
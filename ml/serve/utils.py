@@ -0,0 +1,1486 @@
+"""
+Utility functions for serving DevAI models
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import asyncio
+import threading
+from urllib.parse import quote, unquote
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Optional torch/transformers support for local models
+try:
+    import torch
+    import torch.nn.functional as F
+    from transformers import AutoConfig, AutoModel, AutoModelForCausalLM, AutoModelForSequenceClassification, AutoTokenizer, DynamicCache
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+# Optional PEFT support for serving fine-tuned adapters
+try:
+    from peft import PeftModel
+    PEFT_AVAILABLE = True
+except ImportError:
+    PEFT_AVAILABLE = False
+
+# Optional sentence-transformers support (handles each model's pooling config)
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+def configure_torch_threads():
+    threads = os.getenv("DEVAI_TORCH_THREADS")
+    if threads:
+        torch.set_num_threads(int(threads))
+
+# Files written by scripts/export_model.py for the int8 CPU variant
+INT8_MANIFEST = "quantization.json"
+INT8_WEIGHTS = "model_int8.pt"
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of every Linear layer (CPU inference only)"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def save_int8(model, output_dir: str):
+    """Save a quantize_int8() model so load_causal_lm() can rebuild it without the float weights"""
+    os.makedirs(output_dir, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    state_dict = model.state_dict()
+    # Non-persistent buffers (e.g. rotary frequencies) aren't in the state
+    # dict, but the empty skeleton built at load time needs them too
+    buffers = {name: buffer for name, buffer in model.named_buffers() if name not in state_dict}
+    torch.save({"state_dict": state_dict, "buffers": buffers}, os.path.join(output_dir, INT8_WEIGHTS))
+    with open(os.path.join(output_dir, INT8_MANIFEST), "w") as f:
+        json.dump({"method": "dynamic_int8", "modules": ["Linear"], "torch": torch.__version__}, f, indent=2)
+
+def load_causal_lm(path: str, device: str = "cpu"):
+    """Load a causal LM directory: a regular/merged checkpoint or an int8 export"""
+    if not os.path.exists(os.path.join(path, INT8_MANIFEST)):
+        dtype = torch.float16 if device.startswith("cuda") else torch.float32
+        return AutoModelForCausalLM.from_pretrained(path, torch_dtype=dtype).to(device)
+
+    if device != "cpu":
+        raise ValueError("int8 dynamically quantized models only run on CPU")
+    # Build an uninitialized skeleton, quantize it, then fill in the saved weights
+    config = AutoConfig.from_pretrained(path)
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
+    model = quantize_int8(model.to_empty(device="cpu"))
+    saved = torch.load(os.path.join(path, INT8_WEIGHTS), mmap=True, weights_only=False)
+    model.load_state_dict(saved["state_dict"])
+    for name, buffer in saved["buffers"].items():
+        module_name, _, buffer_name = name.rpartition(".")
+        model.get_submodule(module_name).register_buffer(buffer_name, buffer, persistent=False)
+    return model
+
+class QueueFull(Exception):
+    """Raised when a batcher has no room for more work"""
+
+class MicroBatcher:
+    """Merges concurrent calls into batches for one batched function
+
+    Items wait until either max_batch_size items are queued or the oldest
+    has waited max_wait_ms, then run together in a worker thread. A lone
+    query pays at most max_wait_ms extra; a burst of ingestion traffic gets
+    full batches.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait_ms: float, max_queue: int):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self._queue: "asyncio.Queue[Tuple[Any, asyncio.Future]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.rejected = 0
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def submit_many(self, items: List[Any]) -> List[Any]:
+        if self._queue.qsize() + len(items) > self.max_queue:
+            self.rejected += 1
+            raise QueueFull(f"batch queue is full ({self._queue.qsize()}/{self.max_queue})")
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            self._queue.put_nowait((item, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def submit(self, item: Any) -> Any:
+        return (await self.submit_many([item]))[0]
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Callers that gave up don't need a forward pass
+        return [(item, future) for item, future in batch if not future.done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = await asyncio.to_thread(self.fn, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.busy_seconds += time.perf_counter() - started
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "rejected": self.rejected
+        }
+
+class SentenceEmbedder:
+    """Local sentence-embedding model on CPU
+
+    Uses sentence-transformers when installed; otherwise plain transformers
+    with attention-masked mean pooling. Vectors are L2-normalized float32.
+    """
+
+    def __init__(self, model_name: str, device: str = "cpu", max_tokens: int = 256, normalize: bool = True):
+        self.model_name = model_name
+        self.device = device
+        self.max_tokens = max_tokens
+        self.normalize = normalize
+        self.model = None
+        self.tokenizer = None
+        self.dimension: Optional[int] = None
+
+    def load(self):
+        if not TORCH_AVAILABLE:
+            raise RuntimeError("torch and transformers are required for local embeddings")
+
+        configure_torch_threads()
+        print(f"🔧 Loading embedding model {self.model_name} on {self.device}")
+        if SENTENCE_TRANSFORMERS_AVAILABLE:
+            self.model = SentenceTransformer(self.model_name, device=self.device)
+            self.model.max_seq_length = self.max_tokens
+            self.tokenizer = self.model.tokenizer
+            self.dimension = self.model.get_sentence_embedding_dimension()
+        else:
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.model = AutoModel.from_pretrained(self.model_name).to(self.device).eval()
+            self.dimension = self.model.config.hidden_size
+        print(f"✅ Embedding model ready ({self.dimension} dimensions)")
+
+    def embed(self, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """Embed a batch; returns (vectors, token count per text)"""
+        # Sorting by length keeps padding low when lengths vary a lot
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        ordered = [texts[i] for i in order]
+
+        encoded = self.tokenizer(ordered, padding=True, truncation=True, max_length=self.max_tokens, return_tensors="pt")
+        token_counts = encoded["attention_mask"].sum(dim=1).tolist()
+
+        with torch.inference_mode():
+            if SENTENCE_TRANSFORMERS_AVAILABLE:
+                vectors = self.model.encode(ordered, batch_size=len(ordered), convert_to_numpy=True, normalize_embeddings=self.normalize)
+            else:
+                encoded = encoded.to(self.device)
+                hidden = self.model(**encoded).last_hidden_state
+                mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                if self.normalize:
+                    pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+                vectors = pooled.cpu().numpy()
+
+        # Restore request order
+        result = np.empty_like(vectors, dtype=np.float32)
+        counts = [0] * len(texts)
+        for position, index in enumerate(order):
+            result[index] = vectors[position]
+            counts[index] = int(token_counts[position])
+        return result, counts
+
+    def embed_items(self, texts: List[str]) -> List[Tuple[np.ndarray, int]]:
+        """MicroBatcher entry point: one (vector, token count) per text"""
+        vectors, counts = self.embed(texts)
+        return list(zip(vectors, counts))
+
+class CrossEncoderReranker:
+    """Local cross-encoder that scores (query, passage) pairs on CPU
+
+    Pairs are sorted by token length and cut into batches of neighbours, so
+    each padded batch is about as long as its longest member rather than
+    the longest pair overall. Scores are cached by (query hash, passage
+    hash): follow-up questions rerank mostly the same chunks. Latency is
+    recorded per candidate-count bucket to help pick the retrieval top-k.
+    """
+
+    LATENCY_BUCKETS = (8, 16, 32, 64, 128, 256)
+
+    def __init__(self, model_name: str, device: str = "cpu", max_tokens: int = 512, batch_size: int = 16, cache_size: int = 50_000):
+        self.model_name = model_name
+        self.device = device
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.model = None
+        self.tokenizer = None
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._latencies: Dict[int, deque] = {bound: deque(maxlen=1000) for bound in self.LATENCY_BUCKETS + (0,)}
+
+        self.pairs = 0
+        self.batches = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.busy_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def load(self):
+        if not TORCH_AVAILABLE:
+            raise RuntimeError("torch and transformers are required for local reranking")
+
+        configure_torch_threads()
+        print(f"🔧 Loading reranker {self.model_name} on {self.device}")
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name).to(self.device).eval()
+        print(f"✅ Reranker ready ({self.model.config.num_labels} label(s))")
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """Relevance in [0, 1] per pair; MicroBatcher entry point"""
+        started = time.perf_counter()
+        encoded = self.tokenizer([q for q, _ in pairs], [p for _, p in pairs], truncation="only_second", max_length=self.max_tokens)
+        features = [{key: encoded[key][i] for key in encoded.keys()} for i in range(len(pairs))]
+        order = sorted(range(len(pairs)), key=lambda i: len(features[i]["input_ids"]))
+
+        scores = [0.0] * len(pairs)
+        for start in range(0, len(order), self.batch_size):
+            bucket = order[start:start + self.batch_size]
+            batch = self.tokenizer.pad([features[i] for i in bucket], return_tensors="pt").to(self.device)
+            with torch.inference_mode():
+                logits = self.model(**batch).logits.float()
+            # Single-logit models are trained with a sigmoid; otherwise take P(relevant)
+            relevance = torch.sigmoid(logits[:, 0]) if logits.shape[1] == 1 else torch.softmax(logits, dim=1)[:, -1]
+            for i, score in zip(bucket, relevance.tolist()):
+                scores[i] = score
+            self.batches += 1
+            self.real_tokens += int(batch["attention_mask"].sum())
+            self.padded_tokens += batch["input_ids"].numel()
+
+        self.pairs += len(pairs)
+        self.busy_seconds += time.perf_counter() - started
+        return scores
+
+    @staticmethod
+    def cache_key(query: str, passage: str) -> Tuple[str, str]:
+        return hashlib.sha1(query.encode("utf-8")).hexdigest(), hashlib.sha1(passage.encode("utf-8")).hexdigest()
+
+    def cached(self, keys: List[Tuple[str, str]]) -> List[Optional[float]]:
+        with self._lock:
+            scores = []
+            for key in keys:
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                scores.append(score)
+        hits = sum(score is not None for score in scores)
+        self.cache_hits += hits
+        self.cache_misses += len(keys) - hits
+        return scores
+
+    def remember(self, keys: List[Tuple[str, str]], scores: List[float]):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = score
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def record_latency(self, candidates: int, seconds: float):
+        bound = next((bound for bound in self.LATENCY_BUCKETS if candidates <= bound), 0)
+        self._latencies[bound].append(seconds * 1000)
+
+    def latency_by_candidates(self) -> List[Dict[str, Any]]:
+        report = []
+        lower = 1
+        for bound in self.LATENCY_BUCKETS + (0,):
+            samples = sorted(self._latencies[bound])
+            label = f"{lower}-{bound}" if bound else f"{lower}+"
+            if bound:
+                lower = bound + 1
+            if samples:
+                report.append({
+                    "candidates": label,
+                    "requests": len(samples),
+                    "p50_ms": round(samples[len(samples) // 2], 2),
+                    "p95_ms": round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 2)
+                })
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "pairs": self.pairs,
+            "batches": self.batches,
+            "padding_ratio": round(1 - self.real_tokens / self.padded_tokens, 3) if self.padded_tokens else 0.0,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "latency_by_candidates": self.latency_by_candidates()
+        }
+
+def cache_layers(cache) -> List[Tuple["torch.Tensor", "torch.Tensor"]]:
+    """(key, value) tensors per layer, across transformers cache layouts"""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [(layer[0], layer[1]) for layer in cache]
+
+def build_cache(layers: List[Tuple["torch.Tensor", "torch.Tensor"]]) -> "DynamicCache":
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+def left_pad(tensor: "torch.Tensor", length: int, dim: int) -> "torch.Tensor":
+    """Left-pad a KV (dim=-2) or mask (dim=-1) tensor with zeros to length"""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    padding = (missing, 0) if dim == -1 else (0, 0, missing, 0)
+    return F.pad(tensor, padding)
+
+class GenerationRequest:
+    """One sequence in the continuous-batching engine
+
+    The engine thread appends tokens and posts events back to the caller's
+    event loop: ("token", text), ("done", finish_reason) or ("error", message).
+    """
+
+    def __init__(self, prompt_ids: List[int], max_tokens: int, temperature: float, top_p: float,
+                 stop: List[str], ignore_eos: bool, loop: asyncio.AbstractEventLoop, adapter: Optional[str] = None):
+        self.prompt_ids = prompt_ids
+        self.adapter = adapter
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.stop = stop
+        self.ignore_eos = ignore_eos
+        self.output_ids: List[int] = []
+        self.next_token: Optional[int] = None
+        self.text = ""
+        self.sent = 0
+        # Incremental detokenization window over output_ids
+        self.prefix_offset = 0
+        self.read_offset = 0
+        self.finish_reason: Optional[str] = None
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._loop = loop
+        self._events: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+
+    @property
+    def finished(self) -> bool:
+        return self.finish_reason is not None
+
+    def emit(self, kind: str, value: Any):
+        self._loop.call_soon_threadsafe(self._events.put_nowait, (kind, value))
+
+    def cancel(self):
+        """Ask the engine to drop this sequence at the next step"""
+        self.cancelled = True
+
+    async def events(self) -> AsyncIterator[Tuple[str, Any]]:
+        while True:
+            event = await self._events.get()
+            yield event
+            if event[0] != "token":
+                return
+
+    async def result(self) -> str:
+        """Wait for the whole completion; raises RuntimeError on engine errors"""
+        parts = []
+        async for kind, value in self.events():
+            if kind == "token":
+                parts.append(value)
+            elif kind == "error":
+                raise RuntimeError(value)
+        return "".join(parts)
+
+class AdapterPool:
+    """LoRA adapters known by name, and which of them are resident
+
+    Names are directories under adapter_dir (run_local_training writes one
+    per job, e.g. devai_<job_id>) plus "default" for the adapter the server
+    was started with. The engine loads and evicts them; this class only
+    resolves names and keeps the LRU order and counters.
+    """
+
+    BASE = "base"
+
+    def __init__(self, adapter_dir: Optional[str], default_path: Optional[str], default_model_name: str, max_resident: int):
+        self.adapter_dir = adapter_dir
+        self.default_path = default_path
+        self.default_model_name = default_model_name
+        self.max_resident = max(1, max_resident)
+        self.resident: "OrderedDict[str, float]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def path(self, name: str) -> Optional[str]:
+        if name == "default":
+            return self.default_path
+        if not self.adapter_dir or os.sep in name or name.startswith("."):
+            return None
+        path = os.path.join(self.adapter_dir, name)
+        return path if os.path.exists(os.path.join(path, "adapter_config.json")) else None
+
+    def resolve(self, model_name: str) -> Optional[str]:
+        """Adapter name for a requested model (None means the bare base model)
+
+        Raises KeyError for unknown names.
+        """
+        if model_name == self.default_model_name:
+            return "default" if self.default_path else None
+        if model_name == self.BASE:
+            return None
+        # Also accept the Ollama-style name printed by run_local_training
+        candidates = [model_name]
+        if model_name.startswith(f"{self.default_model_name}-"):
+            candidates.append("devai_" + model_name[len(self.default_model_name) + 1:])
+        for name in candidates:
+            if self.path(name):
+                return name
+        raise KeyError(model_name)
+
+    def available(self) -> List[str]:
+        names = ["default"] if self.default_path else []
+        if self.adapter_dir and os.path.isdir(self.adapter_dir):
+            names += sorted(name for name in os.listdir(self.adapter_dir) if self.path(name))
+        return names
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_resident": self.max_resident,
+            "resident": list(self.resident),
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "load_seconds": round(self.load_seconds, 3)
+        }
+
+class ContinuousBatchingEngine:
+    """Iteration-level scheduler for a causal LM, optionally with PEFT adapters
+
+    Running sequences share one left-padded KV cache and advance one token
+    per decode step. Between steps, finished or cancelled sequences are
+    retired and waiting ones are prefilled into the batch, so a new request
+    starts after at most one step instead of behind whole generations.
+
+    One base model stays resident; LoRA adapters are loaded by name on first
+    use, up to max_adapters at a time (least recently used ones not in use
+    are evicted), and each row of a batch runs with its own adapter.
+    """
+
+    def __init__(self, base_model: str, adapter_path: Optional[str] = None, device: str = "cpu",
+                 max_batch_size: int = 8, max_prefill_tokens: int = 2048, max_queue: int = 64,
+                 context_tokens: Optional[int] = None, adapter_dir: Optional[str] = None,
+                 max_adapters: int = 4, model_name: str = "devai-assistant"):
+        self.base_model = base_model
+        self.adapter_path = adapter_path
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_prefill_tokens = max_prefill_tokens
+        self.max_queue = max_queue
+        self.context_tokens = context_tokens
+        self.model = None
+        self.tokenizer = None
+        self.eos_token_id: Optional[int] = None
+        self.adapters = AdapterPool(adapter_dir, adapter_path, model_name, max_adapters)
+
+        self.running: List[GenerationRequest] = []
+        # Admitted but not yet part of running, so a failed prefill can fail them
+        self._admitting: List[GenerationRequest] = []
+        self._cache = None
+        self._attention_mask: Optional["torch.Tensor"] = None
+        self._waiting: "deque[GenerationRequest]" = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        self.steps = 0
+        self.decode_rows = 0
+        self.prefills = 0
+        self.prefill_tokens = 0
+        self.generated_tokens = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def load(self):
+        if not TORCH_AVAILABLE:
+            raise RuntimeError("torch and transformers are required for local generation")
+        configure_torch_threads()
+
+        print(f"🔧 Loading {self.base_model} on {self.device}")
+        model = load_causal_lm(self.base_model, self.device)
+
+        self.model = model.eval()
+        tokenizer_source = self.base_model
+        if self.adapter_path:
+            self._load_adapter("default")
+            # train.py saves the tokenizer next to the adapter
+            if os.path.exists(os.path.join(self.adapter_path, "tokenizer_config.json")):
+                tokenizer_source = self.adapter_path
+
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_source)
+        self.eos_token_id = self.tokenizer.eos_token_id
+        if self.context_tokens is None:
+            self.context_tokens = getattr(model.config, "max_position_embeddings", None) or 2048
+        print(f"✅ Generation model ready (context {self.context_tokens} tokens, batch up to {self.max_batch_size})")
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="generation-engine", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, prompt: str, max_tokens: int, temperature: float = 0.7, top_p: float = 1.0,
+               stop: Optional[List[str]] = None, ignore_eos: bool = False, adapter: Optional[str] = None) -> GenerationRequest:
+        """Queue a prompt; must be called from the event loop that reads the events
+
+        adapter is a name from self.adapters.resolve(), or None for the base model.
+        """
+        max_tokens = max(1, min(max_tokens, self.context_tokens - 1))
+        prompt_ids = self.tokenizer(prompt)["input_ids"]
+        # Keep the end of over-long prompts so prompt plus completion fits
+        prompt_ids = prompt_ids[-(self.context_tokens - max_tokens):]
+
+        request = GenerationRequest(prompt_ids, max_tokens, temperature, top_p, stop or [], ignore_eos, asyncio.get_running_loop(), adapter)
+        with self._condition:
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f"generation queue is full ({len(self._waiting)}/{self.max_queue})")
+            self._waiting.append(request)
+            self._condition.notify()
+        return request
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopping and not self._waiting and not self.running:
+                    self._condition.wait()
+                if self._stopping:
+                    break
+            try:
+                with torch.inference_mode():
+                    self._step()
+            except Exception as e:
+                print(f"❌ Generation step failed: {e}")
+                for request in self.running + [r for r in self._admitting if r not in self.running]:
+                    request.emit("error", str(e))
+                self._admitting = []
+                self.running = []
+                self._cache = None
+                self._attention_mask = None
+
+        for request in self.running + list(self._waiting):
+            request.emit("error", "engine stopped")
+
+    def _step(self):
+        for request in self.running:
+            if request.cancelled and not request.finished:
+                request.finish_reason = "cancelled"
+
+        self._admitting = self._admit()
+        if self._admitting:
+            self._prefill(self._admitting)
+        self._admitting = []
+        self._retire()
+
+        if self.running:
+            self._decode()
+            self._retire()
+
+    def _admit(self) -> List[GenerationRequest]:
+        candidates = []
+        budget = self.max_prefill_tokens
+        with self._condition:
+            while self._waiting and len(self.running) + len(candidates) < self.max_batch_size:
+                request = self._waiting[0]
+                if request.cancelled:
+                    self._waiting.popleft()
+                    continue
+                # Bound prefill work per step so running sequences keep decoding
+                if candidates and len(request.prompt_ids) > budget:
+                    break
+                budget -= len(request.prompt_ids)
+                candidates.append(self._waiting.popleft())
+
+        # Adapters load outside the lock so submit() never waits on disk
+        admitted = []
+        deferred = []
+        for request in candidates:
+            in_use = {r.adapter for r in self.running + admitted}
+            try:
+                acquired = self._acquire_adapter(request.adapter, in_use)
+            except Exception as e:
+                # A broken adapter only fails the requests that asked for it
+                print(f"❌ Loading adapter {request.adapter} failed: {e}")
+                request.emit("error", f"adapter {request.adapter} failed to load: {e}")
+                continue
+            if acquired:
+                admitted.append(request)
+            else:
+                deferred.append(request)
+        if deferred:
+            # Every resident adapter is busy; retry once a sequence retires
+            with self._condition:
+                self._waiting.extendleft(reversed(deferred))
+        return admitted
+
+    def _acquire_adapter(self, name: Optional[str], in_use: set) -> bool:
+        pool = self.adapters
+        if name is None:
+            return True
+        if name in pool.resident:
+            pool.hits += 1
+            pool.resident.move_to_end(name)
+            return True
+
+        victim = None
+        if len(pool.resident) >= pool.max_resident:
+            victim = next((resident for resident in pool.resident if resident not in in_use), None)
+            if victim is None:
+                return False
+        pool.misses += 1
+        # Load before evicting so the PEFT wrapper always has an adapter
+        self._load_adapter(name)
+        if victim is not None:
+            print(f"♻️ Evicting adapter {victim}")
+            self.model.delete_adapter(victim)
+            del pool.resident[victim]
+            pool.evictions += 1
+        return True
+
+    def _load_adapter(self, name: str):
+        if not PEFT_AVAILABLE:
+            raise RuntimeError("peft is required to serve adapters")
+        path = self.adapters.path(name)
+        print(f"🧩 Loading adapter {name} from {path}")
+        started = time.perf_counter()
+        if isinstance(self.model, PeftModel):
+            self.model.load_adapter(path, adapter_name=name)
+        else:
+            self.model = PeftModel.from_pretrained(self.model, path, adapter_name=name).eval()
+        self.adapters.load_seconds += time.perf_counter() - started
+        self.adapters.loads += 1
+        self.adapters.resident[name] = time.time()
+
+    def _adapter_kwargs(self, requests: List[GenerationRequest]) -> Dict[str, Any]:
+        if not PEFT_AVAILABLE or not isinstance(self.model, PeftModel):
+            return {}
+        return {"adapter_names": [r.adapter or "__base__" for r in requests]}
+
+    def _prefill(self, requests: List[GenerationRequest]):
+        length = max(len(r.prompt_ids) for r in requests)
+        pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else (self.eos_token_id or 0)
+        input_ids = torch.tensor([[pad_id] * (length - len(r.prompt_ids)) + r.prompt_ids for r in requests], device=self.device)
+        mask = torch.tensor([[0] * (length - len(r.prompt_ids)) + [1] * len(r.prompt_ids) for r in requests], device=self.device)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+
+        output = self.model(
+            input_ids=input_ids, attention_mask=mask, position_ids=position_ids,
+            past_key_values=DynamicCache(), use_cache=True, **self._adapter_kwargs(requests)
+        )
+        self.prefills += 1
+        self.prefill_tokens += sum(len(r.prompt_ids) for r in requests)
+
+        self._merge(cache_layers(output.past_key_values), mask)
+        self.running.extend(requests)
+        for request, token in zip(requests, self._sample(output.logits[:, -1, :], requests)):
+            self._append(request, token)
+
+    def _merge(self, layers: List[Tuple["torch.Tensor", "torch.Tensor"]], mask: "torch.Tensor"):
+        """Add newly prefilled rows to the running batch, aligned on the right"""
+        if self._cache is None:
+            self._cache = build_cache(layers)
+            self._attention_mask = mask
+            return
+
+        length = max(self._attention_mask.shape[1], mask.shape[1])
+        merged = [
+            (torch.cat([left_pad(k_old, length, -2), left_pad(k_new, length, -2)]),
+             torch.cat([left_pad(v_old, length, -2), left_pad(v_new, length, -2)]))
+            for (k_old, v_old), (k_new, v_new) in zip(cache_layers(self._cache), layers)
+        ]
+        self._cache = build_cache(merged)
+        self._attention_mask = torch.cat([left_pad(self._attention_mask, length, -1), left_pad(mask, length, -1)])
+
+    def _decode(self):
+        input_ids = torch.tensor([[r.next_token] for r in self.running], device=self.device)
+        mask = torch.cat([self._attention_mask, self._attention_mask.new_ones((len(self.running), 1))], dim=1)
+        position_ids = mask.sum(dim=1, keepdim=True) - 1
+
+        output = self.model(
+            input_ids=input_ids, attention_mask=mask, position_ids=position_ids,
+            past_key_values=self._cache, use_cache=True, **self._adapter_kwargs(self.running)
+        )
+        self._cache = output.past_key_values
+        self._attention_mask = mask
+        self.steps += 1
+        self.decode_rows += len(self.running)
+
+        for request, token in zip(self.running, self._sample(output.logits[:, -1, :], self.running)):
+            self._append(request, token)
+
+    def _retire(self):
+        keep = [i for i, r in enumerate(self.running) if not r.finished]
+        if len(keep) == len(self.running):
+            return
+
+        for request in self.running:
+            if request.finished:
+                self.completed += 1
+                if request.finish_reason != "cancelled":
+                    request.emit("done", request.finish_reason)
+
+        self.running = [self.running[i] for i in keep]
+        if not keep:
+            self._cache = None
+            self._attention_mask = None
+            return
+
+        mask = self._attention_mask[keep]
+        # Drop columns that are padding for every remaining row
+        start = int((mask.sum(dim=0) > 0).nonzero()[0])
+        index = torch.tensor(keep, device=self.device)
+        self._cache = build_cache([(k[index, :, start:], v[index, :, start:]) for k, v in cache_layers(self._cache)])
+        self._attention_mask = mask[:, start:]
+
+    def _sample(self, logits: "torch.Tensor", requests: List[GenerationRequest]) -> List[int]:
+        logits = logits.float()
+        tokens = []
+        for row, request in zip(logits, requests):
+            if request.ignore_eos and self.eos_token_id is not None:
+                row[self.eos_token_id] = float("-inf")
+            if request.temperature <= 0:
+                tokens.append(int(row.argmax()))
+                continue
+            probs = torch.softmax(row / request.temperature, dim=-1)
+            if request.top_p < 1.0:
+                sorted_probs, sorted_ids = probs.sort(descending=True)
+                outside = sorted_probs.cumsum(-1) - sorted_probs > request.top_p
+                sorted_probs[outside] = 0
+                probs = torch.zeros_like(probs).scatter_(0, sorted_ids, sorted_probs)
+            tokens.append(int(torch.multinomial(probs, 1)))
+        return tokens
+
+    def _append(self, request: GenerationRequest, token: int):
+        if request.finished:
+            return
+        if request.first_token_at is None:
+            request.first_token_at = time.perf_counter()
+
+        if token == self.eos_token_id and not request.ignore_eos:
+            request.finish_reason = "stop"
+            request.text += self._new_text(request, final=True)
+        else:
+            request.output_ids.append(token)
+            request.next_token = token
+            self.generated_tokens += 1
+            at_limit = (len(request.output_ids) >= request.max_tokens
+                        or len(request.prompt_ids) + len(request.output_ids) >= self.context_tokens)
+            start = len(request.text)
+            request.text += self._new_text(request, final=at_limit)
+            for stop in request.stop:
+                # Only the new text (plus a stop's worth before it) can hold a new match
+                index = request.text.find(stop, max(0, start - len(stop) + 1))
+                if index >= 0:
+                    request.text = request.text[:index]
+                    request.finish_reason = "stop"
+            if request.finish_reason is None and at_limit:
+                request.finish_reason = "length"
+
+        # Hold back text that could still turn into a stop sequence
+        end = len(request.text)
+        if not request.finished:
+            end -= max((len(stop) - 1 for stop in request.stop), default=0)
+        if end > request.sent:
+            request.emit("token", request.text[request.sent:end])
+            request.sent = end
+
+    def _new_text(self, request: GenerationRequest, final: bool = False) -> str:
+        """Text added by tokens not yet detokenized, decoding only a short window
+
+        The window starts a few tokens back so tokenizers that drop or add
+        leading spaces see the same context as a full decode. Text ending in
+        an incomplete UTF-8 sequence waits for the next token, unless final.
+        """
+        ids = request.output_ids
+        prefix = self.tokenizer.decode(ids[request.prefix_offset:request.read_offset], skip_special_tokens=True)
+        text = self.tokenizer.decode(ids[request.prefix_offset:], skip_special_tokens=True)
+        if len(text) <= len(prefix) or (text.endswith("\ufffd") and not final):
+            return ""
+        request.prefix_offset = request.read_offset
+        request.read_offset = len(ids)
+        return text[len(prefix):]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.base_model,
+            "adapter": self.adapter_path,
+            "max_batch_size": self.max_batch_size,
+            "running": len(self.running),
+            "waiting": len(self._waiting),
+            "decode_steps": self.steps,
+            "avg_decode_batch": round(self.decode_rows / self.steps, 2) if self.steps else 0.0,
+            "prefills": self.prefills,
+            "prefill_tokens": self.prefill_tokens,
+            "generated_tokens": self.generated_tokens,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "adapters": self.adapters.stats()
+        }
+
+def nearest_centroid(vectors: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+    """Index of the highest inner-product centroid for each vector"""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block):
+        assignment[start:start + block] = np.argmax(np.asarray(vectors[start:start + block]) @ centroids.T, axis=1)
+    return assignment
+
+def spherical_kmeans(vectors: np.ndarray, clusters: int, iterations: int = 10, sample_size: int = 65536, seed: int = 0) -> np.ndarray:
+    """Unit-norm k-means centroids for cosine similarity, fitted on a sample"""
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(len(vectors), max(sample_size, clusters)), replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroid(sample, centroids)
+        counts = np.bincount(assignment, minlength=clusters)
+        order = np.argsort(assignment, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+        # Empty clusters restart from random sample points
+        sums[~filled] = sample[rng.choice(len(sample), int((~filled).sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first"""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+class VectorIndex:
+    """Inverted-file (IVF) index over unit-norm vectors, searched by inner product
+
+    Vectors are grouped by their nearest k-means centroid and stored
+    contiguously per list, so a query scores the centroids and then only the
+    vectors of the nprobe closest lists. Saved indexes are plain .npy files
+    opened memory-mapped: loading is instant and pages are read on first
+    touch. Each vector carries a chunk dict with the fields rag.service's
+    formatDoc reads (filePath, declarationName, startLine, endLine,
+    pageContent); chunks live in a JSONL file and are parsed only for hits.
+    In memory a chunk may also be its already-encoded JSONL line, which is
+    how update() carries unchanged chunks over without parsing them.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, vectors: np.ndarray, centroids: np.ndarray, list_offsets: np.ndarray, ids: np.ndarray,
+                 chunks: Optional[List[Dict[str, Any]]] = None, chunk_bytes: Optional[np.ndarray] = None,
+                 chunk_offsets: Optional[np.ndarray] = None, nprobe: int = 8, path: Optional[str] = None):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.ids = ids
+        self.nprobe = nprobe
+        self.path = path
+        self._chunks = chunks
+        self._chunk_bytes = chunk_bytes
+        self._chunk_offsets = chunk_offsets
+        # Row of each original id, for chunk lookups by id
+        self._rows = np.empty(len(ids), dtype=np.int64)
+        self._rows[ids] = np.arange(len(ids))
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def dimension(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, chunks: List[Dict[str, Any]], nlist: Optional[int] = None,
+              centroids: Optional[np.ndarray] = None, nprobe: int = 8, seed: int = 0) -> "VectorIndex":
+        """Cluster and lay out vectors; chunks[i] describes vectors[i] and i becomes its id
+
+        Pass the centroids of a previous index to skip k-means when the
+        data has only changed a little.
+        """
+        if len(vectors) == 0:
+            raise ValueError("cannot build an index without vectors")
+        if len(vectors) != len(chunks):
+            raise ValueError(f"{len(vectors)} vectors but {len(chunks)} chunks")
+
+        vectors = normalize_rows(vectors)
+        if centroids is None:
+            # ~4*sqrt(n) lists keeps both the centroid scan and the lists short
+            nlist = min(len(vectors), nlist or max(1, int(4 * np.sqrt(len(vectors)))))
+            centroids = spherical_kmeans(vectors, nlist, seed=seed)
+        centroids = np.asarray(centroids, dtype=np.float32)
+
+        assignment = nearest_centroid(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=len(centroids))))).astype(np.int64)
+        return cls(np.ascontiguousarray(vectors[order]), centroids, list_offsets, order.astype(np.int64),
+                   chunks=[chunks[i] for i in order], nprobe=nprobe)
+
+    @classmethod
+    def update(cls, previous: "VectorIndex", keep_ids: np.ndarray, vectors: np.ndarray, chunks: List[Dict[str, Any]]) -> "VectorIndex":
+        """New index with previous's keep_ids (sorted) followed by the new vectors
+
+        Kept vectors stay in their lists and new ones join the nearest of
+        the previous centroids, so nothing is re-clustered. Kept chunks get
+        ids 0..len(keep_ids)-1 in keep_ids order; new ones follow.
+        """
+        keep_ids = np.asarray(keep_ids, dtype=np.int64)
+        if len(keep_ids) + len(vectors) == 0:
+            raise ValueError("cannot build an index without vectors")
+        # Walking kept rows in storage order keeps their list ids sorted
+        rows = np.sort(previous._rows[keep_ids])
+        row_lists = np.repeat(np.arange(previous.nlist), np.diff(previous.list_offsets))
+        vectors = normalize_rows(vectors).reshape(-1, previous.dimension)
+        lists = np.concatenate((row_lists[rows], nearest_centroid(vectors, previous.centroids)))
+        ids = np.concatenate((np.searchsorted(keep_ids, previous.ids[rows]), len(keep_ids) + np.arange(len(vectors))))
+
+        order = np.argsort(lists, kind="stable")
+        stored = np.concatenate((np.asarray(previous.vectors[rows]) if len(rows) else np.empty((0, previous.dimension), np.float32), vectors))
+        lines = previous.chunk_lines(rows) + list(chunks)
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=previous.nlist)))).astype(np.int64)
+        return cls(np.ascontiguousarray(stored[order]), previous.centroids, list_offsets, ids[order].astype(np.int64),
+                   chunks=[lines[i] for i in order], nprobe=previous.nprobe)
+
+    def save(self, path: str):
+        """Write the index directory (atomically replacing an existing one)"""
+        staging = f"{path.rstrip(os.sep)}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        np.save(os.path.join(staging, "vectors.npy"), np.asarray(self.vectors))
+        np.save(os.path.join(staging, "centroids.npy"), self.centroids)
+        np.save(os.path.join(staging, "list_offsets.npy"), np.asarray(self.list_offsets))
+        np.save(os.path.join(staging, "ids.npy"), np.asarray(self.ids))
+
+        lines = self.chunk_lines(np.arange(len(self)))
+        with open(os.path.join(staging, "chunks.jsonl"), "wb") as f:
+            f.write(b"".join(lines))
+        offsets = np.concatenate(([0], np.cumsum([len(line) for line in lines]))).astype(np.int64)
+        np.save(os.path.join(staging, "chunk_offsets.npy"), offsets)
+
+        with open(os.path.join(staging, self.MANIFEST), "w") as f:
+            json.dump({
+                "format": "ivf-flat",
+                "metric": "inner_product",
+                "count": len(self),
+                "dimension": self.dimension,
+                "nlist": self.nlist,
+                "nprobe": self.nprobe,
+                "created": int(time.time())
+            }, f, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(staging, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """Open a saved index memory-mapped"""
+        with open(os.path.join(path, cls.MANIFEST)) as f:
+            manifest = json.load(f)
+        mapped = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        return cls(
+            mapped("vectors.npy"), np.load(os.path.join(path, "centroids.npy")), np.load(os.path.join(path, "list_offsets.npy")),
+            np.load(os.path.join(path, "ids.npy")), chunk_bytes=np.memmap(os.path.join(path, "chunks.jsonl"), dtype=np.uint8, mode="r"),
+            chunk_offsets=mapped("chunk_offsets.npy"), nprobe=manifest.get("nprobe", 8), path=path
+        )
+
+    def chunk_line(self, row: int) -> bytes:
+        """The chunk stored at row as its JSONL line"""
+        if self._chunks is None:
+            return self._chunk_bytes[self._chunk_offsets[row]:self._chunk_offsets[row + 1]].tobytes()
+        chunk = self._chunks[row]
+        return chunk if isinstance(chunk, bytes) else (json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def chunk_lines(self, rows: np.ndarray) -> List[bytes]:
+        """chunk_line() for many rows, reading the mapped chunk file once"""
+        if self._chunks is not None:
+            return [self.chunk_line(row) for row in rows]
+        blob = self._chunk_bytes.tobytes()
+        offsets = self._chunk_offsets
+        starts, ends = offsets[rows].tolist(), offsets[np.asarray(rows) + 1].tolist()
+        return [blob[start:end] for start, end in zip(starts, ends)]
+
+    def chunk_at(self, row: int) -> Dict[str, Any]:
+        if self._chunks is not None and isinstance(self._chunks[row], dict):
+            return self._chunks[row]
+        return json.loads(self.chunk_line(row))
+
+    def chunk(self, id: int) -> Dict[str, Any]:
+        return self.chunk_at(int(self._rows[id]))
+
+    def vector(self, id: int) -> np.ndarray:
+        return np.asarray(self.vectors[self._rows[id]])
+
+    def search_ids(self, query: np.ndarray, k: int = 8, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """(id, score) of the approximate top k"""
+        query = normalize_rows(query).ravel()
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        lists = top_k(self.centroids @ query, nprobe)
+
+        rows, scores = [], []
+        for list_id in lists:
+            start, end = int(self.list_offsets[list_id]), int(self.list_offsets[list_id + 1])
+            if end > start:
+                rows.append(np.arange(start, end))
+                scores.append(self.vectors[start:end] @ query)
+        if not rows:
+            return []
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in top_k(scores, k)]
+
+    def search_exact(self, query: np.ndarray, k: int = 8) -> List[Tuple[int, float]]:
+        """Brute-force top k over every vector (the recall reference)"""
+        query = normalize_rows(query).ravel()
+        scores = np.asarray(self.vectors) @ query
+        return [(int(self.ids[i]), float(scores[i])) for i in top_k(scores, k)]
+
+    def search(self, query: np.ndarray, k: int = 8, nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Top k hits with their chunk metadata"""
+        return [{"id": id, "score": score, "chunk": self.chunk(id)} for id, score in self.search_ids(query, k, nprobe)]
+
+class IndexStore:
+    """Index namespaces on disk, one per repo and commit
+
+    index_class is VectorIndex or HybridIndex (anything with save(path),
+    load(path) and a MANIFEST file name).
+    Layout is <root>/<repo>/<commit>/ (names URL-quoted). Each commit's
+    index is immutable once saved; a LATEST file in the repo directory names
+    the commit searched when none is given. Opened indexes stay mapped, up
+    to max_open of them (least recently used are dropped).
+    """
+
+    LATEST = "LATEST"
+
+    def __init__(self, root: str, max_open: int = 16, index_class: type = None):
+        self.root = root
+        self.max_open = max(1, max_open)
+        self.index_class = index_class or VectorIndex
+        self._open: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        if not name or name in (".", ".."):
+            raise ValueError(f"invalid namespace name: {name!r}")
+        return quote(name, safe="")
+
+    def path(self, repo: str, commit: Optional[str] = None) -> str:
+        repo_dir = os.path.join(self.root, self._quote(repo))
+        return repo_dir if commit is None else os.path.join(repo_dir, self._quote(commit))
+
+    def save(self, repo: str, commit: str, index, latest: bool = True):
+        index.save(self.path(repo, commit))
+        with self._lock:
+            self._open.pop((repo, commit), None)
+        if latest:
+            with open(os.path.join(self.path(repo), self.LATEST), "w") as f:
+                f.write(commit)
+
+    def latest(self, repo: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path(repo), self.LATEST)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def open(self, repo: str, commit: Optional[str] = None):
+        """Mapped index for repo at commit (default: latest); KeyError if missing"""
+        commit = commit or self.latest(repo)
+        if commit is None:
+            raise KeyError(repo)
+        key = (repo, commit)
+        with self._lock:
+            if key in self._open:
+                self._open.move_to_end(key)
+                return self._open[key]
+        path = self.path(repo, commit)
+        if not os.path.exists(os.path.join(path, self.index_class.MANIFEST)):
+            raise KeyError(f"{repo}@{commit}")
+        index = self.index_class.load(path)
+        with self._lock:
+            self._open[key] = index
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return index
+
+    def repos(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(unquote(name) for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def commits(self, repo: str) -> List[str]:
+        repo_dir = self.path(repo)
+        if not os.path.isdir(repo_dir):
+            return []
+        return sorted(
+            unquote(name) for name in os.listdir(repo_dir)
+            if os.path.exists(os.path.join(repo_dir, name, self.index_class.MANIFEST))
+        )
+
+    def delete(self, repo: str, commit: Optional[str] = None):
+        """Remove one commit's index, or the whole repo when commit is None"""
+        with self._lock:
+            for key in [key for key in self._open if key[0] == repo and commit in (None, key[1])]:
+                del self._open[key]
+        shutil.rmtree(self.path(repo, commit), ignore_errors=True)
+        if commit is not None and self.latest(repo) == commit:
+            os.remove(os.path.join(self.path(repo), self.LATEST))
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]*|\d+")
+SUBWORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+def code_tokens(text: str) -> List[str]:
+    """Lowercased identifiers plus their camelCase/snake_case parts
+
+    "handleSubmit" gives handlesubmit, handle, submit: the whole identifier
+    matches exactly and the parts still match natural-language queries.
+    """
+    tokens = []
+    for word in IDENTIFIER_PATTERN.findall(text):
+        tokens.append(word.lower())
+        parts = SUBWORD_PATTERN.findall(word)
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+    return tokens
+
+class BM25Index:
+    """Inverted BM25 index over code tokens, stored as term-major CSR arrays
+
+    Postings for term t are posting_docs/posting_tfs[term_offsets[t]:term_offsets[t + 1]],
+    with doc ids ascending. Saved as .npy files opened memory-mapped plus a
+    JSON vocabulary.
+    """
+
+    MANIFEST = "bm25.json"
+
+    def __init__(self, vocab: List[str], term_offsets: np.ndarray, posting_docs: np.ndarray, posting_tfs: np.ndarray,
+                 doc_lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.vocab = vocab
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        self.term_offsets = term_offsets
+        self.posting_docs = posting_docs
+        self.posting_tfs = posting_tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(np.mean(doc_lengths)) if len(doc_lengths) else 0.0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @staticmethod
+    def _postings(texts: List[str], term_ids: Dict[str, int], vocab: List[str], first_doc: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(terms, docs, tfs, doc lengths) for texts, adding new terms to vocab"""
+        terms, docs, tfs, lengths = [], [], [], []
+        for doc, text in enumerate(texts, start=first_doc):
+            counts: Dict[int, int] = {}
+            tokens = code_tokens(text)
+            for token in tokens:
+                term = term_ids.get(token)
+                if term is None:
+                    term = term_ids[token] = len(vocab)
+                    vocab.append(token)
+                counts[term] = counts.get(term, 0) + 1
+            terms.extend(counts)
+            tfs.extend(counts.values())
+            docs.extend([doc] * len(counts))
+            lengths.append(len(tokens))
+        return (np.asarray(terms, dtype=np.int64), np.asarray(docs, dtype=np.int64),
+                np.asarray(tfs, dtype=np.int32), np.asarray(lengths, dtype=np.int32))
+
+    @classmethod
+    def _from_postings(cls, vocab: List[str], terms: np.ndarray, docs: np.ndarray, tfs: np.ndarray, doc_lengths: np.ndarray) -> "BM25Index":
+        order = np.argsort(terms, kind="stable")
+        term_offsets = np.concatenate(([0], np.cumsum(np.bincount(terms, minlength=len(vocab))))).astype(np.int64)
+        return cls(vocab, term_offsets, docs[order].astype(np.int32), tfs[order], doc_lengths)
+
+    @classmethod
+    def build(cls, texts: List[str]) -> "BM25Index":
+        vocab: List[str] = []
+        terms, docs, tfs, lengths = cls._postings(texts, {}, vocab, 0)
+        return cls._from_postings(vocab, terms, docs, tfs, lengths)
+
+    @classmethod
+    def update(cls, previous: "BM25Index", keep_ids: np.ndarray, texts: List[str]) -> "BM25Index":
+        """New index with previous's keep_ids (sorted, renumbered from 0) followed by texts
+
+        Kept postings are filtered and renumbered in place; only the new
+        texts are tokenized. Both runs are already sorted by term, so the
+        stable sort that merges them is linear.
+        """
+        keep_ids = np.asarray(keep_ids, dtype=np.int64)
+        keep = np.zeros(len(previous), dtype=bool)
+        keep[keep_ids] = True
+        posting_terms = np.repeat(np.arange(len(previous.vocab)), np.diff(previous.term_offsets))
+        posting_docs = np.asarray(previous.posting_docs)
+        mask = keep[posting_docs]
+
+        vocab = list(previous.vocab)
+        terms, docs, tfs, lengths = cls._postings(texts, dict(previous.term_ids), vocab, len(keep_ids))
+        return cls._from_postings(
+            vocab,
+            np.concatenate((posting_terms[mask], terms)),
+            np.concatenate((np.searchsorted(keep_ids, posting_docs[mask]), docs)),
+            np.concatenate((np.asarray(previous.posting_tfs)[mask], tfs)),
+            np.concatenate((np.asarray(previous.doc_lengths)[keep_ids], lengths))
+        )
+
+    def search_ids(self, query: str, k: int = 8) -> List[Tuple[int, float]]:
+        """(id, score) of the top k by BM25"""
+        n = len(self)
+        docs, weights = [], []
+        for token in set(code_tokens(query)):
+            term = self.term_ids.get(token)
+            if term is None:
+                continue
+            start, end = self.term_offsets[term], self.term_offsets[term + 1]
+            if end == start:
+                continue
+            matched = np.asarray(self.posting_docs[start:end])
+            tf = np.asarray(self.posting_tfs[start:end], dtype=np.float32)
+            idf = np.log(1 + (n - (end - start) + 0.5) / ((end - start) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * np.asarray(self.doc_lengths)[matched] / max(self.avg_length, 1e-9))
+            docs.append(matched)
+            weights.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not docs:
+            return []
+        scores = np.bincount(np.concatenate(docs), weights=np.concatenate(weights), minlength=n)
+        matched = np.flatnonzero(scores)
+        return [(int(matched[i]), float(scores[matched[i]])) for i in top_k(scores[matched], k)]
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "term_offsets.npy"), np.asarray(self.term_offsets))
+        np.save(os.path.join(path, "posting_docs.npy"), np.asarray(self.posting_docs))
+        np.save(os.path.join(path, "posting_tfs.npy"), np.asarray(self.posting_tfs))
+        np.save(os.path.join(path, "doc_lengths.npy"), np.asarray(self.doc_lengths))
+        with open(os.path.join(path, "vocab.json"), "w") as f:
+            # json.dumps uses the C encoder; json.dump streams through Python
+            f.write(json.dumps(self.vocab, ensure_ascii=False))
+        with open(os.path.join(path, self.MANIFEST), "w") as f:
+            json.dump({"format": "bm25-csr", "documents": len(self), "terms": len(self.vocab), "k1": self.k1, "b": self.b}, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(os.path.join(path, cls.MANIFEST)) as f:
+            manifest = json.load(f)
+        with open(os.path.join(path, "vocab.json")) as f:
+            vocab = json.load(f)
+        mapped = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        return cls(vocab, np.load(os.path.join(path, "term_offsets.npy")), mapped("posting_docs.npy"), mapped("posting_tfs.npy"),
+                   np.load(os.path.join(path, "doc_lengths.npy")), manifest["k1"], manifest["b"])
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists: score(id) = sum of 1 / (k + rank), rank from 1"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+class HybridIndex:
+    """Dense VectorIndex and BM25Index over the same chunks
+
+    Dense search finds paraphrases; BM25 finds exact identifiers such as
+    handleSubmit. Their rankings are fused with reciprocal-rank fusion.
+    update() derives the next commit's index from this one by file: chunks
+    of changed or deleted files are dropped, new chunks appended, and
+    nothing else is re-embedded, re-tokenized or re-clustered.
+    """
+
+    MANIFEST = "hybrid.json"
+
+    def __init__(self, dense: VectorIndex, sparse: BM25Index, files: List[str], doc_files: np.ndarray, path: Optional[str] = None):
+        self.dense = dense
+        self.sparse = sparse
+        self.files = files
+        self.doc_files = doc_files
+        self.path = path
+
+    def __len__(self) -> int:
+        return len(self.dense)
+
+    @staticmethod
+    def chunk_text(chunk: Dict[str, Any]) -> str:
+        return " ".join(str(chunk.get(field) or "") for field in ("filePath", "declarationName", "pageContent"))
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, chunks: List[Dict[str, Any]], nlist: Optional[int] = None) -> "HybridIndex":
+        files = sorted({chunk["filePath"] for chunk in chunks})
+        file_ids = {path: i for i, path in enumerate(files)}
+        doc_files = np.asarray([file_ids[chunk["filePath"]] for chunk in chunks], dtype=np.int32)
+        return cls(VectorIndex.build(vectors, chunks, nlist=nlist), BM25Index.build([cls.chunk_text(c) for c in chunks]), files, doc_files)
+
+    def update(self, replaced_files: List[str], vectors: np.ndarray, chunks: List[Dict[str, Any]]) -> "HybridIndex":
+        """Index for the next commit
+
+        replaced_files are the changed and deleted paths; their old chunks
+        are dropped and chunks (with vectors) are the new chunks of the
+        changed and added files.
+        """
+        file_ids = {path: i for i, path in enumerate(self.files)}
+        replaced = [file_ids[path] for path in replaced_files if path in file_ids]
+        keep_ids = np.flatnonzero(~np.isin(np.asarray(self.doc_files), replaced))
+
+        files = list(self.files)
+        new_doc_files = []
+        for chunk in chunks:
+            if chunk["filePath"] not in file_ids:
+                file_ids[chunk["filePath"]] = len(files)
+                files.append(chunk["filePath"])
+            new_doc_files.append(file_ids[chunk["filePath"]])
+
+        return HybridIndex(
+            VectorIndex.update(self.dense, keep_ids, vectors, chunks),
+            BM25Index.update(self.sparse, keep_ids, [self.chunk_text(c) for c in chunks]),
+            files,
+            np.concatenate((np.asarray(self.doc_files)[keep_ids], np.asarray(new_doc_files, dtype=np.int32)))
+        )
+
+    def save(self, path: str):
+        """Write the index directory (atomically replacing an existing one)"""
+        staging = f"{path.rstrip(os.sep)}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        self.dense.save(os.path.join(staging, "dense"))
+        self.sparse.save(os.path.join(staging, "bm25"))
+        np.save(os.path.join(staging, "doc_files.npy"), np.asarray(self.doc_files))
+        with open(os.path.join(staging, "files.json"), "w") as f:
+            f.write(json.dumps(self.files, ensure_ascii=False))
+        with open(os.path.join(staging, self.MANIFEST), "w") as f:
+            json.dump({"format": "hybrid", "count": len(self), "files": len(self.files), "created": int(time.time())}, f, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(staging, path)
+        self.path = path
+        self.dense.path = os.path.join(path, "dense")
+
+    @classmethod
+    def load(cls, path: str) -> "HybridIndex":
+        with open(os.path.join(path, "files.json")) as f:
+            files = json.load(f)
+        return cls(VectorIndex.load(os.path.join(path, "dense")), BM25Index.load(os.path.join(path, "bm25")),
+                   files, np.load(os.path.join(path, "doc_files.npy")), path)
+
+    def search(self, query: str, query_vector: Optional[np.ndarray] = None, k: int = 8, mode: str = "hybrid",
+               candidates: int = 50, nprobe: Optional[int] = None, rrf_k: int = 60) -> List[Dict[str, Any]]:
+        """Top k chunks; mode is "hybrid", "dense" or "bm25" (dense modes need query_vector)"""
+        dense = self.dense.search_ids(query_vector, max(k, candidates), nprobe) if mode in ("hybrid", "dense") else []
+        sparse = self.sparse.search_ids(query, max(k, candidates)) if mode in ("hybrid", "bm25") else []
+        dense_ranks = {id: rank for rank, (id, _) in enumerate(dense, start=1)}
+        sparse_ranks = {id: rank for rank, (id, _) in enumerate(sparse, start=1)}
+        fused = reciprocal_rank_fusion([[id for id, _ in dense], [id for id, _ in sparse]], rrf_k)[:k]
+        return [
+            {"id": id, "score": score, "dense_rank": dense_ranks.get(id), "bm25_rank": sparse_ranks.get(id), "chunk": self.dense.chunk(id)}
+            for id, score in fused
+        ]